@@ -8,8 +8,9 @@ from models import (
     AccountDetailsDTO, AccountInfoDTO, AccountPermissions, BriefAccountInfoDTO, 
     LedgerDTO, LedgerEntry, OwnerInfoDTO, PermissionsDTO
 )
-from cache import cached, account_specific_key_builder
+from cache import Uncacheable, cached, account_specific_key_builder, account_tags, invalidate_tags
 from utils import calculate_days_to_expiry
+from position_book import PositionBook
 from prot import ServiceProtocol
 
 
@@ -26,8 +27,23 @@ class AccountMixin:
             all_positions.extend(pos_page)
             page_id += 1
         self.state.positions[account_id] = all_positions
+        self.state.position_books[account_id] = PositionBook(all_positions)
+        await self.symbols.add_positions(account_id, all_positions)
         return all_positions
 
+    async def invalidate_account(self: ServiceProtocol, account_id: Optional[str] = None) -> None:
+        """
+        Drop everything cached about an account's positions and cash after a
+        trade (order routes, fills on the 'sor' stream). Without an id, the
+        account the WebSocket is streaming for is used.
+        """
+        account_id = account_id or self._current_ws_account
+        if not account_id:
+            return
+        self.state.positions.pop(account_id, None)
+        self.state.position_books.pop(account_id, None)
+        await invalidate_tags(f"account:{account_id}:positions", f"account:{account_id}:cash")
+
     async def get_position_by_conid(self: ServiceProtocol, account_id: str, conid: int) -> Optional[dict]:
         account_positions = self.state.positions.get(account_id)
         if account_positions is None:
@@ -52,7 +68,7 @@ class AccountMixin:
             return []
         return [BriefAccountInfoDTO.model_validate(acc) for acc in raw_accounts]
 
-    @cached(ttl=1200, key_builder=account_specific_key_builder)
+    @cached(ttl=1200, key_builder=account_specific_key_builder, model=AccountPermissions)
     async def get_account_permissions(self: ServiceProtocol, account_id: str) -> AccountPermissions:
         """
         Fetches and parses trading permissions for a specific account.
@@ -86,12 +102,13 @@ class AccountMixin:
             )
         except Exception as e:
             log.exception(f"Failed to parse account permissions for {account_id}: {e}")
-            return AccountPermissions(
+            # Served for this request only; the next one asks the gateway again
+            raise Uncacheable(AccountPermissions(
                 canTrade=False, allowOptionsTrading=False, allowCryptoTrading=False,
                 isMarginAccount=False, supportsFractions=False
-            )
+            ))
     
-    @cached(ttl=120, key_builder=account_specific_key_builder) 
+    @cached(ttl=120, key_builder=account_specific_key_builder, tags=account_tags("positions", "cash"))
     async def get_account_summary(self: ServiceProtocol, account_id: str) -> Dict[str, Any]:
         """ Fetches account summary details like cash, net liquidation value, etc. """
         try:
@@ -113,6 +130,7 @@ class AccountMixin:
             log.exception(f"Failed to fetch partitioned PnL: {e}")
             return {} # Return an empty dict on failure
     
+    @cached(ttl=1200, key_builder=account_specific_key_builder, model=AccountDetailsDTO)
     async def get_account_details(self: ServiceProtocol, accountId: str ) -> AccountDetailsDTO:
         """Fetch complete account details from multiple endpoints"""
         # Run all three API calls concurrently
@@ -185,11 +203,15 @@ class AccountMixin:
                 supportsFractions=acct_props.get("supportsFractions", False)
             )
 
-        return AccountDetailsDTO(
+        details = AccountDetailsDTO(
             owner=owner_info,
             account=account_info,
             permissions=permissions
         )
+        if any(isinstance(r, Exception) for r in results):
+            # Placeholders for the failed parts are served for this request only
+            raise Uncacheable(details)
+        return details
     
     async def account_performance(self: ServiceProtocol, accountId: str, period: str = "1Y") -> list[dict]:
         """
@@ -229,25 +251,28 @@ class AccountMixin:
         
         return watchlists
 
-    @cached(ttl=1500, key_builder=account_specific_key_builder)
+    @cached(ttl=1500, key_builder=account_specific_key_builder, stale_ttl=3600, tags=account_tags("positions"))
     async def account_allocation(self: ServiceProtocol, account_id: str):
         data = await self._req("GET", f"/portfolio/{account_id}/allocation")
         self.state.allocation = data
         return data
 
-    @cached(ttl=300, key_builder=account_specific_key_builder)
+    @cached(ttl=300, key_builder=account_specific_key_builder, tags=account_tags("positions"))
     async def combo_positions(self: ServiceProtocol, acct: str | None = None, nocache: bool = False):
         params = {"nocache": str(nocache).lower()}
         return await self._req("GET", f"/portfolio/{acct}/combo/positions", params=params)
 
-    @cached(ttl=300, key_builder=account_specific_key_builder)
+    @cached(ttl=300, key_builder=account_specific_key_builder, stale_ttl=900, model=LedgerDTO,
+            tags=account_tags("cash"))
     async def ledger(self: ServiceProtocol, account_id: str) -> LedgerDTO:
         raw_data: Dict[str, Dict[str, Any]] = await self._req("GET", f"/portfolio/{account_id}/ledger")
         
         base_currency_entry = raw_data.get("BASE", {})
         base_currency = base_currency_entry.get("currency") or base_currency_entry.get("secondkey")
+        partial = False
         
         if not base_currency or base_currency == "BASE":
+            partial = True
             log.warning(f"Could not conclusively determine base currency from IBKR ledger data for account {account_id}. Defaulting to USD.")
             base_currency = "USD"
 
@@ -263,9 +288,15 @@ class AccountMixin:
                 ledgers.append(LedgerEntry.model_validate(data_payload))
             except ValidationError as e:
                 log.error(f"Pydantic validation error for ledger entry '{currency_key}': {e}. Raw data: {data_payload}")
+                partial = True
                 continue
             except Exception as e:
                 log.error(f"Unexpected error processing ledger entry '{currency_key}': {e}. Raw data: {data_payload}")
+                partial = True
                 continue
 
-        return LedgerDTO(baseCurrency=base_currency, ledgers=ledgers)
\ No newline at end of file
+        result = LedgerDTO(baseCurrency=base_currency, ledgers=ledgers)
+        if partial:
+            # A guessed base currency or missing currencies shouldn't be served for the whole TTL
+            raise Uncacheable(result)
+        return result
\ No newline at end of file
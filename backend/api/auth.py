@@ -38,10 +38,16 @@ class AuthMixin:
         is_authenticated = status.get("authenticated", False)
         is_connected = status.get("connected", False)
         is_session_valid = is_authenticated and is_connected
+        # The auth status doubles as the circuit breaker's half-open health probe
+        self.breaker.record_probe(is_session_valid)
         
+        was_authenticated = self.state.ibkr_authenticated
         self.state.ibkr_authenticated = is_session_valid
         if not is_session_valid:
             self.state.ibkr_session_token = None
+        elif not was_authenticated:
+            # Fresh login: fill the cache while the user is still on the landing page
+            self.start_warmup(self._current_ws_account, trigger="auth")
 
         return AuthStatusDTO(
             authenticated=is_session_valid,
@@ -3,8 +3,12 @@ import logging
 import time
 import asyncio
 import httpx
-from cache import cached, account_specific_key_builder, option_key_builder, snapshot_key_builder, history_cache_key_builder
+from barstore import NoChartData
+from config import NEGATIVE_CACHE_TTL
+from cache import cached, option_key_builder, snapshot_key_builder
 from prot import ServiceProtocol
+from symbol_index import query_key
+from tracing import span
 
 
 log = logging.getLogger("ibkr.market")
@@ -19,33 +23,63 @@ class MarketDataMixin:
         log.info("Running IServer scanner with payload: %s", scanner_payload)
         return await self._req("POST", "/iserver/scanner/run", json=scanner_payload)
     
-    @cached(ttl=3600, key_builder=account_specific_key_builder)
-    async def get_conid(self: ServiceProtocol, symbol: str, sec_type: str = "STK") -> str | None:
+    async def get_conid(self: ServiceProtocol, symbol: str, sec_type: str = "STK") -> int | None:
+        # Not cached here: the symbol index remembers the gateway's answers per
+        # (symbol, sec_type), empty ones for NEGATIVE_CACHE_TTL, and failed lookups not at all
+        conid = self.symbols.conid_for(symbol, sec_type or "STK")
+        if conid is not None:
+            return conid
         try:
-            res = await self._req("GET", "/iserver/secdef/search", params={"symbol": symbol, "secType": sec_type})
-            return res[0]["conid"] if res else None
+            res = await self.search(symbol=symbol, secType=sec_type)
+            return int(res[0]["conid"]) if res else None
         except httpx.HTTPStatusError as exc:
             log.warning("secdef search failed %s %s", exc.response.status_code, symbol)
             return None
         
-    @cached(ttl=3600) 
     async def search(self: ServiceProtocol, symbol, name=False, secType=""):
+        # Answered from the symbol index when the gateway has been asked the same before
+        key = query_key(symbol, name, secType)
+        answer = self.symbols.gateway_answer(key)
+        if answer is not None:
+            return answer
         q = {"symbol": symbol}
         if name: q["name"] = str(name).lower()
         if secType: q["secType"] = secType
-        return await self._req("GET", "/iserver/secdef/search", params=q)
+        res = await self._req("GET", "/iserver/secdef/search", params=q)
+        if isinstance(res, list):
+            await self.symbols.add_secdef(res, query=key)
+        return res
+
+    async def search_symbols(self: ServiceProtocol, query: str, limit: int = 20) -> list:
+        """
+        Search-bar lookup: local prefix/fuzzy matches, plus the gateway's
+        answer for this query. The gateway is only called when the query is
+        new and nothing in the index matches the symbol exactly.
+        """
+        hits = self.symbols.search(query, limit)
+        answer = self.symbols.gateway_answer(query_key(query))
+        if answer is None and not any(h["exact"] for h in hits):
+            answer = await self.search(symbol=query)
+            hits = self.symbols.search(query, limit)
+        results = [{"conid": int(item["conid"]), "symbol": item.get("symbol"),
+                    "companyName": item.get("companyHeader"), "secType": item.get("secType")}
+                   for item in (answer if isinstance(answer, list) else [])
+                   if item.get("conid") and int(item["conid"]) != -1]
+        seen = {r["conid"] for r in results}
+        results.extend(h for h in hits if h["conid"] not in seen)
+        return results[:limit]
     
-    @cached(ttl=3600)
+    @cached(ttl=3600, negative_ttl=NEGATIVE_CACHE_TTL)
     async def search_detailed(self: ServiceProtocol, conid: int):
         response = await self._req("GET", f"/trsrv/secdef?conids={conid}")
         return response.get('secdef', [])[0] if response.get('secdef') else None
 
-    @cached(ttl=3600, key_builder=option_key_builder)
+    @cached(ttl=3600, key_builder=option_key_builder, negative_ttl=NEGATIVE_CACHE_TTL)
     async def get_strikes_for_month(self: ServiceProtocol, conid: int, month: str) -> dict:
         params = {"conid": conid, "secType": "OPT", "month": month}
         return await self._req("GET", "/iserver/secdef/strikes", params=params)
     
-    @cached(ttl=3600, key_builder=option_key_builder)
+    @cached(ttl=3600, key_builder=option_key_builder, negative_ttl=NEGATIVE_CACHE_TTL)
     async def get_contract_info(self: ServiceProtocol, conid: int, month: str, strike: float, right: str) -> list:
         params = {"conid": conid, "secType": "OPT", "month": month, "strike": strike, "right": right}
         return await self._req("GET", "/iserver/secdef/info", params=params)
@@ -66,22 +100,28 @@ class MarketDataMixin:
         requested_fields = fields.split(',')
         log.info(f"Starting snapshot poll for conids: {conids} with fields: {fields}")
 
+        iteration = 0
         while time.time() - start_time < timeout:
-            response = await self._req("GET", "/iserver/marketdata/snapshot", params=q)
-            if response and isinstance(response, list):
-                all_data_present = True
-                conids_in_response = {str(item.get('conid')) for item in response}
+            iteration += 1
+            with span("ibkr.snapshot.poll", **{"ibkr.snapshot.iteration": iteration,
+                                               "ibkr.snapshot.conids": q["conids"]}) as poll:
+                response = await self._req("GET", "/iserver/marketdata/snapshot", params=q)
+                all_data_present = False
+                if response and isinstance(response, list):
+                    all_data_present = True
+                    conids_in_response = {str(item.get('conid')) for item in response}
 
-                if not set(map(str, conids)).issubset(conids_in_response):
-                    all_data_present = False
-                else:
-                    for item in response:
-                        if not all(field in item for field in requested_fields):
-                            all_data_present = False
-                            break
-                if all_data_present:
-                    log.info(f"Successfully received complete snapshot for conids: {conids}")
-                    return response
+                    if not set(map(str, conids)).issubset(conids_in_response):
+                        all_data_present = False
+                    else:
+                        for item in response:
+                            if not all(field in item for field in requested_fields):
+                                all_data_present = False
+                                break
+                poll.set_attribute("ibkr.snapshot.complete", all_data_present)
+            if all_data_present:
+                log.info(f"Successfully received complete snapshot for conids: {conids}")
+                return response
 
             log.info(f"All requested fields not yet available. Retrying in {interval}s...")
             await asyncio.sleep(interval)
@@ -89,8 +129,19 @@ class MarketDataMixin:
         log.warning(f"Snapshot request for conids {conids} timed out after {timeout}s.")
         return response # Return whatever was last received
     
-    @cached(ttl=1500, key_builder=history_cache_key_builder)
     async def history(self:ServiceProtocol, conid, period="1w", bar="15min"):
-        await self.ensure_accounts()
-        q = {"conid": conid, "period": period, "bar": bar, "outsideRth": "true"}
-        return await self._req("GET", "/iserver/marketdata/history", params=q)
\ No newline at end of file
+        """
+        Bars in the gateway's response shape, served from the BarStore: only
+        bars it doesn't hold yet are fetched. `period` may also be "ytd".
+        """
+        async def fetch(gateway_period: str):
+            await self.ensure_accounts()
+            q = {"conid": conid, "period": gateway_period, "bar": bar, "outsideRth": "true"}
+            try:
+                return await self._req("GET", "/iserver/marketdata/history", params=q)
+            except httpx.HTTPStatusError as exc:
+                if exc.response.status_code == 500 and b"Chart data unavailable" in exc.response.content:
+                    raise NoChartData(f"Chart data unavailable for {conid}") from exc
+                raise
+
+        return await self.bars.history(conid, period, bar, fetch)
\ No newline at end of file
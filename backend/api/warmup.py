@@ -0,0 +1,114 @@
+# api/warmup.py
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from metrics import Counter, Histogram
+from prot import ServiceProtocol
+
+log = logging.getLogger("ibkr.warmup")
+
+WARMUP_STEP_SECONDS = Histogram("ibkr_warmup_step_seconds", "Duration of each cache warmup step", ("step", "result"))
+WARMUP_RUNS = Counter("ibkr_warmup_runs_total", "Cache warmup runs by trigger", ("trigger",))
+
+# What the dashboard paints first goes first. Every step goes through _req,
+# so the limiters pace the whole run like any other traffic.
+WARMUP_STEPS = (
+    ("positions",       lambda svc, acct: svc.positions(acct)),
+    ("allocation",      lambda svc, acct: svc.account_allocation(acct)),
+    ("ledger",          lambda svc, acct: svc.ledger(acct)),
+    ("summary",         lambda svc, acct: svc.get_account_summary(acct)),
+    ("permissions",     lambda svc, acct: svc.get_account_permissions(acct)),
+    ("account_details", lambda svc, acct: svc.get_account_details(acct)),
+)
+
+WARMUP_INTERVAL = 600  # don't re-warm the same account more often than this (s)
+
+
+def _is_warm(progress: Optional[Dict[str, Any]]) -> bool:
+    """A run is in progress, or finished cleanly within WARMUP_INTERVAL."""
+    if not progress:
+        return False
+    if progress["status"] == "running":
+        return True
+    return progress["status"] == "done" and time.time() - progress["finished_at"] < WARMUP_INTERVAL
+
+
+class WarmupMixin:
+    def start_warmup(self: ServiceProtocol, account_id: Optional[str] = None, trigger: str = "auth") -> None:
+        """
+        Prefetch an account's dashboard data into the cache in the background.
+        Without an id the session's selected account is resolved first. A run
+        already in progress, or one finished within WARMUP_INTERVAL, is reused.
+        """
+        key = account_id or "_selected"
+        task = self._warmup_tasks.get(key)
+        if task is not None and not task.done():
+            return
+        if account_id and _is_warm(self.state.warmup.get(account_id)):
+            return
+        WARMUP_RUNS.inc(trigger=trigger)
+        self._warmup_tasks[key] = asyncio.create_task(self._warmup(account_id), name=f"warmup-{key}")
+
+    async def _warmup(self: ServiceProtocol, account_id: Optional[str]) -> None:
+        if account_id is None:
+            try:
+                await self.ensure_accounts()
+                accounts = self.state.accounts_cache
+                if not isinstance(accounts, dict):  # /iserver/accounts answers with a dict
+                    return
+                account_id = accounts.get("selectedAccount") or next(iter(accounts.get("accounts") or []), None)
+            except Exception as e:
+                log.warning(f"Warmup could not resolve the selected account: {e}")
+                return
+            if not account_id:
+                return
+            if _is_warm(self.state.warmup.get(account_id)):
+                return
+
+        progress: Dict[str, Any] = {
+            "accountId": account_id,
+            "status": "running",
+            "total": len(WARMUP_STEPS),
+            "completed": [],
+            "failed": [],
+            "current": None,
+            "started_at": time.time(),
+            "finished_at": None,
+        }
+        self.state.warmup[account_id] = progress
+        log.info(f"Warming cache for account {account_id}")
+
+        for step, load in WARMUP_STEPS:
+            progress["current"] = step
+            started = time.perf_counter()
+            try:
+                await load(self, account_id)
+                progress["completed"].append(step)
+                result = "ok"
+            except asyncio.CancelledError:
+                progress["status"] = "cancelled"
+                raise
+            except Exception as e:
+                log.warning(f"Warmup step {step} for {account_id} failed: {e}")
+                progress["failed"].append(step)
+                result = "error"
+            WARMUP_STEP_SECONDS.observe(time.perf_counter() - started, step=step, result=result)
+            await self._report_warmup(progress)
+
+        progress["current"] = None
+        progress["status"] = "done" if not progress["failed"] else "partial"
+        progress["finished_at"] = time.time()
+        log.info(f"Cache warmup for {account_id} finished in "
+                 f"{progress['finished_at'] - progress['started_at']:.1f}s ({len(progress['failed'])} failed)")
+        await self._report_warmup(progress)
+
+    async def _report_warmup(self: ServiceProtocol, progress: Dict[str, Any]) -> None:
+        try:
+            await self._publish({"type": "warmup", "data": dict(progress)}, account_id=progress["accountId"])
+        except Exception as e:
+            log.debug(f"warmup progress broadcast failed: {e}")
+
+    def warmup_status(self: ServiceProtocol, account_id: str) -> Optional[Dict[str, Any]]:
+        return self.state.warmup.get(account_id)
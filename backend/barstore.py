@@ -0,0 +1,284 @@
+# barstore.py
+"""
+Incremental store for historical bars, one series per (conid, bar size).
+
+history() used to cache whole gateway responses per (conid, period, bar),
+so 3M/1d, 1Y/1d and YTD/1d were three fetches of overlapping data, each
+repeated in full after the TTL. Here every series:
+
+* merges bars by timestamp (newest version of a bar wins, so the still
+  forming last bar is updated in place),
+* only asks the gateway for the tail since its last bar once it is due for
+  a refresh,
+* answers any period it already covers by slicing – including "ytd",
+  which is never sent to the gateway,
+* keeps bars only as far back as the widest period it has been asked for,
+* remembers contracts the gateway has no chart data for (NoChartData)
+  for NEGATIVE_CACHE_TTL instead of asking again on every refresh.
+
+Series are also written to the shared cache backend (Redis when
+configured) so other workers and restarts start warm.
+"""
+import asyncio
+import bisect
+import datetime
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import cache as cache_mod
+from cache_codec import CodecError, decode, encode, resolve_codec
+from config import NEGATIVE_CACHE_TTL
+from metrics import Counter
+
+log = logging.getLogger("ibkr.bars")
+
+BAR_REQUESTS = Counter("ibkr_barstore_requests_total", "history() requests by how they were served", ("served",))
+
+_UNIT_SECONDS = {"min": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "m": 30 * 86400, "y": 365 * 86400}
+_DURATION = re.compile(r"^\s*(\d+)\s*(min|mins|h|d|w|m|y)\s*$", re.IGNORECASE)
+
+SERIES_TTL = 7 * 86400   # how long a persisted series survives without being touched
+MAX_SERIES = 500         # in-memory series, least recently used dropped first
+
+Fetch = Callable[[str], Awaitable[Dict[str, Any]]]   # period -> gateway history response
+
+
+class NoChartData(Exception):
+    """The gateway has no bars for this contract ("Chart data unavailable")."""
+
+
+def duration_seconds(spec: str) -> int:
+    """'15min' -> 900, '2h' -> 7200, '1m' -> 30 days, '5y' -> 5 * 365 days."""
+    m = _DURATION.match(spec)
+    if not m:
+        raise ValueError(f"Unsupported period/bar {spec!r}")
+    unit = m.group(2).lower()
+    return int(m.group(1)) * _UNIT_SECONDS["min" if unit.startswith("min") else unit]
+
+
+def period_start(period: str, now: float) -> float:
+    """Epoch seconds where `period` ending now begins; 'ytd' is 1 January (UTC)."""
+    if period.lower() == "ytd":
+        today = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+        return datetime.datetime(today.year, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+    return now - duration_seconds(period)
+
+
+def gateway_period(seconds: float, bar_s: int) -> str:
+    """Smallest period the gateway accepts that spans `seconds` at this bar size."""
+    if bar_s >= _UNIT_SECONDS["m"]:
+        return f"{min(182, math.ceil(seconds / _UNIT_SECONDS['m']))}m"
+    if bar_s >= _UNIT_SECONDS["w"]:
+        return f"{min(792, math.ceil(seconds / _UNIT_SECONDS['w']))}w"
+    if seconds <= 8 * 3600 and bar_s < 3600:
+        return f"{max(1, math.ceil(seconds / 3600))}h"
+    days = math.ceil(seconds / 86400)
+    return f"{days}d" if days <= 1000 else f"{min(15, math.ceil(days / 365))}y"
+
+
+class BarSeries:
+    """Bars for one (conid, bar size), keyed by bar timestamp in ms."""
+
+    def __init__(self, bar: str):
+        self.bar = bar
+        self.bar_s = duration_seconds(bar)
+        self.bars: Dict[int, dict] = {}
+        self._times: List[int] = []            # keys of `bars`, ascending
+        self.covered_from: float = math.inf   # epoch s; every bar after this has been fetched
+        self.span_s: float = 0.0              # widest period asked for, counted back from now
+        self.fetched_at: float = 0.0
+        self.meta: Dict[str, Any] = {}        # non-bar fields of the latest gateway response
+
+    @property
+    def refresh_after(self) -> float:
+        # 5min bars: every 2.5 min; 30min and larger: every 15 min
+        return min(900.0, max(30.0, self.bar_s / 2))
+
+    def merge(self, response: Dict[str, Any], covered_from: float, fetched_at: float) -> None:
+        for row in response.get("data") or []:
+            t = row["t"]
+            if t not in self.bars:
+                if not self._times or t > self._times[-1]:
+                    self._times.append(t)
+                else:
+                    bisect.insort(self._times, t)
+            self.bars[t] = row
+        self.meta = {k: v for k, v in response.items() if k not in ("data", "points")}
+        self.covered_from = min(self.covered_from, covered_from)
+        self.fetched_at = fetched_at
+
+    def last_bar_s(self) -> Optional[float]:
+        return self._times[-1] / 1000 if self._times else None
+
+    def slice(self, start: float) -> Dict[str, Any]:
+        # Copies, so callers reshaping rows don't edit the stored series
+        i = bisect.bisect_left(self._times, start * 1000)
+        data = [dict(self.bars[t]) for t in self._times[i:]]
+        return {**self.meta, "data": data, "points": len(data)}
+
+    def trim(self, now: float) -> None:
+        """Drop bars older than the widest period requested so far."""
+        if not self.span_s:
+            return
+        cutoff = now - self.span_s
+        i = bisect.bisect_left(self._times, cutoff * 1000)
+        if i:
+            for t in self._times[:i]:
+                del self.bars[t]
+            del self._times[:i]
+        self.covered_from = max(self.covered_from, cutoff)
+
+    # ---------- persistence ----------
+    def to_dict(self) -> dict:
+        return {"bar": self.bar, "bars": [self.bars[t] for t in self._times], "covered_from": self.covered_from,
+                "fetched_at": self.fetched_at, "meta": self.meta, "span_s": self.span_s}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "BarSeries":
+        s = cls(d["bar"])
+        s.bars = {row["t"]: row for row in d["bars"]}
+        s._times = sorted(s.bars)
+        s.span_s = d.get("span_s", 0.0)
+        s.covered_from = d["covered_from"]
+        s.fetched_at = d["fetched_at"]
+        s.meta = d["meta"]
+        return s
+
+
+class BarStore:
+    def __init__(self, max_series: int = MAX_SERIES, negative_ttl: float = NEGATIVE_CACHE_TTL):
+        self.max_series = max_series
+        self.negative_ttl = negative_ttl
+        self._series: "OrderedDict[Tuple[int, str], BarSeries]" = OrderedDict()
+        self._unavailable: Dict[Tuple[int, str], float] = {}   # key -> epoch until which we don't ask again
+        self._locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+        self._codec = resolve_codec()
+
+    async def history(self, conid: int, period: str, bar: str, fetch: Fetch) -> Dict[str, Any]:
+        """
+        Bars for `period` at `bar` size in the gateway's response shape.
+        `fetch(period)` performs the actual gateway call for this conid/bar and
+        raises NoChartData when the gateway has nothing for the contract.
+        """
+        key = (int(conid), bar)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            series = self._series.get(key) or await self._load(key)
+            now = time.time()
+            start = period_start(period, now)
+
+            if series is None or series.covered_from > start:
+                if series is None and await self._known_unavailable(key, now):
+                    BAR_REQUESTS.inc(served="negative")
+                    raise NoChartData(f"No chart data for {conid} ({bar})")
+                # Not covered yet: one fetch of the whole requested period
+                fetch_period = period if period.lower() != "ytd" else gateway_period(now - start, duration_seconds(bar))
+                try:
+                    response = await fetch(fetch_period)
+                except NoChartData:
+                    if series is None:
+                        await self._mark_unavailable(key, now)
+                    raise
+                series = series or BarSeries(bar)
+                series.merge(response, start, now)
+                BAR_REQUESTS.inc(served="full")
+                await self._save(key, series)
+            elif now - series.fetched_at >= series.refresh_after:
+                last = series.last_bar_s() or start
+                tail = gateway_period(now - last + series.bar_s, series.bar_s)
+                try:
+                    series.merge(await fetch(tail), series.covered_from, now)
+                    BAR_REQUESTS.inc(served="tail")
+                    await self._save(key, series)
+                except Exception as e:
+                    # We still hold everything up to the last refresh – better than an error
+                    log.warning("Tail refresh of %s/%s failed, serving stored bars: %s", conid, bar, e)
+                    BAR_REQUESTS.inc(served="stale")
+            else:
+                BAR_REQUESTS.inc(served="slice")
+
+            slice_start = self._slice_start(series, period, start, now)
+            series.span_s = max(series.span_s, now - min(start, slice_start))
+            series.trim(now)
+            self._remember(key, series)
+            return series.slice(slice_start)
+
+    @staticmethod
+    def _slice_start(series: BarSeries, period: str, start: float, now: float) -> float:
+        """
+        Like the gateway, a period counts back from the latest bar, not from
+        now – "1d" on a Sunday is Friday's session, not an empty slice.
+        """
+        last = series.last_bar_s()
+        if period.lower() == "ytd" or last is None:
+            return start
+        return min(now, last + series.bar_s) - duration_seconds(period)
+
+    def _remember(self, key: Tuple[int, str], series: BarSeries) -> None:
+        self._series[key] = series
+        self._series.move_to_end(key)
+        while len(self._series) > self.max_series:
+            old, _ = self._series.popitem(last=False)
+            self._locks.pop(old, None)
+
+    def invalidate(self, conid: Optional[int] = None) -> None:
+        """Drop in-memory series and no-data markers (for one conid, or all)."""
+        for key in [k for k in self._series if conid is None or k[0] == int(conid)]:
+            del self._series[key]
+        for key in [k for k in self._unavailable if conid is None or k[0] == int(conid)]:
+            del self._unavailable[key]
+
+    # ---------- no-data markers ----------
+    async def _known_unavailable(self, key: Tuple[int, str], now: float) -> bool:
+        until = self._unavailable.get(key)
+        if until is None:
+            # Another worker (or a previous run) may have learnt it already
+            try:
+                payload = await cache_mod.cache.get(self._cache_key(key) + ":unavailable")
+                until = decode(payload)[1] + self.negative_ttl if payload is not None else 0.0
+            except Exception as e:
+                log.debug("bar marker load fail %s", e)
+                until = 0.0
+        if until > now:
+            self._unavailable[key] = until
+            return True
+        self._unavailable.pop(key, None)
+        return False
+
+    async def _mark_unavailable(self, key: Tuple[int, str], now: float) -> None:
+        if self.negative_ttl <= 0:
+            return
+        self._unavailable[key] = now + self.negative_ttl
+        try:
+            await cache_mod.cache.set(self._cache_key(key) + ":unavailable",
+                                      encode({"unavailable": True}, now, self._codec), ttl=int(self.negative_ttl))
+        except Exception as e:
+            log.debug("bar marker save fail %s", e)
+
+    # ---------- shared backend ----------
+    @staticmethod
+    def _cache_key(key: Tuple[int, str]) -> str:
+        return cache_mod.versioned_key(f"bars:{key[0]}:{key[1]}")
+
+    async def _load(self, key: Tuple[int, str]) -> Optional[BarSeries]:
+        try:
+            payload = await cache_mod.cache.get(self._cache_key(key))
+            if payload is None:
+                return None
+            return BarSeries.from_dict(decode(payload)[0])
+        except (CodecError, KeyError, ValueError) as e:
+            log.debug("discarding stored bar series %s: %s", key, e)
+        except Exception as e:
+            log.debug("bar series load fail %s", e)
+        return None
+
+    async def _save(self, key: Tuple[int, str], series: BarSeries) -> None:
+        try:
+            payload = encode(series.to_dict(), time.time(), self._codec)
+            await cache_mod.cache.set(self._cache_key(key), payload, ttl=SERIES_TTL)
+        except Exception as e:
+            log.debug("bar series save fail %s", e)
@@ -1,11 +1,45 @@
 # cache.py
 import os, json, logging, asyncio
+import re
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
 from functools import wraps
-from typing import Callable, Awaitable
+from typing import Any, Callable, Awaitable, Dict, Iterable, List, Optional
 from aiocache import Cache
-from config import REDIS_PASSWORD, REDIS_URL
+from aiocache.serializers import BaseSerializer
+from pydantic import BaseModel
+from cache_codec import Codec, CodecError, decode, encode, resolve_codec
+from config import (CACHE_KEY_VERSION, CACHE_L1_MAX_BYTES, CACHE_L1_MAX_ENTRIES, CACHE_LOCK_TTL,
+                    CACHE_LOCK_WAIT, CACHE_TAG_CHECK_INTERVAL, REDIS_PASSWORD, REDIS_URL)
+from metrics import Counter, Gauge
+from tracing import span
 
 log = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter("cache_requests_total", "cached() lookups by outcome", ("function", "result"))
+L1_EVENTS = Counter("cache_l1_events_total", "In-process cache hits, misses, expiries and evictions",
+                    ("function", "event"))
+L1_ENTRIES = Gauge("cache_l1_entries", "Entries held in the in-process cache")
+L1_BYTES = Gauge("cache_l1_bytes", "Payload bytes held in the in-process cache")
+INVALIDATIONS = Counter("cache_tag_invalidations_total", "Tag invalidations by tag kind", ("tag",))
+COLLAPSED = Counter("cache_collapsed_waiters_total",
+                    "Cache misses that awaited a computation already in flight instead of calling upstream",
+                    ("function", "scope"))
+
+
+class BytesSerializer(BaseSerializer):
+    """Pass-through: cache_codec already produced bytes; encoding=None keeps Redis from decoding them."""
+    DEFAULT_ENCODING = None
+
+    def dumps(self, value):
+        return value
+
+    def loads(self, value):
+        return value
+
+
 try:
     redis_url = REDIS_URL
     if redis_url:
@@ -15,10 +49,13 @@ try:
         port=13792,                
         password=REDIS_PASSWORD,  
         timeout=3,       
+        serializer=BytesSerializer(),
         )
     else:
         log.info("redis url not found")
-        cache = Cache(Cache.MEMORY)
+        cache = Cache(Cache.MEMORY, serializer=BytesSerializer())
+    # Several workers share Redis, so misses are also serialised across processes
+    _distributed = bool(redis_url)
 except ImportError:
     raise RuntimeError("Install aiocache[redis] for caching layer")
 
@@ -116,32 +153,619 @@ def account_specific_key_builder(*args, **kwargs) -> str:
     # Create a key like: "IBKRService.ledger:U1234567"
     return f"{fn_name}:{account_id}"
 
-def cached(ttl: int, key_builder: Callable[..., str] | None = None):
+class LRUCache:
+    """
+    In-process L1 in front of `cache` (Redis). Holds the encoded payload,
+    not the decoded object, so callers can't mutate each other's results;
+    a hit still saves the Redis round trip. Bounded by entry count and by
+    total payload bytes, least recently used evicted first.
+    """
+
+    def __init__(self, max_entries: int = CACHE_L1_MAX_ENTRIES, max_bytes: int = CACHE_L1_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # key -> (expires_at monotonic, payload, size, function)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, payload, _, function = entry
+        if expires_at <= time.monotonic():
+            self._drop(key)
+            L1_EVENTS.inc(function=function, event="expired")
+            return None
+        self._data.move_to_end(key)
+        return payload
+
+    def set(self, key: str, payload: bytes, ttl: float, function: str) -> None:
+        size = len(payload)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._data:
+            self._drop(key)
+        self._data[key] = (time.monotonic() + ttl, payload, size, function)
+        self.bytes += size
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            oldest, (_, _, _, evicted_fn) = next(iter(self._data.items()))
+            self._drop(oldest)
+            L1_EVENTS.inc(function=evicted_fn, event="evicted")
+        self._report()
+
+    def delete(self, key: str) -> None:
+        if key in self._data:
+            self._drop(key)
+            self._report()
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+        self._report()
+
+    def delete_prefix(self, prefix: str) -> int:
+        keys = [k for k in self._data if k.startswith(prefix)]
+        for key in keys:
+            self._drop(key)
+        self._report()
+        return len(keys)
+
+    def entries(self) -> List[tuple]:
+        """(key, size, seconds left, function) for every live entry."""
+        now = time.monotonic()
+        return [(k, size, expires_at - now, fn) for k, (expires_at, _, size, fn) in list(self._data.items())
+                if expires_at > now]
+
+    def _drop(self, key: str) -> None:
+        self.bytes -= self._data.pop(key)[2]
+
+    def _report(self) -> None:
+        L1_ENTRIES.set(len(self._data))
+        L1_BYTES.set(self.bytes)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "bytes": self.bytes,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+
+l1 = LRUCache()
+
+
+@dataclass
+class CachedFunction:
+    """What `cached` was configured with, keyed by function qualname in CACHED_FUNCTIONS."""
+    name: str
+    ttl: int
+    l1_ttl: float
+    stale_ttl: int = 0
+    codec: str = "json"
+    tagged: bool = False
+    negative_ttl: int = 0
+
+
+CACHED_FUNCTIONS: Dict[str, CachedFunction] = {}
+
+# ---------- value age ----------
+# Age in seconds of the value the last cached() call returned in this context (0.0 = just fetched)
+cache_age: ContextVar[Optional[float]] = ContextVar("cache_age", default=None)
+# Per-request holder (see track_response_age) collecting the oldest value a response was built from
+_response_age: ContextVar[Optional[dict]] = ContextVar("cache_response_age", default=None)
+
+
+def track_response_age() -> dict:
+    """
+    Start collecting cache ages for the current request. Returns a dict whose
+    "age" is the oldest cached value used, or None if nothing came from cache.
+    """
+    holder = {"age": None}
+    _response_age.set(holder)
+    return holder
+
+
+def _note_age(age: float) -> None:
+    cache_age.set(age)
+    holder = _response_age.get()
+    if holder is not None and age > (holder["age"] or 0.0):
+        holder["age"] = age
+
+
+# ---------- payloads ----------
+def versioned_key(key: str) -> str:
+    """Every stored key carries CACHE_KEY_VERSION; bump it to orphan entries in an old format."""
+    return f"{CACHE_KEY_VERSION}:{key}"
+
+
+def _wrap(val: Any, codec: Codec) -> bytes:
+    if isinstance(val, BaseModel):
+        val = val.model_dump(mode="json")
+    return encode(val, time.time(), codec)
+
+
+def _unwrap(payload: bytes) -> Optional[tuple[Any, float]]:
+    """(value, stored_at epoch), or None if the payload can't be read (treated as a miss)."""
+    try:
+        return decode(payload)
+    except (CodecError, ValueError) as e:
+        log.debug("unreadable cache payload: %s", e)
+        return None
+
+
+# ---------- negative results ----------
+# Known-empty results are stored as {NEGATIVE: 1, "v": value} so a cached
+# "nothing there" can't be mistaken for a miss, and expire on their own TTL.
+NEGATIVE = "__negative__"
+
+
+def is_empty(val: Any) -> bool:
+    """Default `negative` predicate: None, [] or {}."""
+    return val is None or (isinstance(val, (list, dict)) and not val)
+
+
+class Uncacheable(Exception):
+    """
+    Raised by a cached function to return `value` without storing it, e.g.
+    a fallback built after the gateway failed, which must not outlive the
+    failure.
+    """
+    def __init__(self, value: Any):
+        super().__init__("result not cacheable")
+        self.value = value
+
+
+def _split_negative(value: Any) -> tuple[Any, bool]:
+    if isinstance(value, dict) and NEGATIVE in value:
+        return value["v"], True
+    return value, False
+
+
+# ---------- single flight ----------
+# key -> task computing it in this process (a miss or a stale refresh)
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def _start_compute(key: str, compute: Callable[[], Awaitable]) -> asyncio.Task:
+    """
+    One computation per key at a time. Runs as its own task so a caller
+    being cancelled doesn't fail the others waiting on it.
+    """
+    task = _inflight.get(key)
+    if task is not None:
+        return task
+
+    def _done(t: asyncio.Task) -> None:
+        if _inflight.get(key) is t:
+            del _inflight[key]
+        if not t.cancelled() and t.exception() is not None:
+            log.debug("cache compute of %s failed: %s", key, t.exception())
+
+    task = asyncio.create_task(compute())
+    _inflight[key] = task
+    task.add_done_callback(_done)
+    return task
+
+
+async def _acquire_remote_lock(key: str) -> bool:
+    """Cross-worker lock via Redis SET NX; always granted on the memory backend."""
+    if not _distributed:
+        return True
+    try:
+        return await cache.add(f"lock:{key}", b"1", ttl=CACHE_LOCK_TTL)
+    except ValueError:   # aiocache raises when the key already exists
+        return False
+    except Exception as e:
+        log.debug("cache lock fail %s", e)
+        return True      # Redis trouble: compute locally rather than wait on nothing
+
+
+async def _release_remote_lock(key: str) -> None:
+    if not _distributed:
+        return
+    try:
+        await cache.delete(f"lock:{key}")
+    except Exception as e:
+        log.debug("cache unlock fail %s", e)
+
+
+async def _wait_for_remote(key: str, accept: Callable[[tuple[Any, float]], Awaitable[bool]]
+                           ) -> Optional[tuple[bytes, tuple[Any, float]]]:
+    """
+    Poll Redis for the value another worker is computing, up to CACHE_LOCK_WAIT
+    seconds. Entries `accept` turns down (e.g. the one the miss was about) are
+    skipped and polling continues; returns (payload, entry) or None.
+    """
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    delay = 0.05
+    while time.monotonic() < deadline:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        try:
+            payload = await cache.get(key)
+        except Exception:
+            return None
+        entry = _unwrap(payload) if payload is not None else None
+        if entry is not None and await accept(entry):
+            return payload, entry
+    return None
+
+
+def account_tags(*kinds: str) -> Callable[..., List[str]]:
+    """
+    Tag builder for account-scoped functions: account_tags("cash") tags
+    ledger(self, "U123") as "account:U123:cash". The account is taken from
+    `accountId`/`account_id`/`acct` or the first positional argument.
+    """
+    def build(*args, **kwargs) -> List[str]:
+        account_id = (kwargs.get("accountId") or kwargs.get("account_id") or kwargs.get("acct")
+                      or (args[1] if len(args) > 1 else None))
+        return [f"account:{account_id}:{kind}" for kind in kinds] if account_id else []
+    return build
+
+
+# ---------- tags ----------
+# Each tag has a version counter in the backend (mirrored here); entries
+# remember the versions they were computed under, and invalidating a tag
+# bumps its version so every entry carrying it turns into a miss. L1 hits
+# trust the mirror for CACHE_TAG_CHECK_INTERVAL seconds, then re-read it,
+# so an invalidation in another worker is seen within that interval.
+_tag_versions: Dict[str, int] = {}
+_tag_checked_at: Dict[str, float] = {}   # tag -> monotonic time the mirror was last read from Redis
+
+
+def _tag_key(tag: str) -> str:
+    return versioned_key(f"tagv:{tag}")
+
+
+async def _current_tag_versions(tags: Iterable[str]) -> Dict[str, int]:
+    """Authoritative versions from the backend (one round trip), refreshing the local mirror."""
+    tags = list(tags)
+    try:
+        values = await cache.multi_get([_tag_key(t) for t in tags])
+        now = time.monotonic()
+        for tag, value in zip(tags, values):
+            _tag_versions[tag] = int(value or 0)
+            _tag_checked_at[tag] = now
+    except Exception as e:
+        log.debug("tag version read fail %s", e)
+    return {t: _tag_versions.get(t, 0) for t in tags}
+
+
+async def _l1_tag_versions(tags: List[str]) -> Dict[str, int]:
+    """Versions for checking an L1 hit: the mirror, re-read from Redis once it is too old."""
+    if _distributed:
+        now = time.monotonic()
+        if any(now - _tag_checked_at.get(t, 0.0) > CACHE_TAG_CHECK_INTERVAL for t in tags):
+            return await _current_tag_versions(tags)
+    return {t: _tag_versions.get(t, 0) for t in tags}
+
+
+def _tags_current(stamped: Dict[str, int], versions: Dict[str, int]) -> bool:
+    return all(versions.get(tag, 0) == v for tag, v in stamped.items())
+
+
+async def invalidate_tags(*tags: str) -> None:
+    """Invalidate every cached entry carrying any of `tags`, in this and other workers."""
+    for tag in tags:
+        _tag_versions[tag] = _tag_versions.get(tag, 0) + 1
+        INVALIDATIONS.inc(tag=tag.rsplit(":", 1)[-1])
+        try:
+            _tag_versions[tag] = max(_tag_versions[tag], int(await cache.increment(_tag_key(tag), 1)))
+        except Exception as e:
+            log.debug("tag invalidate fail %s", e)
+    log.info("Invalidated cache tags %s", ", ".join(tags))
+
+
+# ---------- introspection ----------
+def namespace_of(key: str) -> str:
+    """'v2:IBKRService.ledger:U1' -> 'IBKRService.ledger'; 'lock:v2:…' -> 'lock'."""
+    version = f"{CACHE_KEY_VERSION}:"
+    return (key[len(version):] if key.startswith(version) else key).split(":", 1)[0]
+
+
+def _size(value: Any) -> int:
+    return len(value) if isinstance(value, (bytes, bytearray, str)) else len(str(value))
+
+
+async def backend_entries(prefix: str = "", limit: int = 10_000) -> List[Dict[str, Any]]:
+    """
+    {key, bytes, ttl} for up to `limit` keys in the shared backend starting
+    with `prefix` (a full key, version included). ttl is seconds left, None
+    for keys without expiry.
+    """
+    if _distributed:
+        client = cache.client
+        keys = []
+        async for raw in client.scan_iter(match=re.sub(r"([*?\[\]\\])", r"\\\1", prefix) + "*", count=500):
+            keys.append(raw)
+            if len(keys) >= limit:
+                break
+        pipe = client.pipeline(transaction=False)
+        for k in keys:
+            pipe.strlen(k)
+            pipe.pttl(k)
+        res = await pipe.execute() if keys else []
+        return [{"key": k.decode() if isinstance(k, bytes) else k, "bytes": res[2 * i],
+                 "ttl": res[2 * i + 1] / 1000 if res[2 * i + 1] >= 0 else None}
+                for i, k in enumerate(keys)]
+
+    out = []
+    for key, value in list(await cache.raw("items")):   # the memory backend's dict, via the public raw()
+        if key.startswith(prefix):
+            out.append({"key": key, "bytes": _size(value), "ttl": _memory_ttl(key)})
+            if len(out) >= limit:
+                break
+    return out
+
+
+def _memory_ttl(key: str) -> Optional[float]:
+    """
+    Seconds left on a memory-backend key. aiocache has no public TTL read,
+    so this relies on SimpleMemoryBackend's expiry timers (aiocache 0.12,
+    pinned in requirements); anything else reports no TTL.
+    """
+    handlers = getattr(cache, "_handlers", None)
+    handle = handlers.get(key) if isinstance(handlers, dict) else None
+    if not isinstance(handle, asyncio.TimerHandle):
+        return None
+    return handle.when() - asyncio.get_running_loop().time()
+
+
+async def namespaces() -> List[Dict[str, Any]]:
+    """Backend and L1 keys grouped by namespace, with counts, bytes and the TTL range left."""
+    groups: Dict[str, Dict[str, Any]] = {}
+
+    def group(ns: str) -> Dict[str, Any]:
+        return groups.setdefault(ns, {"namespace": ns, "keys": 0, "bytes": 0, "ttl_min": None, "ttl_max": None,
+                                      "l1_keys": 0, "l1_bytes": 0})
+
+    for e in await backend_entries():
+        g = group(namespace_of(e["key"]))
+        g["keys"] += 1
+        g["bytes"] += e["bytes"]
+        if e["ttl"] is not None:
+            g["ttl_min"] = e["ttl"] if g["ttl_min"] is None else min(g["ttl_min"], e["ttl"])
+            g["ttl_max"] = e["ttl"] if g["ttl_max"] is None else max(g["ttl_max"], e["ttl"])
+    for key, size, _, _ in l1.entries():
+        g = group(namespace_of(key))
+        g["l1_keys"] += 1
+        g["l1_bytes"] += size
+    for g in groups.values():
+        for k in ("ttl_min", "ttl_max"):
+            if g[k] is not None:
+                g[k] = round(g[k], 1)
+    return sorted(groups.values(), key=lambda g: g["bytes"] + g["l1_bytes"], reverse=True)
+
+
+def function_stats() -> List[Dict[str, Any]]:
+    """Configuration, lookup outcomes and hit ratio of every cached() function since start."""
+    outcomes: Dict[str, Dict[str, float]] = {}
+    for (function, result), count in CACHE_REQUESTS.samples().items():
+        outcomes.setdefault(function, {})[result] = count
+    out = []
+    for name, cfg in sorted(CACHED_FUNCTIONS.items()):
+        counts = outcomes.get(name, {})
+        hits = sum(counts.get(r, 0) for r in ("l1_hit", "l2_hit", "stale", "negative_hit"))
+        lookups = hits + counts.get("miss", 0) + counts.get("invalidated", 0)
+        out.append({
+            **asdict(cfg),
+            "lookups": int(lookups),
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "outcomes": {k: int(v) for k, v in counts.items()},
+            "collapsed": {scope: int(COLLAPSED.value(function=name, scope=scope)) for scope in ("local", "remote")},
+        })
+    return out
+
+
+async def purge_prefix(prefix: str) -> Dict[str, int]:
+    """
+    Delete entries whose key (after the version prefix) starts with `prefix`,
+    from L1 and the backend. Tag version counters are left alone: resetting
+    them could make entries stamped before the purge current again.
+    """
+    full = versioned_key(prefix)
+    l1_removed = l1.delete_prefix(full)
+    removed = 0
+    for e in await backend_entries(full, limit=1_000_000):
+        if namespace_of(e["key"]) == "tagv":
+            continue
+        try:
+            removed += int(bool(await cache.delete(e["key"])))
+        except Exception as ex:
+            log.debug("cache purge fail %s", ex)
+    log.info("Purged %d cache entries (%d in L1) under %r", removed, l1_removed, prefix)
+    return {"backend": removed, "l1": l1_removed}
+
+
+async def drop_key(key: str) -> None:
+    l1.delete(key)
+    try:
+        await cache.delete(key)
+    except Exception as e:
+        log.debug("cache delete fail %s", e)
+
+
+def cached(
+    ttl: int,
+    key_builder: Callable[..., str] | None = None,
+    l1_ttl: float | None = None,
+    stale_ttl: int = 0,
+    model: type[BaseModel] | None = None,
+    codec: str | None = None,
+    tags: Callable[..., Iterable[str]] | None = None,
+    negative_ttl: int = 0,
+    negative: Callable[[Any], bool] = is_empty,
+):
     """
     Decorator to cache coroutine results for `ttl` seconds.
+
+    Lookups go to the in-process L1 first (kept for `l1_ttl` seconds,
+    default `ttl`), then to Redis; values read from Redis are copied into
+    L1. If Redis is unreachable the L1 still serves and stores results.
+
+    With `stale_ttl`, a value older than `ttl` but younger than
+    `ttl + stale_ttl` is returned immediately while one background task
+    per key refreshes it (stale-while-revalidate).
+
+    Concurrent misses for a key share one computation; with Redis, a
+    `lock:<key>` entry makes other workers wait for that result too.
+
+    Functions returning a pydantic model pass it as `model` so cached
+    values are validated back into it. `codec` picks the payload encoding
+    (see cache_codec; default CACHE_CODEC). `tags` builds tag names from
+    the call arguments (e.g. account_tags("cash")); invalidate_tags() on
+    any of them turns the entry into a miss. A function raising
+    Uncacheable(value) returns `value` to the caller without it being stored.
+
+    With `negative_ttl`, results for which `negative(result)` is true
+    (default: None, [] or {}) are cached under an explicit marker for
+    `negative_ttl` seconds instead of `ttl`, without a stale window, so a
+    known-empty answer is served locally but rechecked sooner.
     """
     def decorator(fn: Callable[..., Awaitable]):
-        @wraps(fn)
-        async def wrapper(*args, **kw):
+        name = fn.__qualname__
+        local_ttl = ttl if l1_ttl is None else l1_ttl
+        codec_impl = resolve_codec(codec)
+        CACHED_FUNCTIONS[name] = CachedFunction(name=name, ttl=ttl, l1_ttl=local_ttl, stale_ttl=stale_ttl,
+                                                codec=codec_impl.name, tagged=tags is not None,
+                                                negative_ttl=negative_ttl)
 
+        def _decode(value):
+            return model.model_validate(value) if model is not None and value is not None else value
+
+        async def _fetch_and_store(key: str, args, kw, tag_names: List[str], refresh: bool = False):
+            if not await _acquire_remote_lock(key):
+                if refresh:
+                    return None   # another worker is already refreshing this key
+                # Another worker is computing this key – wait for its result. What
+                # is in Redis now may be the entry this miss rejected (expired or
+                # invalidated), so only take one stored after the miss whose tag
+                # stamp is still current.
+                missed_at = time.time()
+
+                async def fresh(entry) -> bool:
+                    if entry[1] < missed_at:
+                        return False
+                    if not tags:
+                        return True
+                    stamped = entry[0]
+                    return isinstance(stamped, dict) and _tags_current(
+                        stamped.get("tags") or {},
+                        await _current_tag_versions(tag_names) if tag_names else {})
+
+                found = await _wait_for_remote(key, fresh)
+                if found is not None:
+                    payload, entry = found
+                    COLLAPSED.inc(function=name, scope="remote")
+                    value, is_negative = _split_negative(entry[0]["v"] if tags else entry[0])
+                    l1.set(key, payload, min(local_ttl, negative_ttl) if is_negative else local_ttl + stale_ttl, name)
+                    return _decode(value)
+                acquired = False
+            else:
+                acquired = True
+            try:
+                # Versions as of *before* the call: an invalidation racing the
+                # fetch leaves this entry already out of date
+                stamp = await _current_tag_versions(tag_names) if tag_names else None
+                # IMPORTANT: Call the original function with the ORIGINAL, unmodified kwargs
+                try:
+                    val = await fn(*args, **kw)
+                except Uncacheable as e:
+                    CACHE_REQUESTS.inc(function=name, result="uncacheable")
+                    return e.value
+                try:
+                    stored = val.model_dump(mode="json") if isinstance(val, BaseModel) else val
+                    if negative_ttl and negative(val):
+                        stored = {NEGATIVE: 1, "v": stored}
+                        l1_for, backend_for = min(local_ttl, negative_ttl), negative_ttl
+                    else:
+                        l1_for, backend_for = local_ttl + stale_ttl, ttl + stale_ttl
+                    payload = _wrap({"tags": stamp, "v": stored} if tags else stored, codec_impl)
+                    l1.set(key, payload, l1_for, name)
+                    await cache.set(key, payload, ttl=backend_for)
+                except Exception as e:
+                    CACHE_REQUESTS.inc(function=name, result="set_error")
+                    log.debug("cache set fail %s", e)
+                return val
+            finally:
+                if acquired:
+                    await _release_remote_lock(key)
+
+        def cache_key(*args, **kw) -> str:
             builder_kw = kw.copy()
             builder_kw['func_name'] = fn.__name__
-            key = key_builder(*args, **builder_kw) if key_builder else f"{fn.__name__}:{args[1:]}:{kw}"
+            return versioned_key(
+                key_builder(*args, **builder_kw) if key_builder else f"{fn.__name__}:{args[1:]}:{kw}"
+            )
 
-            try:
-                cached_val = await cache.get(key)
-                if cached_val is not None:
-                    return json.loads(cached_val)
-            except Exception as e:
-                log.debug("cache miss %s", e)
+        @wraps(fn)
+        async def wrapper(*args, **kw):
+            key = cache_key(*args, **kw)
+            tag_names = list(tags(*args, **kw)) if tags else []
 
-            # IMPORTANT: Call the original function with the ORIGINAL, unmodified kwargs
-            val = await fn(*args, **kw) 
+            with span("cache.lookup", **{"cache.function": name, "cache.key": key}) as lookup:
+                payload, tier = l1.get(key), "l1"
+                if payload is not None:
+                    L1_EVENTS.inc(function=name, event="hit")
+                else:
+                    L1_EVENTS.inc(function=name, event="miss")
+                    tier = "l2"
+                    try:
+                        payload = await cache.get(key)
+                    except Exception as e:
+                        CACHE_REQUESTS.inc(function=name, result="error")
+                        log.debug("cache miss %s", e)
 
-            try:
-                await cache.set(key, json.dumps(val), ttl=ttl)
-            except Exception as e:
-                log.debug("cache set fail %s", e)
+                entry = _unwrap(payload) if payload is not None else None
+                if entry is not None and tags:
+                    stamped = entry[0]
+                    versions = (
+                        await _l1_tag_versions(tag_names) if tier == "l1"
+                        else await _current_tag_versions(tag_names)
+                    )
+                    if isinstance(stamped, dict) and _tags_current(stamped.get("tags") or {}, versions):
+                        entry = (stamped["v"], entry[1])
+                    else:
+                        CACHE_REQUESTS.inc(function=name, result="invalidated")
+                        l1.delete(key)
+                        entry = None
+                if entry is not None:
+                    value, stored_at = entry
+                    age = time.time() - stored_at
+                    value, is_negative = _split_negative(value) if negative_ttl else (value, False)
+                    if is_negative:
+                        if age < negative_ttl:
+                            CACHE_REQUESTS.inc(function=name, result="negative_hit")
+                            lookup.set_attribute("cache.hit", "negative")
+                            if tier == "l2":
+                                l1.set(key, payload, min(local_ttl, negative_ttl) - age, name)
+                            _note_age(age)
+                            return _decode(value)
+                    elif age < ttl:
+                        CACHE_REQUESTS.inc(function=name, result=f"{tier}_hit")
+                        lookup.set_attribute("cache.hit", tier)
+                        if tier == "l2":
+                            l1.set(key, payload, local_ttl + stale_ttl, name)
+                        _note_age(age)
+                        return _decode(value)
+                    elif age < ttl + stale_ttl:
+                        CACHE_REQUESTS.inc(function=name, result="stale")
+                        lookup.set_attribute("cache.hit", "stale")
+                        lookup.set_attribute("cache.age_s", round(age, 1))
+                        _start_compute(key, lambda: _fetch_and_store(key, args, kw, tag_names, refresh=True))
+                        _note_age(age)
+                        return _decode(value)
+                CACHE_REQUESTS.inc(function=name, result="miss")
+                lookup.set_attribute("cache.hit", False)
+
+            if key in _inflight:
+                COLLAPSED.inc(function=name, scope="local")
+            val = await asyncio.shield(_start_compute(key, lambda: _fetch_and_store(key, args, kw, tag_names)))
+            _note_age(0.0)
             return val
+
+        wrapper.cache_key = cache_key
         return wrapper
     return decorator
@@ -0,0 +1,153 @@
+# cache_codec.py
+"""
+Binary encoding for values stored by cache.cached().
+
+Every payload starts with a small header – format version, codec id,
+compression id and the write timestamp – so entries written with one
+codec stay readable after a function switches to another. Payloads of at
+least CACHE_COMPRESS_MIN_BYTES are compressed with zstd or lz4 when
+installed.
+
+Codecs: "json" (always), "orjson", "msgpack"; compression: "auto" (zstd,
+else lz4, else none), "zstd", "lz4", "none".
+"""
+import json
+import logging
+import struct
+from typing import Any, Dict, Optional, Tuple
+
+from config import CACHE_CODEC, CACHE_COMPRESSION, CACHE_COMPRESS_MIN_BYTES
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is the fallback
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("!BBBd")   # version, codec id, compression id, stored_at (epoch seconds)
+
+
+class CodecError(ValueError):
+    """Payload is not in a format this process can read."""
+
+
+class Codec:
+    name = ""
+    id = 0
+
+    def dumps(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name, id = "json", 1
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name, id = "orjson", 2
+
+    def dumps(self, value: Any) -> bytes:
+        # int dict keys (conid maps) are stringified, as with json.dumps
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name, id = "msgpack", 3
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+CODECS: Dict[str, Codec] = {"json": JsonCodec()}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+_CODECS_BY_ID = {c.id: c for c in CODECS.values()}
+
+# compression id -> (compress, decompress)
+_NO_COMPRESSION = 0
+_COMPRESSORS: Dict[int, Tuple] = {}
+_COMPRESSION_IDS = {"none": _NO_COMPRESSION}
+if zstandard is not None:
+    _COMPRESSORS[1] = (zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress)
+    _COMPRESSION_IDS["zstd"] = 1
+if lz4_frame is not None:
+    _COMPRESSORS[2] = (lz4_frame.compress, lz4_frame.decompress)
+    _COMPRESSION_IDS["lz4"] = 2
+
+
+def resolve_codec(name: Optional[str] = None) -> Codec:
+    """Codec by name (default CACHE_CODEC), falling back to json if its library is missing."""
+    name = name or CACHE_CODEC
+    codec = CODECS.get(name)
+    if codec is None:
+        log.warning("Cache codec %r unavailable, using json", name)
+        codec = CODECS["json"]
+    return codec
+
+
+def _resolve_compression(name: str) -> int:
+    if name == "auto":
+        return _COMPRESSION_IDS.get("zstd", _COMPRESSION_IDS.get("lz4", _NO_COMPRESSION))
+    if name not in _COMPRESSION_IDS:
+        log.warning("Cache compression %r unavailable, storing uncompressed", name)
+        return _NO_COMPRESSION
+    return _COMPRESSION_IDS[name]
+
+
+_default_compression = _resolve_compression(CACHE_COMPRESSION)
+
+
+def encode(value: Any, stored_at: float, codec: Codec) -> bytes:
+    body = codec.dumps(value)
+    compression = _NO_COMPRESSION
+    if _default_compression != _NO_COMPRESSION and len(body) >= CACHE_COMPRESS_MIN_BYTES:
+        compression = _default_compression
+        body = _COMPRESSORS[compression][0](body)
+    return _HEADER.pack(FORMAT_VERSION, codec.id, compression, stored_at) + body
+
+
+def decode(payload: bytes) -> Tuple[Any, float]:
+    """(value, stored_at). Raises CodecError for foreign or unreadable payloads."""
+    if not isinstance(payload, (bytes, bytearray)) or len(payload) < _HEADER.size:
+        raise CodecError("not a cache payload")
+    version, codec_id, compression, stored_at = _HEADER.unpack_from(payload)
+    codec = _CODECS_BY_ID.get(codec_id)
+    if version != FORMAT_VERSION or codec is None:
+        raise CodecError(f"unsupported payload (format {version}, codec {codec_id})")
+    body = memoryview(payload)[_HEADER.size:]
+    if compression != _NO_COMPRESSION:
+        if compression not in _COMPRESSORS:
+            raise CodecError(f"compression {compression} not installed")
+        body = _COMPRESSORS[compression][1](body)
+    return codec.loads(bytes(body)), stored_at
@@ -0,0 +1,165 @@
+# circuit.py
+"""
+Circuit breaker for the IBKR gateway REST client.
+
+CLOSED    – normal operation; failures are tracked in a sliding window.
+OPEN      – the gateway is considered down; calls fail fast with a 503.
+HALF_OPEN – after `open_seconds`, one trial call at a time is let through
+            and the /auth/status probe can close the circuit directly.
+"""
+import logging
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Tuple
+
+from fastapi import HTTPException
+from metrics import Counter, Gauge
+
+log = logging.getLogger("ibkr.circuit")
+
+# Health-check endpoints always pass; their result is fed back via record_probe()
+PROBE_ENDPOINTS = ("/iserver/auth/status", "/tickle", "/sso/validate")
+# Statuses that mean the gateway itself is unhealthy. A plain 500 is how IBKR
+# reports application errors ("Chart data unavailable", unknown conid, ...),
+# so it is an answer, not an outage.
+FAILURE_STATUSES = frozenset({401, 502, 503, 504})
+
+CIRCUIT_STATE = Gauge("ibkr_circuit_state", "Gateway circuit state (0=closed, 1=half_open, 2=open)")
+CIRCUIT_REJECTED = Counter("ibkr_circuit_rejected_total", "Gateway calls rejected while the circuit was open")
+CIRCUIT_TRANSITIONS = Counter("ibkr_circuit_transitions_total", "Circuit state changes", ("to",))
+
+
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+
+_STATE_VALUE = {BreakerState.CLOSED: 0, BreakerState.HALF_OPEN: 1, BreakerState.OPEN: 2}
+
+
+class CircuitOpenException(HTTPException):
+    """Raised instead of calling the gateway while the circuit is open."""
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=503,
+            detail="IBKR gateway unavailable",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        consecutive_failures: int = 5,   # connection errors / FAILURE_STATUSES in a row
+        error_rate: float = 0.5,          # …or this failure ratio over the window
+        min_calls: int = 10,
+        window_seconds: float = 30.0,
+        open_seconds: float = 15.0,
+    ):
+        self.consecutive_failures = consecutive_failures
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+
+        self._state = BreakerState.CLOSED
+        self._opened_at = 0.0
+        self._streak = 0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()   # (timestamp, ok)
+        self._trial_in_flight = False
+        CIRCUIT_STATE.set(0)
+
+    # ---------- state ----------
+    @property
+    def state(self) -> BreakerState:
+        if self._state is BreakerState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(BreakerState.HALF_OPEN)
+        return self._state
+
+    def _transition(self, new: BreakerState) -> None:
+        if new is self._state:
+            return
+        log.warning("Gateway circuit %s -> %s", self._state.value, new.value)
+        self._state = new
+        CIRCUIT_STATE.set(_STATE_VALUE[new])
+        CIRCUIT_TRANSITIONS.inc(to=new.value)
+        if new is BreakerState.OPEN:
+            self._opened_at = time.monotonic()
+        if new is BreakerState.CLOSED:
+            self._streak = 0
+            self._outcomes.clear()
+        self._trial_in_flight = False
+
+    def retry_after(self) -> int:
+        remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+        return max(1, int(remaining) + 1)
+
+    def snapshot(self) -> dict:
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return {
+            "state": self.state.value,
+            "consecutive_failures": self._streak,
+            "window_calls": len(self._outcomes),
+            "window_failures": failures,
+            "retry_after": self.retry_after() if self._state is not BreakerState.CLOSED else 0,
+        }
+
+    # ---------- call gating ----------
+    def reject_if_open(self, ep: str) -> None:
+        """Cheap pre-check before queueing for a limiter slot; never claims the trial."""
+        if not ep.startswith(PROBE_ENDPOINTS) and self.state is BreakerState.OPEN:
+            CIRCUIT_REJECTED.inc()
+            raise CircuitOpenException(self.retry_after())
+
+    def before_call(self, ep: str) -> bool:
+        """
+        Raise CircuitOpenException if `ep` may not go upstream right now.
+        Returns True when the call is the half-open trial request.
+        """
+        if ep.startswith(PROBE_ENDPOINTS):
+            return False
+        state = self.state
+        if state is BreakerState.CLOSED:
+            return False
+        if state is BreakerState.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        CIRCUIT_REJECTED.inc()
+        raise CircuitOpenException(self.retry_after())
+
+    def record(self, ep: str, ok: bool, trial: bool = False) -> None:
+        """Feed the outcome of a non-probe gateway call."""
+        if ep.startswith(PROBE_ENDPOINTS):
+            return
+        if trial:
+            self._transition(BreakerState.CLOSED if ok else BreakerState.OPEN)
+            return
+
+        now = time.monotonic()
+        self._outcomes.append((now, ok))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+        self._streak = 0 if ok else self._streak + 1
+
+        if self._state is not BreakerState.CLOSED or ok:
+            return
+        failures = sum(1 for _, o in self._outcomes if not o)
+        if self._streak >= self.consecutive_failures or (
+            len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate
+        ):
+            self._transition(BreakerState.OPEN)
+
+    def release_trial(self) -> None:
+        """The half-open trial ended without a verdict (e.g. it was cancelled)."""
+        self._trial_in_flight = False
+
+    def record_probe(self, healthy: bool) -> None:
+        """Result of the /auth/status health probe."""
+        state = self.state
+        if healthy and state is not BreakerState.CLOSED:
+            self._transition(BreakerState.CLOSED)
+        elif not healthy and state is BreakerState.HALF_OPEN:
+            self._transition(BreakerState.OPEN)
@@ -11,3 +11,58 @@ PERPLEXITY_REPORT_MODEL = os.getenv("PERPLEXITY_REPORT_MODEL", "sonar-pro")
 GATEWAY_BASE_URL = os.getenv("IBKR_GATEWAY_URL", "https://ibkr-gateway:5000")
 REDIS_URL =  os.getenv("REDIS_URL")
 REDIS_PASSWORD =  os.getenv("REDIS_PASSWORD")
+# Gateway HTTP client tuning (one host, so pool limits are per-host limits). HTTP/2 is opt-in
+# until it has been measured against the Client Portal gateway
+GATEWAY_HTTP2 = os.getenv("IBKR_HTTP2", "0") == "1"
+GATEWAY_MAX_CONNECTIONS = int(os.getenv("IBKR_MAX_CONNECTIONS", "20"))
+GATEWAY_MAX_KEEPALIVE = int(os.getenv("IBKR_MAX_KEEPALIVE", "10"))
+GATEWAY_KEEPALIVE_EXPIRY = float(os.getenv("IBKR_KEEPALIVE_EXPIRY", "30"))
+GATEWAY_POOL_TIMEOUT = float(os.getenv("IBKR_POOL_TIMEOUT", "10"))
+# Gateway responses larger than this are JSON-decoded in a worker thread
+GATEWAY_JSON_OFFLOAD_BYTES = int(os.getenv("IBKR_JSON_OFFLOAD_BYTES", str(128 * 1024)))
+# Span tracing: "none", "console" or "jsonl"; only traces whose root span
+# took at least TRACE_SLOW_MS are exported
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+# Event-loop monitor: lag sampling period (s) and the slow-callback threshold (ms, 0 disables)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+LOOP_SLOW_CALLBACK_MS = float(os.getenv("LOOP_SLOW_CALLBACK_MS", "100"))
+# In-process L1 cache in front of Redis
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "2048"))
+CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(64 * 1024 * 1024)))
+# Cross-worker cache fill lock: lock lifetime and how long other workers wait on it (s)
+CACHE_LOCK_TTL = int(os.getenv("CACHE_LOCK_TTL", "30"))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "10"))
+# How old (s) this worker's copy of a tag version may be before an L1 hit re-reads it from Redis
+CACHE_TAG_CHECK_INTERVAL = float(os.getenv("CACHE_TAG_CHECK_INTERVAL", "1"))
+# Cached payload format: codec (json/orjson/msgpack), compression (auto/zstd/lz4/none) above a size
+# threshold, and a key prefix to bump whenever the stored format changes
+CACHE_CODEC = os.getenv("CACHE_CODEC", "orjson")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "auto")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", str(16 * 1024)))
+CACHE_KEY_VERSION = os.getenv("CACHE_KEY_VERSION", "v2")
+# Persistent symbol/conid index (SQLite) and how long a remembered secdef search answer is trusted (s)
+SYMBOL_INDEX_PATH = os.getenv("SYMBOL_INDEX_PATH", "symbols.db")
+if SYMBOL_INDEX_PATH != ":memory:" and not os.path.isabs(SYMBOL_INDEX_PATH):
+    # Relative to the backend directory, not to wherever the server was started from
+    SYMBOL_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), SYMBOL_INDEX_PATH)
+SYMBOL_QUERY_TTL = float(os.getenv("SYMBOL_QUERY_TTL", str(7 * 86400)))
+# Known-empty answers (unknown tickers, "Chart data unavailable") are remembered for this long (s)
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "1800"))
+# IBKR WebSocket dispatch: worker shards, queued messages per shard, and what to do with
+# market data when a shard is full (drop_oldest, drop_newest or block)
+WS_DISPATCH_SHARDS = int(os.getenv("WS_DISPATCH_SHARDS", "4"))
+WS_QUEUE_MAX = int(os.getenv("WS_QUEUE_MAX", "1000"))
+WS_QUEUE_OVERFLOW = os.getenv("WS_QUEUE_OVERFLOW", "drop_oldest").lower()
+# Max updates per second per conid sent to the frontend, per stream ("stream=hz,..."; 0 = every tick)
+STREAM_MAX_HZ = os.getenv("STREAM_MAX_HZ", "market_data=4,active_stock_update=10")
+# Frontend WebSocket clients: outbound queue per client, what to do when it is full
+# (drop_oldest, conflate or disconnect), and how far behind (s) a client may fall before it is dropped
+WS_CLIENT_QUEUE_MAX = int(os.getenv("WS_CLIENT_QUEUE_MAX", "500"))
+WS_CLIENT_OVERFLOW = os.getenv("WS_CLIENT_OVERFLOW", "conflate").lower()
+WS_CLIENT_MAX_LAG = float(os.getenv("WS_CLIENT_MAX_LAG", "30"))
+# /admin/* routes (cache purge/prewarm, stream rates): off with ADMIN_ENABLED=0. With ADMIN_TOKEN set
+# callers must send it as X-Admin-Token; without one only requests from this host are accepted
+ADMIN_ENABLED = os.getenv("ADMIN_ENABLED", "1").lower() in ("1", "true", "yes")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
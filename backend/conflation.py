@@ -0,0 +1,121 @@
+# conflation.py
+"""
+Rate-limited delivery of streaming updates to the frontend.
+
+In a fast market IBKR sends far more `smd` frames than a browser can
+paint, and on a slow link every one of them queues up behind the last.
+Updates are therefore offered here under (stream, conid): while an
+update is waiting, newer ones for the same key are merged into it
+(fields missing from the newer frame keep their last value), and each
+stream is flushed at most `hz` times per second. The first update after
+a quiet period goes out immediately.
+
+Streams are the frontend message types ("market_data",
+"active_stock_update"); STREAM_MAX_HZ sets their rates and set_rate()
+changes them at runtime. A rate of 0 turns conflation off for a stream.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import STREAM_MAX_HZ
+from metrics import Counter, Gauge
+
+log = logging.getLogger("ibkr.conflation")
+
+CONFLATED = Counter("ws_conflated_updates_total", "Updates merged into one still waiting to be sent", ("stream",))
+FLUSHED = Counter("ws_conflation_flushed_total", "Updates sent by the conflation stage", ("stream",))
+STREAM_RATE = Gauge("ws_stream_max_hz", "Configured maximum update rate per stream", ("stream",))
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """'market_data=4,active_stock_update=10' -> {"market_data": 4.0, "active_stock_update": 10.0}"""
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        stream, _, hz = part.partition("=")
+        try:
+            rates[stream.strip()] = float(hz)
+        except ValueError:
+            log.warning("Ignoring bad STREAM_MAX_HZ entry %r", part)
+    return rates
+
+
+class Conflator:
+    def __init__(self, publish: Callable[[Dict[str, Any]], Awaitable[None]], rates: Optional[Dict[str, float]] = None):
+        self._publish = publish
+        self._rates: Dict[str, float] = {}
+        self._pending: Dict[str, Dict[int, Dict[str, Any]]] = {}   # stream -> conid -> merged update
+        self._dirty: Dict[str, asyncio.Event] = {}
+        self._flushers: Dict[str, asyncio.Task] = {}
+        for stream, hz in (parse_rates(STREAM_MAX_HZ) if rates is None else rates).items():
+            self.set_rate(stream, hz)
+
+    # ---------- configuration ----------
+    def rates(self) -> Dict[str, float]:
+        return dict(self._rates)
+
+    def set_rate(self, stream: str, hz: float) -> None:
+        """Change a stream's maximum rate; 0 sends every update as it comes."""
+        self._rates[stream] = max(0.0, float(hz))
+        STREAM_RATE.set(self._rates[stream], stream=stream)
+        if stream in self._dirty:
+            self._dirty[stream].set()   # flush whatever is pending under the new rate
+
+    # ---------- updates ----------
+    async def offer(self, stream: str, conid: int, update: Dict[str, Any]) -> None:
+        hz = self._rates.get(stream, 0.0)
+        if hz <= 0 and not self._pending.get(stream):
+            await self._send(stream, update)
+            return
+        pending = self._pending.setdefault(stream, {})
+        merged = pending.get(conid)
+        if merged is None:
+            pending[conid] = dict(update)
+        else:
+            merged.update((k, v) for k, v in update.items() if v is not None)
+            CONFLATED.inc(stream=stream)
+        self._flusher(stream).set()
+
+    def _flusher(self, stream: str) -> asyncio.Event:
+        task = self._flushers.get(stream)
+        if task is None or task.done():
+            self._dirty[stream] = asyncio.Event()
+            self._flushers[stream] = asyncio.create_task(self._flush_loop(stream), name=f"conflate-{stream}")
+        return self._dirty[stream]
+
+    async def _flush_loop(self, stream: str) -> None:
+        loop = asyncio.get_running_loop()
+        dirty = self._dirty[stream]
+        last_flush = 0.0
+        while True:
+            await dirty.wait()
+            dirty.clear()
+            hz = self._rates.get(stream, 0.0)
+            if hz > 0:
+                wait = last_flush + 1 / hz - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            last_flush = loop.time()
+            batch = self._pending.pop(stream, None)
+            for update in (batch or {}).values():
+                await self._send(stream, update)
+
+    async def _send(self, stream: str, update: Dict[str, Any]) -> None:
+        FLUSHED.inc(stream=stream)
+        try:
+            await self._publish(update)
+        except Exception as e:
+            log.warning("Publishing %s update failed: %s", stream, e)
+
+    async def stop(self) -> None:
+        for task in self._flushers.values():
+            task.cancel()
+        await asyncio.gather(*self._flushers.values(), return_exceptions=True)
+        self._flushers.clear()
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rates_hz": self.rates(),
+            "pending": {stream: len(p) for stream, p in self._pending.items()},
+        }
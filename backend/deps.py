@@ -1,9 +1,27 @@
 # deps.py ---------------------------------------------------------------
-from fastapi import Request
+import secrets
+from typing import Optional
+from fastapi import Header, HTTPException, Request
+from config import ADMIN_ENABLED, ADMIN_TOKEN
 from ibkr import IBKRService
 
+LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
 def get_ibkr_service(request: Request) -> IBKRService:
     """
     Pull the singleton instance that main.py stashed on app.state.
     """
     return request.app.state.ibkr
+
+def require_admin(request: Request, x_admin_token: Optional[str] = Header(None)) -> None:
+    """
+    Gate for the /admin routes: ADMIN_TOKEN when configured, otherwise
+    requests from this host only.
+    """
+    if not ADMIN_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if ADMIN_TOKEN:
+        if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="Admin token required")
+    elif request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=403, detail="Admin routes are only available from localhost")
@@ -0,0 +1,113 @@
+# gateway_http.py
+"""
+httpx client factory for the IBKR gateway: configurable protocol, pool size
+and keepalive, plus a transport that reports pool utilisation and how long
+requests wait for a pooled connection.
+"""
+import importlib.util
+import logging
+import time
+
+import httpx
+
+from config import (GATEWAY_HTTP2, GATEWAY_KEEPALIVE_EXPIRY, GATEWAY_MAX_CONNECTIONS,
+                    GATEWAY_MAX_KEEPALIVE, GATEWAY_POOL_TIMEOUT)
+from metrics import Gauge, Histogram
+
+log = logging.getLogger("ibkr.http")
+
+POOL_CONNECTIONS = Gauge("ibkr_http_pool_connections", "Open connections to the gateway", ("state",))
+POOL_QUEUED = Gauge("ibkr_http_pool_queued_requests", "Requests waiting for a pooled connection")
+POOL_ACQUIRE_SECONDS = Histogram(
+    "ibkr_http_pool_acquire_seconds", "Time from request start until a connection was assigned",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """
+    AsyncHTTPTransport that measures connection-acquire wait through the
+    httpcore trace hook: the first trace event (TCP connect on a new
+    connection, or sending headers on a reused one) marks the moment the
+    pool handed the request a connection.
+    """
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        acquired = False
+        upstream_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict) -> None:
+            nonlocal acquired
+            if not acquired:
+                acquired = True
+                POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - started)
+            if upstream_trace is not None:
+                await upstream_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self._report_pool()
+
+    def _report_pool(self) -> None:
+        stats = self.pool_stats()
+        if stats["open"] >= 0:
+            POOL_CONNECTIONS.set(stats["active"], state="active")
+            POOL_CONNECTIONS.set(stats["idle"], state="idle")
+        if stats["queued"] >= 0:
+            POOL_QUEUED.set(stats["queued"])
+
+    def pool_stats(self) -> dict:
+        """
+        Pool utilisation. httpx exposes no public pool API, so this reads
+        httpcore's pool (versions pinned in requirements); if its shape
+        changes the counts are reported as unknown (-1) instead of failing.
+        """
+        pool = getattr(self, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        try:
+            idle = sum(1 for c in connections if c.is_idle())
+            open_ = len(connections)
+        except (TypeError, AttributeError):
+            open_ = idle = -1
+        try:
+            queued = sum(1 for r in getattr(pool, "_requests") if r.is_queued())
+        except (TypeError, AttributeError):
+            queued = -1
+        return {
+            "open": open_,
+            "active": open_ - idle if open_ >= 0 else -1,
+            "idle": idle,
+            "queued": queued,
+            "max_connections": GATEWAY_MAX_CONNECTIONS,
+            "http2": GATEWAY_HTTP2 and _h2_available(),
+        }
+
+
+def _h2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def build_gateway_client(base_url: str) -> httpx.AsyncClient:
+    """The AsyncClient IBKRService uses for every gateway REST call."""
+    http2 = GATEWAY_HTTP2
+    if http2 and not _h2_available():
+        log.warning("IBKR_HTTP2=1 but the 'h2' package is missing; falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=GATEWAY_MAX_CONNECTIONS,
+        max_keepalive_connections=GATEWAY_MAX_KEEPALIVE,
+        keepalive_expiry=GATEWAY_KEEPALIVE_EXPIRY,
+    )
+    # HTTP/2 is negotiated over ALPN, so a gateway without h2 support
+    # transparently stays on HTTP/1.1 with the same pool limits.
+    transport = InstrumentedTransport(verify=False, http2=http2, limits=limits)
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=httpx.Timeout(30.0, pool=GATEWAY_POOL_TIMEOUT),
+        headers={"Host": "api.ibkr.com"},
+    )
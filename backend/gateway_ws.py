@@ -2,10 +2,38 @@
 """
 FastAPI-native WebSocket broadcaster.
 The single public symbol ``broadcast`` is injected into IBKRService.
+
+Every client has its own bounded outbound queue drained by its own
+writer task, so broadcast() only serialises once and enqueues: a slow
+browser falls behind on its own instead of holding up every other client
+and the IBKR reader. When a client's queue is full, WS_CLIENT_OVERFLOW
+decides:
+
+* ``drop_oldest`` – discard the oldest queued message,
+* ``conflate``    – replace the queued update for the same stream and
+  conid in place (falling back to drop_oldest), the default,
+* ``disconnect``  – close the client; it reconnects and starts fresh.
+
+A client whose oldest queued message is older than WS_CLIENT_MAX_LAG
+seconds is disconnected whatever the policy.
+
+Messages are routed by topic rather than sent to everyone. A topic is
+"<message type>:<account id or conid>": account-scoped streams (pnl,
+ledger, allocation, warmup, portfolio ticks) go to that account's
+clients, instrument-scoped ones (active stock quote, book, chart) to the
+clients showing that conid. Clients join their account's topics on
+connect; the frontend's subscribe_*/unsubscribe_* commands add and remove
+the rest. A message nobody is subscribed to is not even serialised.
+Message types without a routing rule still go to every client.
 """
 import asyncio
+import itertools
 import logging, json
-from typing import Any, Set
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+from config import WS_CLIENT_MAX_LAG, WS_CLIENT_OVERFLOW, WS_CLIENT_QUEUE_MAX
+from metrics import Counter, Gauge, Histogram
 from utils import clean_nan_values
 
 from ibkr import IBKRService
@@ -13,35 +41,254 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from models import WebSocketRequest
 log = logging.getLogger(__name__)
 router = APIRouter()
-_clients: Set[WebSocket] = set()
+
+CONNECTED_CLIENTS = Gauge("ws_connected_clients", "Frontend WebSocket clients connected")
+BROADCAST_SECONDS = Histogram("ws_broadcast_seconds", "Time to fan one payload out to all clients", ("type",),
+                              buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+CLIENT_QUEUE_DEPTH = Gauge("ws_client_queue_depth", "Messages waiting in a client's outbound queue", ("client",))
+CLIENT_LAG = Gauge("ws_client_lag_seconds", "Age of the last message a client was sent when it went out", ("client",))
+SEND_LAG = Histogram("ws_client_send_lag_seconds", "Time messages waited in client queues before being sent",
+                     buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+CLIENT_DROPPED = Counter("ws_client_dropped_total", "Outbound messages dropped or conflated for slow clients",
+                         ("policy",))
+CLIENT_DISCONNECTS = Counter("ws_client_slow_disconnects_total", "Clients disconnected for falling behind",
+                             ("reason",))
+UNDELIVERED = Counter("ws_undelivered_messages_total", "Payloads published with no subscribed client", ("type",))
+TOPIC_COUNT = Gauge("ws_subscribed_topics", "Topics with at least one subscribed client")
+
+OVERFLOW_POLICIES = ("drop_oldest", "conflate", "disconnect")
+CONFLATABLE_TYPES = {"market_data", "active_stock_update"}
+_client_ids = itertools.count(1)
+
+# Message type -> what its topic is scoped by
+ACCOUNT_TYPES = {"market_data", "pnl", "ledger", "allocation", "warmup"}
+CONID_TYPES = {"active_stock_update", "book_data", "chart_update"}
+# Joined on connect; portfolio ticks ("market_data") need subscribe_portfolio
+DEFAULT_ACCOUNT_TYPES = ("pnl", "ledger", "allocation", "warmup")
+STOCK_TYPES = ("active_stock_update", "book_data", "chart_update")
+
+
+def topic(msg_type: str, scope: Any) -> str:
+    return f"{msg_type}:{scope}"
+
+
+def topic_for(payload: Dict[str, Any], account_id: Optional[str]) -> Optional[str]:
+    """The topic a payload is published on; None for unrouted types (sent to everyone)."""
+    msg_type = payload.get("type")
+    if msg_type in CONID_TYPES:
+        scope = payload.get("conid")
+    elif msg_type in ACCOUNT_TYPES:
+        scope = account_id
+    else:
+        return None
+    return topic(msg_type, scope) if scope is not None else None
+
+
+class ClientConnection:
+    """One frontend socket with its own outbound queue and writer task."""
+
+    def __init__(self, ws: WebSocket, account_id: str, max_queue: int = WS_CLIENT_QUEUE_MAX,
+                 policy: str = WS_CLIENT_OVERFLOW, max_lag: float = WS_CLIENT_MAX_LAG):
+        if policy not in OVERFLOW_POLICIES:
+            log.warning("Unknown WS_CLIENT_OVERFLOW %r, using conflate", policy)
+            policy = "conflate"
+        self.ws = ws
+        self.account_id = account_id
+        self.id = f"{account_id}#{next(_client_ids)}"
+        self.topics: Set[str] = set()
+        self.max_queue = max_queue
+        self.policy = policy
+        self.max_lag = max_lag
+        # entries are [text, enqueued_at, conflation key]; lists so conflation can swap the text in place
+        self._queue: Deque[list] = deque()
+        self._by_key: Dict[Tuple[str, Any], list] = {}
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(self._write_loop(), name=f"ws-writer-{self.id}")
+
+    def enqueue(self, text: str, key: Optional[Tuple[str, Any]] = None) -> None:
+        if self.closed:
+            return
+        now = time.monotonic()
+        if self._queue and self.max_lag > 0 and now - self._queue[0][1] > self.max_lag:
+            self.kick("lag")
+            return
+        if key is not None and self.policy == "conflate":
+            queued = self._by_key.get(key)
+            if queued is not None:
+                queued[0] = text   # keeps its place (and age) in the queue, carries the newest state
+                CLIENT_DROPPED.inc(policy="conflate")
+                return
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self.kick("queue_full")
+                return
+            self._forget(self._queue.popleft())
+            CLIENT_DROPPED.inc(policy="drop_oldest")
+        entry = [text, now, key]
+        self._queue.append(entry)
+        if key is not None:
+            self._by_key[key] = entry
+        self._ready.set()
+        CLIENT_QUEUE_DEPTH.set(len(self._queue), client=self.id)
+
+    def _forget(self, entry: list) -> None:
+        if entry[2] is not None and self._by_key.get(entry[2]) is entry:
+            del self._by_key[entry[2]]
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                while not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                entry = self._queue.popleft()
+                self._forget(entry)
+                CLIENT_QUEUE_DEPTH.set(len(self._queue), client=self.id)
+                lag = time.monotonic() - entry[1]
+                SEND_LAG.observe(lag)
+                CLIENT_LAG.set(lag, client=self.id)
+                await self.ws.send_text(entry[0])
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        except Exception as e:
+            log.warning(f"Writer for client {self.id} stopped: {e}")
+        finally:
+            self._detach()
+
+    def kick(self, reason: str) -> None:
+        """Drop a client that can't keep up; it reconnects and is sent a fresh snapshot."""
+        if self.closed:
+            return
+        log.warning(f"Disconnecting slow client {self.id} ({reason}, {len(self._queue)} queued)")
+        CLIENT_DISCONNECTS.inc(reason=reason)
+        self._detach()
+        if self._writer is not None:
+            self._writer.cancel()
+        asyncio.create_task(self._close())
+
+    async def _close(self) -> None:
+        try:
+            await self.ws.close(code=1013, reason="Client too slow")
+        except Exception:
+            pass
+
+    def _detach(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        _clients.pop(self.ws, None)
+        subscriptions.drop(self)
+        self._queue.clear()
+        self._by_key.clear()
+        CONNECTED_CLIENTS.set(len(_clients))
+        CLIENT_QUEUE_DEPTH.remove(client=self.id)
+        CLIENT_LAG.remove(client=self.id)
+
+    async def close(self) -> None:
+        self._detach()
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+
+
+class SubscriptionRegistry:
+    """Which clients want which topics, both ways round."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[ClientConnection]] = {}
+
+    def subscribe(self, client: ClientConnection, *topics: str) -> None:
+        for t in topics:
+            self._subscribers.setdefault(t, set()).add(client)
+            client.topics.add(t)
+        TOPIC_COUNT.set(len(self._subscribers))
+
+    def unsubscribe(self, client: ClientConnection, *topics: str) -> None:
+        for t in topics:
+            client.topics.discard(t)
+            subscribers = self._subscribers.get(t)
+            if subscribers is None:
+                continue
+            subscribers.discard(client)
+            if not subscribers:
+                del self._subscribers[t]
+        TOPIC_COUNT.set(len(self._subscribers))
+
+    def drop(self, client: ClientConnection) -> None:
+        self.unsubscribe(client, *list(client.topics))
+
+    def subscribers(self, t: str) -> Set[ClientConnection]:
+        return self._subscribers.get(t, set())
+
+    def has_subscribers(self, t: str) -> bool:
+        return t in self._subscribers
+
+    def stats(self) -> Dict[str, int]:
+        return {t: len(c) for t, c in self._subscribers.items()}
+
+
+_clients: Dict[WebSocket, ClientConnection] = {}
+subscriptions = SubscriptionRegistry()
+
+
+def apply_command(client: ClientConnection, command: WebSocketRequest) -> bool:
+    """
+    Update the client's subscriptions for a frontend command. Returns False
+    when the command should not reach IBKR: an unsubscribe for an instrument
+    another client is still watching.
+    """
+    action, conid = command.action, command.conid
+    account_id = command.account_id or client.account_id
+    if action == "subscribe_stock" and conid:
+        subscriptions.subscribe(client, *(topic(t, conid) for t in STOCK_TYPES))
+    elif action == "unsubscribe_stock" and conid:
+        subscriptions.unsubscribe(client, *(topic(t, conid) for t in STOCK_TYPES))
+        return not any(subscriptions.has_subscribers(topic(t, conid)) for t in STOCK_TYPES)
+    elif action == "subscribe_portfolio" and account_id:
+        subscriptions.subscribe(client, topic("market_data", account_id))
+    elif action == "unsubscribe_portfolio" and account_id:
+        subscriptions.unsubscribe(client, topic("market_data", account_id))
+        return not subscriptions.has_subscribers(topic("market_data", account_id))
+    elif action == "GET_INITIAL_ALLOCATION" and account_id:
+        subscriptions.subscribe(client, topic("allocation", account_id))
+    return True
+
 
 # ---------- helper wired from IBKRService ----------
-async def broadcast(payload: dict[str, Any]) -> None:
+async def broadcast(payload: dict[str, Any], account_id: Optional[str] = None) -> None:
     """
-    Cleans, serializes, and broadcasts a dictionary payload to all connected clients.
+    Cleans, serializes, and queues a dictionary payload for the clients
+    subscribed to its topic (all clients for unrouted message types).
+    `account_id` scopes account-level messages.
     """
     if not isinstance(payload, dict):
         log.error(f"Broadcast function received non-dict payload: {type(payload)}")
         return
 
+    started = time.perf_counter()
+    msg_type = payload.get("type")
+    t = topic_for(payload, account_id)
+    targets = list(subscriptions.subscribers(t) if t is not None else _clients.values())
+    if not targets:
+        UNDELIVERED.inc(type=str(msg_type or "unknown"))
+        return
+
     # 1. Clean the dictionary to remove any NaN values
     cleaned_payload = clean_nan_values(payload)
     
-    # 2. Convert the clean dictionary to a JSON string
+    # 2. Convert the clean dictionary to a JSON string, once for everyone
     json_string = json.dumps(cleaned_payload)
 
-    # 3. Send the valid JSON string to all clients
-    dead: list[WebSocket] = []
-    for ws in _clients:
-        try:
-            await ws.send_text(json_string)
-        except WebSocketDisconnect:
-            dead.append(ws)
-        except RuntimeError:
-            dead.append(ws)
+    # 3. Hand it to each subscriber's writer; nobody waits on a slow socket here
+    key = (msg_type, payload["conid"]) if msg_type in CONFLATABLE_TYPES and "conid" in payload else None
+    for client in targets:
+        client.enqueue(json_string, key)
 
-    for ws in dead:
-        _clients.discard(ws)  
+    BROADCAST_SECONDS.observe(time.perf_counter() - started, type=str(msg_type or "unknown"))
 
 # ---------- WebSocket endpoint ----------
 @router.websocket("/ws")
@@ -60,7 +307,11 @@ async def ws_endpoint(ws: WebSocket, accountId: str):
     # 2. NOW, accept the client connection.
     await ws.accept()
     
-    _clients.add(ws)
+    client = ClientConnection(ws, accountId)
+    _clients[ws] = client
+    subscriptions.subscribe(client, *(topic(t, accountId) for t in DEFAULT_ACCOUNT_TYPES))
+    client.start()
+    CONNECTED_CLIENTS.set(len(_clients))
     log.info(f"Frontend client connected for account {accountId} ({len(_clients)} total)")
 
     # 3. Send initial data
@@ -79,12 +330,13 @@ async def ws_endpoint(ws: WebSocket, accountId: str):
                 command = WebSocketRequest.model_validate_json(data)
                 if not command.account_id:
                     command.account_id = accountId
-                await svc.handle_ws_command(command)
+                if apply_command(client, command):
+                    await svc.handle_ws_command(command)
             except Exception as e:
                 log.error(f"Failed to process WS command: {data}, error: {e}")
                 
     except (WebSocketDisconnect, RuntimeError):
         pass # Clean disconnect
     finally:
-        _clients.discard(ws)
+        await client.close()
         log.info(f"FE socket left ({len(_clients)} total)")
\ No newline at end of file
@@ -1,28 +1,67 @@
 # ibkr_service.py
 import asyncio
+import json
 import logging
+import re
+import time
 import httpx
-from fastapi import HTTPException
-from typing import Callable, Awaitable
+from typing import Any, Callable, Awaitable, Dict
 
-from config import GATEWAY_BASE_URL
+from barstore import BarStore
+from circuit import FAILURE_STATUSES, CircuitBreaker
+from conflation import Conflator
+from config import GATEWAY_BASE_URL, GATEWAY_JSON_OFFLOAD_BYTES
+from gateway_http import build_gateway_client
+from metrics import Counter, Histogram, endpoint_label
 from rate_control import paced
 from state import IBKRState
+from symbol_index import SymbolIndex
+from tracing import span
+from utils import json_loads
 
 # Import all the mixin classes
 from api.auth import AuthMixin
 from api.market import MarketDataMixin
 from api.orders import OrdersMixin
 from api.account import AccountMixin
+from api.warmup import WarmupMixin
 from ibkr_websocket.handler import WebSocketHandlerMixin
 
 log = logging.getLogger("ibkr.service")
 
+# Idempotent (method, endpoint) pairs whose concurrent identical calls share
+# a single upstream request. Anything not listed always goes to the gateway.
+COALESCE_ENDPOINTS = [
+    ("GET", re.compile(r"^/iserver/marketdata/(snapshot|history)")),
+    ("GET", re.compile(r"^/portfolio/[^/]+/(positions|summary|ledger|allocation|combo/positions)")),
+    ("GET", re.compile(r"^/portfolio/(accounts|subaccounts)$")),
+    ("GET", re.compile(r"^/iserver/accounts$")),
+    ("GET", re.compile(r"^/iserver/account/(orders|trades|pnl/partitioned)$")),
+    ("GET", re.compile(r"^/iserver/(secdef|scanner/params|watchlists?)")),
+    ("GET", re.compile(r"^/trsrv/secdef")),
+    ("GET", re.compile(r"^/acesws/")),
+    ("POST", re.compile(r"^/pa/(performance|summary|transactions)$")),
+]
+
+COALESCED = Counter("ibkr_coalesced_requests_total",
+                    "Calls served by joining an identical in-flight gateway request", ("endpoint",))
+COALESCE_LEADERS = Counter("ibkr_coalesce_leaders_total",
+                           "Coalescable calls that went upstream themselves", ("endpoint",))
+
+REQUEST_SECONDS = Histogram("ibkr_request_seconds", "Gateway round-trip latency", ("method", "endpoint", "status"))
+JSON_DECODE_SECONDS = Histogram("ibkr_json_decode_seconds", "Gateway response JSON decode time", ("mode",),
+                                buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+
+
+def _coalescable(method: str, ep: str) -> bool:
+    return any(m == method and pat.search(ep) for m, pat in COALESCE_ENDPOINTS)
+
 class IBKRService(
     AuthMixin, 
     MarketDataMixin, 
     OrdersMixin, 
     AccountMixin, 
+    WarmupMixin,
     WebSocketHandlerMixin
 ):
     """
@@ -32,19 +71,29 @@ class IBKRService(
     def __init__(self, base_url: str = f"{GATEWAY_BASE_URL}/v1/api"):
         self.base_url = base_url.rstrip("/")
         self.state = IBKRState()
-        self.http = httpx.AsyncClient(
-            base_url=self.base_url, 
-            verify=False,
-            timeout=httpx.Timeout(30.0),
-            headers={"Host": "api.ibkr.com"}
-        )
+        self.http = build_gateway_client(self.base_url)
         self._ws_task: asyncio.Task | None = None
         self._current_ws_account: str | None = None
-        self._broadcast: Callable[[str], Awaitable[None]] | None = None
+        self._broadcast: Callable[..., Awaitable[None]] | None = None
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self.breaker = CircuitBreaker()
+        self.bars = BarStore()
+        self.symbols = SymbolIndex()
+        self._warmup_tasks: Dict[str, asyncio.Task] = {}
+        self._book_rebuilds: Dict[str, asyncio.Task] = {}
+        self.conflator = Conflator(self._publish)
     
-    def set_broadcast(self, cb: Callable[[str], Awaitable[None]]) -> None:
+    def set_broadcast(self, cb: Callable[..., Awaitable[None]]) -> None:
         """Sets the callback function to broadcast messages to clients."""
         self._broadcast = cb
+
+    async def _publish(self, payload: Dict[str, Any], account_id: str | None = None) -> None:
+        """
+        Sends a payload to the clients subscribed to it. Account-scoped
+        messages default to the account the IBKR stream is running for.
+        """
+        if self._broadcast is not None:
+            await self._broadcast(payload, account_id=account_id or self._current_ws_account)
     
     @property
     def _ibkr_ws_session(self):
@@ -57,35 +106,91 @@ class IBKRService(
             await asyncio.sleep(0.1)
 
     # This is the core request helper used by ALL API mixins.
+    async def _req(self, method: str, ep: str, *, raw: bool = False, **kw):
+        """
+        Single-flight front for `_send`: concurrent identical calls to an
+        endpoint in COALESCE_ENDPOINTS await the same upstream request and
+        share its (read-only) result instead of each taking a limiter token.
+
+        With ``raw=True`` the undecoded response body (bytes) is returned,
+        for routes that pass the gateway JSON straight to the frontend.
+        """
+        with span("ibkr.request", **{"http.request.method": method, "url.path": ep,
+                                     "ibkr.endpoint": endpoint_label(ep)}) as s:
+            self.breaker.reject_if_open(ep)  # fail fast instead of queueing for a limiter slot
+            if not _coalescable(method, ep):
+                return await self._send(method, ep, raw=raw, **kw)
+
+            key = (method, ep, raw, json.dumps(kw, sort_keys=True, default=str))
+            task = self._inflight.get(key)
+            if task is not None:
+                COALESCED.inc(endpoint=endpoint_label(ep))
+                s.set_attribute("ibkr.coalesced", True)
+            else:
+                COALESCE_LEADERS.inc(endpoint=endpoint_label(ep))
+                # Own task, so one caller being cancelled doesn't fail the others
+                task = asyncio.create_task(self._send(method, ep, raw=raw, **kw))
+                self._inflight[key] = task
+                task.add_done_callback(lambda t: self._finish_inflight(key, t))
+            return await asyncio.shield(task)
+
+    def _finish_inflight(self, key: tuple, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter was cancelled
+
     @paced("dynamic")
-    async def _req(self, method: str, ep: str, **kw):
-        max_retries = 3
-        initial_retry_delay = 0.5
-        backoff_factor = 2
-
-        for attempt in range(max_retries):
-            current_delay = initial_retry_delay * (backoff_factor ** attempt)
-            try:
+    async def _send(self, method: str, ep: str, raw: bool = False, **kw):
+        """
+        One gateway round trip. Pacing and retries live in `paced`; the
+        outcome feeds the circuit breaker (transport errors and
+        FAILURE_STATUSES count as failures; IBKR's application-level 500s don't).
+        """
+        trial = self.breaker.before_call(ep)
+        started = time.perf_counter()
+        try:
+            with span("ibkr.gateway.call", **{"http.request.method": method}) as call:
                 r = await self.http.request(method, ep, **kw)
-                
-                if r.status_code in [404, 503] and attempt < max_retries - 1:
-                    log.warning(f"Retrying {r.status_code} for {ep}...")
-                    await asyncio.sleep(current_delay)
-                    continue
-
-                if r.status_code >= 400:
-                    log.error("IBKR %s %s → %s (Status: %s)", method, ep, r.text, r.status_code)
-                    r.raise_for_status()
-                
-                return r.json()
-
-            except httpx.ConnectError as e:
-                log.error(f"Connection error on attempt {attempt + 1}: {e}")
-                if attempt >= max_retries - 1:
-                    raise
-                await asyncio.sleep(current_delay)
-            except httpx.HTTPStatusError as e:
-                log.error(f"HTTP Status Error: {e.response.status_code} - {e.response.text}")
-                raise
-
-        raise HTTPException(status_code=500, detail="Request failed after all retries.")
\ No newline at end of file
+                call.set_attribute("http.response.status_code", r.status_code)
+        except httpx.TransportError as e:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=method,
+                                    endpoint=endpoint_label(ep), status=type(e).__name__)
+            self.breaker.record(ep, ok=False, trial=trial)
+            if isinstance(e, httpx.ConnectError):
+                log.error(f"Connection error for {method} {ep}: {e}")
+            raise
+        except BaseException:
+            if trial:
+                self.breaker.release_trial()
+            raise
+
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=method,
+                                endpoint=endpoint_label(ep), status=str(r.status_code))
+        self.breaker.record(ep, ok=r.status_code not in FAILURE_STATUSES, trial=trial)
+        if r.status_code >= 400:
+            log.error("IBKR %s %s → %s (Status: %s)", method, ep, r.text, r.status_code)
+            r.raise_for_status()
+
+        if raw:
+            return r.content
+        return await self._decode(r)
+
+    @staticmethod
+    async def _decode(r: httpx.Response):
+        """
+        Decode a gateway JSON body. Small payloads are parsed inline; large
+        ones (scanner params, multi-page positions, 5Y history, /pa/*) go to a
+        worker thread so the loop keeps dispatching WebSocket ticks.
+        """
+        body = r.content
+        if not body:
+            return None
+        started = time.perf_counter()
+        if len(body) >= GATEWAY_JSON_OFFLOAD_BYTES:
+            data = await asyncio.to_thread(json_loads, body)
+            JSON_DECODE_SECONDS.observe(time.perf_counter() - started, mode="thread")
+        else:
+            data = json_loads(body)
+            JSON_DECODE_SECONDS.observe(time.perf_counter() - started, mode="inline")
+        return data
@@ -0,0 +1,157 @@
+# ibkr_websocket/dispatch.py
+"""
+Receive/dispatch split for the IBKR WebSocket.
+
+The reader only parses frames and hands each message to one of a few
+dispatch shards; workers drain the shards and run the (possibly slow)
+handlers. A message's shard is picked from its conid, so updates for one
+instrument are still handled in the order they arrived, while a slow
+handler for one instrument no longer stops the socket from being read.
+
+Each shard is bounded. When one is full, market-data messages (smd, sbd,
+smh) follow WS_QUEUE_OVERFLOW:
+
+* ``drop_oldest`` – discard the oldest queued market-data message; the
+  newest price is the one worth showing (default),
+* ``drop_newest`` – discard the incoming message,
+* ``block``       – stop reading the socket until the shard has room.
+
+Everything else (orders, P&L, ledger) is never dropped; it blocks instead.
+"""
+import asyncio
+import logging
+import time
+import zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Tuple
+
+from config import WS_DISPATCH_SHARDS, WS_QUEUE_MAX, WS_QUEUE_OVERFLOW
+from metrics import Counter, Gauge, Histogram
+from utils import json_loads
+
+log = logging.getLogger("ibkr.ws.dispatch")
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+DROPPABLE_TOPICS = ("smd+", "sbd+", "smh+")
+
+WS_QUEUE_DEPTH = Gauge("ibkr_ws_queue_depth", "Messages waiting per dispatch shard", ("shard",))
+WS_QUEUE_DROPPED = Counter("ibkr_ws_queue_dropped_total", "Messages dropped on a full dispatch shard",
+                           ("topic", "policy"))
+WS_QUEUE_WAIT_SECONDS = Histogram(
+    "ibkr_ws_queue_wait_seconds", "Time messages spent queued before dispatch", ("topic",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+WS_READER_BLOCKED_SECONDS = Counter("ibkr_ws_reader_blocked_seconds_total",
+                                    "Time the socket reader waited for room in a full shard")
+
+
+def parse_frame(raw: str | bytes) -> List[dict]:
+    """Messages in one WebSocket frame; heartbeats and other non-JSON frames yield none."""
+    try:
+        msgs = json_loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        return []
+    if not isinstance(msgs, list):
+        msgs = [msgs]
+    return [m for m in msgs if isinstance(m, dict)]
+
+
+def _droppable(topic: str) -> bool:
+    return topic.startswith(DROPPABLE_TOPICS)
+
+
+def _topic_label(topic: str) -> str:
+    return topic.split("+", 1)[0] or "none"
+
+
+class _Shard:
+    __slots__ = ("items", "ready", "space")
+
+    def __init__(self):
+        self.items: Deque[Tuple[dict, float]] = deque()   # (message, enqueued at perf_counter)
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+
+
+class MessageDispatcher:
+    def __init__(self, handle: Callable[[dict], Awaitable[Any]], shards: int = WS_DISPATCH_SHARDS,
+                 max_depth: int = WS_QUEUE_MAX, policy: str = WS_QUEUE_OVERFLOW):
+        if policy not in OVERFLOW_POLICIES:
+            log.warning("Unknown WS_QUEUE_OVERFLOW %r, using drop_oldest", policy)
+            policy = "drop_oldest"
+        self._handle = handle
+        self.max_depth = max_depth
+        self.policy = policy
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._workers: List[asyncio.Task] = []
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._work(i), name=f"ibkr-ws-dispatch-{i}")
+                         for i in range(len(self._shards))]
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for i, shard in enumerate(self._shards):
+            shard.items.clear()
+            WS_QUEUE_DEPTH.set(0, shard=str(i))
+
+    # ---------- reader side ----------
+    def shard_for(self, topic: str) -> int:
+        """By conid (last '+' segment) when the topic has one, else by topic."""
+        tail = topic.rsplit("+", 1)[-1]
+        key = int(tail) if tail.isdigit() else zlib.crc32(topic.encode())
+        return key % len(self._shards)
+
+    async def submit(self, msg: dict) -> None:
+        topic = msg.get("topic", "")
+        index = self.shard_for(topic)
+        shard = self._shards[index]
+        if len(shard.items) >= self.max_depth:
+            droppable = _droppable(topic)
+            if droppable and self.policy == "drop_newest":
+                WS_QUEUE_DROPPED.inc(topic=_topic_label(topic), policy=self.policy)
+                return
+            if not (droppable and self.policy == "drop_oldest" and self._drop_oldest(shard)):
+                await self._wait_for_room(shard)
+        shard.items.append((msg, time.perf_counter()))
+        shard.ready.set()
+        WS_QUEUE_DEPTH.set(len(shard.items), shard=str(index))
+
+    def _drop_oldest(self, shard: _Shard) -> bool:
+        """Remove the oldest queued market-data message; False if only undroppable ones are queued."""
+        for i, (queued, _) in enumerate(shard.items):
+            queued_topic = queued.get("topic", "")
+            if _droppable(queued_topic):
+                del shard.items[i]
+                WS_QUEUE_DROPPED.inc(topic=_topic_label(queued_topic), policy=self.policy)
+                return True
+        return False
+
+    async def _wait_for_room(self, shard: _Shard) -> None:
+        started = time.perf_counter()
+        while len(shard.items) >= self.max_depth:
+            shard.space.clear()
+            await shard.space.wait()
+        WS_READER_BLOCKED_SECONDS.inc(time.perf_counter() - started)
+
+    # ---------- workers ----------
+    async def _work(self, index: int) -> None:
+        shard = self._shards[index]
+        label = str(index)
+        while True:
+            while not shard.items:
+                shard.ready.clear()
+                await shard.ready.wait()
+            msg, enqueued = shard.items.popleft()
+            shard.space.set()
+            WS_QUEUE_DEPTH.set(len(shard.items), shard=label)
+            topic = msg.get("topic", "")
+            WS_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - enqueued, topic=_topic_label(topic))
+            try:
+                await self._handle(msg)
+            except Exception:
+                log.exception("Dispatching IBKR message %s failed", topic)
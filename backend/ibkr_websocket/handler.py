@@ -1,19 +1,24 @@
 # websocket/handler.py
 import asyncio
-import json
 import logging
 import math
 import ssl
 import time
 import websockets
-from models import (FrontendMarketDataUpdate, LedgerDTO, LedgerEntry,
+from models import (LedgerDTO, LedgerEntry,
                     LedgerUpdate, PnlRow, PnlUpdate, WebSocketRequest)
-from utils import extract_price_from_snapshot, safe_float_conversion, parse_option_symbol
+from utils import extract_price_from_snapshot, safe_float_conversion
 from config import GATEWAY_BASE_URL
+from metrics import Counter
 from prot import ServiceProtocol
+from ibkr_websocket.dispatch import MessageDispatcher, parse_frame
 
 log = logging.getLogger("ibkr.ws")
 
+WS_MESSAGES = Counter("ibkr_ws_messages_total", "Messages received from the IBKR WebSocket", ("topic",))
+# Orders whose filled quantity is remembered to spot new fills; the least recently filled drop out first
+ORDER_FILLS_MAX = 1000
+
 class WebSocketHandlerMixin:
     # --- WebSocket Task Management ---
     async def initialize_websocket_task(self: ServiceProtocol, account_id: str):
@@ -23,6 +28,7 @@ class WebSocketHandlerMixin:
         log.info(f"Initializing new WebSocket task for account: {account_id}")
         self._current_ws_account = account_id
         self._ws_task = asyncio.create_task(self._websocket_loop(account_id))
+        self.start_warmup(account_id, trigger="websocket")
         
     async def shutdown_websocket_task(self: ServiceProtocol):
         """Signals the websocket loop to terminate and closes the connection."""
@@ -147,9 +153,10 @@ class WebSocketHandlerMixin:
             # Sort the book with the highest price (lowest ask) at the top
             processed_book.sort(key=lambda x: x["price"], reverse=True)
 
-            # Broadcast the cleaned data to the frontend
-            await self._broadcast({
+            # Broadcast the cleaned data to the clients showing this conid ("sbd+{acct}+{conid}")
+            await self._publish({
                 "type": "book_data", # A unique type for the frontend to identify it
+                "conid": int(msg["topic"].rsplit("+", 1)[-1]),
                 "data": processed_book
             })
 
@@ -190,7 +197,7 @@ class WebSocketHandlerMixin:
             )
             
             # 5. Broadcast the correctly formatted update
-            await self._broadcast(
+            await self._publish(
                 LedgerUpdate(data=ledger_dto).model_dump(by_alias=True) # Use by_alias to serialize correctly
             )
         except Exception as e:
@@ -222,10 +229,34 @@ class WebSocketHandlerMixin:
                             rows[key] = PnlRow(**v)
 
         if rows:
-            await self._broadcast(
+            await self._publish(
                 PnlUpdate(type="pnl", data=rows).model_dump()
             )
         
+    async def _dispatch_order_update(self: ServiceProtocol, msg: dict):
+        """
+        'sor' frames carry live-order updates. A new fill changes positions
+        and cash, so the cached views of that account are invalidated.
+        """
+        filled_accounts = set()
+        for order in msg.get("args") or []:
+            if not isinstance(order, dict) or "orderId" not in order:
+                continue
+            order_id = str(order["orderId"])
+            filled = safe_float_conversion(order.get("filledQuantity")) or 0.0
+            # Terminal orders are kept too, so a repeated "Filled" frame isn't a new fill
+            fills = self.state.order_fills
+            if filled > fills.get(order_id, 0.0):
+                fills.pop(order_id, None)   # re-insert so the dict stays ordered by last fill
+                fills[order_id] = filled
+                while len(fills) > ORDER_FILLS_MAX:
+                    del fills[next(iter(fills))]
+                filled_accounts.add(order.get("acct") or self._current_ws_account)
+
+        for account_id in filled_accounts:
+            log.info(f"Order fill on {account_id}, invalidating cached positions and cash")
+            await self.invalidate_account(account_id)
+
     async def _dispatch_chart_data(self: ServiceProtocol, msg: dict):
         """
         Parses a historical market data message ('smh') and broadcasts
@@ -261,7 +292,7 @@ class WebSocketHandlerMixin:
             
             # Only broadcast if there's actual data to send
             if formatted_bars:
-                await self._broadcast({
+                await self._publish({
                     "type": "chart_update",
                     "conid": conid,
                     "data": formatted_bars
@@ -274,58 +305,46 @@ class WebSocketHandlerMixin:
     async def _dispatch_tick(self: ServiceProtocol, msg: dict):
         account_id = self._current_ws_account
         if not account_id: return
-        all_positions = self.state.positions.get(account_id)
-        if all_positions is None:
-            all_positions = await self.positions(account_id)
-        conid_to_pos = {p["conid"]: p for p in all_positions}
-        # 1. Get the price from the real-time message. If there's no price, ignore it.
+        # The book is rebuilt by positions(); a tick only looks its conid up.
+        # While it is being rebuilt (e.g. after a fill) ticks are dropped rather
+        # than holding this dispatch shard on a paginated REST call.
+        book = self.state.position_books.get(account_id)
+        if book is None:
+            self._rebuild_position_book(account_id)
+            return
+
+        cid = int(msg["topic"].split("+", 1)[1])
+        pos = book.get(cid)
+        if pos is None:
+            return
+        # Ticks without a price carry nothing to show
         last_price = extract_price_from_snapshot(msg)
         if last_price is None:
             return
 
-        # 2. Get the contract ID (conid) from the message
-        cid = int(msg["topic"].split("+", 1)[1])
+        await self.conflator.offer("market_data", cid, pos.market_data(
+            last_price,
+            safe_float_conversion(msg.get("83")),
+            safe_float_conversion(msg.get("82")),
+        ))
+    
+    
+    def _rebuild_position_book(self: ServiceProtocol, account_id: str) -> None:
+        """Reload an account's positions (and with them its book) in the background, once at a time."""
+        task = self._book_rebuilds.get(account_id)
+        if task is not None and not task.done():
+            return
 
-        # 3. Make sure we have the full position details for this conid
-        if (pos := conid_to_pos.get(cid)):
-            
-            # 4. Now that we have the details, figure out the correct name
-            asset_class = pos.get("assetClass", "STK")
-            raw_description = pos.get("contractDesc") or str(cid)
+        def _done(t: asyncio.Task) -> None:
+            if self._book_rebuilds.get(account_id) is t:
+                del self._book_rebuilds[account_id]
+            if not t.cancelled() and t.exception() is not None:
+                log.warning(f"Rebuilding positions for {account_id} failed: {t.exception()}")
 
-            if asset_class == 'OPT':
-                # If it's an option, parse it
-                symbol_name = parse_option_symbol(raw_description)
-            else:
-                # Otherwise, just use the stock ticker
-                symbol_name = raw_description
-
-            # 5. Get the rest of the data
-            qty = pos.get("position")
-            cost = pos.get("avgPrice")
-            daily_change_pct = safe_float_conversion(msg.get("83"))
-            change_amount = safe_float_conversion(msg.get("82"))
-            multiplier = 100 if asset_class == "OPT" else 1
-            
-            # 6. Build the final update object with the correct name
-            update = FrontendMarketDataUpdate(
-                conid=cid,
-                symbol=symbol_name,
-                last_price=last_price,
-                quantity=qty,
-                avg_bought_price=cost,
-                daily_change_percent=daily_change_pct,
-                daily_change_amount=change_amount,
-            )
-            
-            if qty is not None and cost is not None:
-                update.value = last_price * qty * multiplier
-                update.unrealized_pnl = (last_price - cost) * qty * multiplier
+        task = asyncio.create_task(self.positions(account_id), name=f"position-book-{account_id}")
+        task.add_done_callback(_done)
+        self._book_rebuilds[account_id] = task
 
-            # 7. Send the update to the frontend
-            await self._broadcast(update.model_dump())
-    
-    
     async def _dispatch_active_stock_update(self: ServiceProtocol, msg: dict):
         """
         Creates and sends ONE rich, detailed update for the single active stock,
@@ -355,41 +374,32 @@ class WebSocketHandlerMixin:
         # Filter out null values to keep the payload clean
         final_payload = {k: v for k, v in update_payload.items() if v is not None}
 
-        await self._broadcast(final_payload)
+        # Rate-capped per conid; frames arriving before the next send are merged into one
+        await self.conflator.offer("active_stock_update", conid, final_payload)
 
-    async def _process_ibkr_message(self: ServiceProtocol, raw_message: str | bytes):
-        """Parses and dispatches a single message from the IBKR WebSocket."""
-        if isinstance(raw_message, bytes):
-            raw_message = raw_message.decode()
-        try:
-            msgs = json.loads(raw_message)
-            if not isinstance(msgs, list):
-                msgs = [msgs]
+    async def _dispatch_message(self: ServiceProtocol, msg: dict):
+        """Routes one parsed IBKR message to its handler (run by the dispatch workers)."""
+        topic = msg.get("topic", "")
+        WS_MESSAGES.inc(topic=topic.split("+", 1)[0] or "none")
+        
+        if topic.startswith("smd+"):
+            conid = int(topic.split("+", 1)[1])
+            if self.state.active_stock_conid and conid == self.state.active_stock_conid:
+                await self._dispatch_active_stock_update(msg)
+            else:
+                await self._dispatch_tick(msg)
+        
+        elif topic == "spl":
+            await self._dispatch_pnl(msg)
 
-            for msg in msgs:
-                if not isinstance(msg, dict):
-                    continue
-                topic = msg.get("topic", "")
-                
-                if topic.startswith("smd+"):
-                    conid = int(topic.split("+", 1)[1])
-                    if self.state.active_stock_conid and conid == self.state.active_stock_conid:
-                        await self._dispatch_active_stock_update(msg)
-                    else:
-                        await self._dispatch_tick(msg)
-                
-                elif topic == "spl":
-                    await self._dispatch_pnl(msg)
-                    
-                elif topic.startswith("sbd+"):
-                    await self._dispatch_book_data(msg)
-                    
-                elif topic.startswith("smh+"):
-                    await self._dispatch_chart_data(msg)
-
-        except (json.JSONDecodeError, UnicodeDecodeError):
-            # This can happen with heartbeat messages, safe to ignore.
-            return
+        elif topic == "sor":
+            await self._dispatch_order_update(msg)
+            
+        elif topic.startswith("sbd+"):
+            await self._dispatch_book_data(msg)
+            
+        elif topic.startswith("smh+"):
+            await self._dispatch_chart_data(msg)
 
     # --- Background Tasks (Private) ---
     async def _ws_heartbeat(self: ServiceProtocol):
@@ -415,10 +425,10 @@ class WebSocketHandlerMixin:
             try:
                 log.info(f"Refreshing account allocation for {account_id}...")
                 fresh_data = await self.account_allocation(account_id)
-                await self._broadcast({
+                await self._publish({
                     "type": "allocation",
                     "data": fresh_data
-                })
+                }, account_id=account_id)
                 await asyncio.sleep(300) # Refresh every 5 minutes
             except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
                 break
@@ -438,10 +448,10 @@ class WebSocketHandlerMixin:
         try:
             data_to_send = await self.account_allocation(account_id)
             
-            await self._broadcast({
+            await self._publish({
                 "type": "allocation",
                 "data": data_to_send
-            })
+            }, account_id=account_id)
             log.info("Successfully sent initial allocation data.")
         except Exception as e:
             log.error(f"Could not send initial allocation data: {e}")
@@ -463,6 +473,7 @@ class WebSocketHandlerMixin:
             # Define tasks as None before the try block
             heartbeat_task = None
             allocation_task = None
+            dispatcher = MessageDispatcher(self._dispatch_message)
             try:
                 log.info(f"Connecting to IBKR WebSocket for account: {account_id}")
                 async with websockets.connect(
@@ -477,13 +488,19 @@ class WebSocketHandlerMixin:
                     self.state.ibkr_websocket_session = ws
                     log.info("✅ IBKR WebSocket connection established.")
 
+                    # Live-order updates drive cache invalidation on fills
+                    await ws.send("sor+{}")
+
                     # --- Start Background Tasks ---
                     heartbeat_task = asyncio.create_task(self._ws_heartbeat())
                     allocation_task = asyncio.create_task(self._ws_allocation_refresher(account_id))
 
                     # --- Main Receive Loop ---
+                    # Only parse and queue here; handlers run on the dispatch workers
+                    dispatcher.start()
                     async for raw in ws:
-                        await self._process_ibkr_message(raw)
+                        for msg in parse_frame(raw):
+                            await dispatcher.submit(msg)
 
             except Exception as exc:
                 log.warning(f"IBKR WS loop error: {exc}")
@@ -496,6 +513,7 @@ class WebSocketHandlerMixin:
                 self.state.pnl_subscribed = False # Reset the flag
 
                 # Safely cancel background tasks
+                await dispatcher.stop()
                 if heartbeat_task and not heartbeat_task.done():
                     heartbeat_task.cancel()
                 if allocation_task and not allocation_task.done():
@@ -0,0 +1,131 @@
+# loopmon.py
+"""
+Event-loop health for the single asyncio loop everything runs on.
+
+* Lag sampler – a task sleeps `interval` seconds and records how late it
+  woke up; that delay is what every tick, heartbeat and route saw too.
+* Slow-callback detector – wraps ``asyncio.Handle._run`` and reports any
+  callback (usually one step of a coroutine) that held the loop longer
+  than the threshold, named after the coroutine it belongs to.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from config import LOOP_LAG_INTERVAL, LOOP_SLOW_CALLBACK_MS
+from metrics import Counter, Gauge, Histogram
+
+log = logging.getLogger("ibkr.loop")
+
+LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Scheduling delay of the loop-lag sampler",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+LOOP_LAG_QUANTILE = Gauge("event_loop_lag_quantile_seconds", "Recent loop lag percentile", ("quantile",))
+SLOW_CALLBACKS = Counter("event_loop_slow_callbacks_total", "Callbacks that blocked the loop too long", ("callback",))
+SLOW_CALLBACK_SECONDS = Counter("event_loop_slow_callback_seconds_total",
+                                "Time the loop was blocked by slow callbacks", ("callback",))
+
+
+def _percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def callback_name(handle: asyncio.Handle) -> str:
+    """Coroutine qualname for task steps, function qualname otherwise."""
+    cb = handle._callback
+    owner = getattr(cb, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return getattr(coro, "__qualname__", None) or type(coro).__name__
+    cb = getattr(cb, "func", cb)  # functools.partial
+    return getattr(cb, "__qualname__", None) or repr(cb)
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, slow_callback_ms: float = LOOP_SLOW_CALLBACK_MS,
+                 window: int = 1200):
+        self.interval = interval
+        self.slow_callback_s = slow_callback_ms / 1000
+        self._lags: Deque[float] = deque(maxlen=window)
+        self.recent_slow: Deque[dict] = deque(maxlen=50)
+        self._task: Optional[asyncio.Task] = None
+        self._orig_run = None
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sample(), name="loop-lag-sampler")
+        if self.slow_callback_s > 0 and self._orig_run is None:
+            self._install_hook()
+
+    async def stop(self) -> None:
+        if self._orig_run is not None:
+            asyncio.Handle._run = self._orig_run
+            self._orig_run = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ---------- lag sampler ----------
+    async def _sample(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self._lags.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            if len(self._lags) % 20 == 0:
+                ordered = sorted(self._lags)
+                LOOP_LAG_QUANTILE.set(_percentile(ordered, .5), quantile="0.5")
+                LOOP_LAG_QUANTILE.set(_percentile(ordered, .99), quantile="0.99")
+
+    # ---------- slow-callback detector ----------
+    def _install_hook(self) -> None:
+        monitor = self
+        orig_run = self._orig_run = asyncio.Handle._run
+        threshold = self.slow_callback_s
+
+        def _run(handle: asyncio.Handle):
+            started = time.perf_counter()
+            try:
+                return orig_run(handle)
+            finally:
+                took = time.perf_counter() - started
+                if took >= threshold:
+                    monitor._report_slow(handle, took)
+
+        asyncio.Handle._run = _run
+
+    def _report_slow(self, handle: asyncio.Handle, took: float) -> None:
+        name = callback_name(handle)
+        SLOW_CALLBACKS.inc(callback=name)
+        SLOW_CALLBACK_SECONDS.inc(took, callback=name)
+        self.recent_slow.append({"callback": name, "ms": round(took * 1000, 1), "at": time.time()})
+        log.warning("Event loop blocked for %.0fms by %s", took * 1000, name)
+
+    # ---------- reporting ----------
+    def stats(self) -> dict:
+        ordered = sorted(self._lags)
+        return {
+            "interval_s": self.interval,
+            "samples": len(ordered),
+            "lag_ms": {
+                "p50": round(_percentile(ordered, .5) * 1000, 2),
+                "p99": round(_percentile(ordered, .99) * 1000, 2),
+                "max": round((ordered[-1] if ordered else 0.0) * 1000, 2),
+            },
+            "slow_callback_threshold_ms": self.slow_callback_s * 1000,
+            "recent_slow_callbacks": list(self.recent_slow),
+        }
+
+
+monitor = LoopMonitor()
@@ -2,6 +2,7 @@ import logging
 
 from fastapi.responses import JSONResponse
 from rate_control import RateLimitExceededException
+from circuit import CircuitOpenException
 
 # ---- global logging setup *first* ----
 logging.basicConfig(
@@ -10,7 +11,7 @@ logging.basicConfig(
 )
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request
 from ibkr import IBKRService
 from models import AuthStatusDTO
 from starlette.middleware.cors import CORSMiddleware
@@ -21,8 +22,14 @@ from routers.watchlist import router as watchlist_router
 from routers.account_transactions import router as transactions_router
 from routers.scanner import router as scanner_router
 from routers.ai_service import router as ai_router
+from routers.metrics import router as metrics_router
+from routers.admin import router as admin_router
+from routers.streams import router as streams_router
 # --- Global instances and config loading ---
 from deps import get_ibkr_service
+from tracing import span, enabled as tracing_enabled
+from loopmon import monitor as loop_monitor
+from cache import track_response_age
 
 
 @asynccontextmanager
@@ -30,9 +37,13 @@ async def lifespan(app: FastAPI):
     svc = IBKRService()
     svc.set_broadcast(broadcast) 
     app.state.ibkr = svc 
+    loop_monitor.start()
     yield
     print("Application shutdown: Cleaning up IBKR resources.")
     await app.state.ibkr.shutdown_websocket_task()
+    await app.state.ibkr.conflator.stop()
+    app.state.ibkr.symbols.close()
+    await loop_monitor.stop()
 
     
 app = FastAPI(lifespan=lifespan)
@@ -49,12 +60,56 @@ async def rate_limit_exception_handler(request, exc: RateLimitExceededException)
         headers={"Retry-After": str(exc.retry_after)} if exc.retry_after else {}
     )
 
+@app.exception_handler(CircuitOpenException)
+async def circuit_open_exception_handler(request, exc: CircuitOpenException):
+    return JSONResponse(
+        status_code=503,
+        content={
+            "error": "gateway_unavailable",
+            "message": "IBKR gateway is unavailable, failing fast until it recovers",
+            "retry_after": exc.retry_after,
+        },
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Root span per HTTP request; the trace id is echoed back as X-Trace-Id."""
+    if not tracing_enabled():
+        return await call_next(request)
+    with span(f"{request.method} {request.url.path}", **{
+        "http.request.method": request.method,
+        "url.path": request.url.path,
+        "url.query": request.url.query,
+    }) as root:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            # Low-cardinality name, e.g. "GET /market/stock/{conid}/details"
+            root.name = f"{request.method} {route.path}"
+            root.set_attribute("http.route", route.path)
+        root.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            root.status = "ERROR"
+        response.headers["X-Trace-Id"] = root.trace_id
+        return response
+
+@app.middleware("http")
+async def cache_age_header(request: Request, call_next):
+    """X-Cache-Age: age in seconds of the oldest cached value the response was built from."""
+    ages = track_response_age()
+    response = await call_next(request)
+    if ages["age"] is not None:
+        response.headers["X-Cache-Age"] = str(int(ages["age"]))
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173"],
     allow_credentials=True, 
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache-Age", "X-Trace-Id"],
 )
 app.include_router(ws_router)
 app.include_router(market_router)    
@@ -63,6 +118,9 @@ app.include_router(watchlist_router)
 app.include_router(transactions_router)
 app.include_router(scanner_router)
 app.include_router(ai_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
+app.include_router(streams_router)
 
 
 @app.get("/auth/status", response_model=AuthStatusDTO)
@@ -74,6 +132,18 @@ async def auth_status(svc: IBKRService = Depends(get_ibkr_service)):
     """
     return await svc.check_and_authenticate()
 
+@app.get("/health/gateway")
+async def gateway_health(svc: IBKRService = Depends(get_ibkr_service)):
+    """Circuit breaker and connection pool state for the gateway REST client."""
+    transport = svc.http._transport
+    pool = transport.pool_stats() if hasattr(transport, "pool_stats") else None
+    return {**svc.breaker.snapshot(), "pool": pool}
+
+@app.get("/debug/loop")
+async def loop_health():
+    """Event-loop lag percentiles and the most recent callbacks that blocked the loop."""
+    return loop_monitor.stats()
+
 @app.post("/auth/logout")
 async def logout(svc: IBKRService = Depends(get_ibkr_service)):
     """
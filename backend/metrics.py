@@ -0,0 +1,160 @@
+# metrics.py
+"""
+Tiny in-process metrics registry (Prometheus naming, no client library).
+Metrics register themselves on creation; ``snapshot()`` dumps current
+values and ``render_text()`` emits the Prometheus text exposition format.
+"""
+import re
+import threading
+from typing import Dict, Tuple
+
+LabelKey = Tuple[str, ...]
+
+REGISTRY: Dict[str, "_Metric"] = {}
+
+_ID_SEGMENT = re.compile(r"/(?:[A-Z]{1,3}\d{3,}|\d+|[0-9a-f]{8,}(?:-[0-9a-f]+)*)(?=/|$)")
+
+
+def endpoint_label(ep: str) -> str:
+    """
+    Collapse ids in a gateway path so it is safe to use as a label value.
+    "/portfolio/U1234567/positions/0" -> "/portfolio/{id}/positions/{id}"
+    """
+    return _ID_SEGMENT.sub("/{id}", ep.split("?", 1)[0])
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Dict[LabelKey, float]:
+        return dict(self._values)
+
+    def remove(self, **labels) -> None:
+        """Forget one label set (e.g. a per-client series once the client is gone)."""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [count per bucket..., +Inf count, sum]
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[len(self.buckets)] if series else 0
+
+    def samples(self) -> Dict[LabelKey, float]:
+        """Mean per label set (full buckets are available via `series`)."""
+        return {k: (s[-1] / s[len(self.buckets)] if s[len(self.buckets)] else 0.0) for k, s in self._series.items()}
+
+    def series(self) -> Dict[LabelKey, list]:
+        return {k: list(v) for k, v in self._series.items()}
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """{metric_name: {"label=value,...": value}} for every registered metric."""
+    out: Dict[str, Dict[str, float]] = {}
+    for name, metric in REGISTRY.items():
+        out[name] = {
+            ",".join(f"{n}={v}" for n, v in zip(metric.labelnames, key)): val
+            for key, val in metric.samples().items()
+        }
+    return out
+
+
+def _fmt_labels(names: Tuple[str, ...], values: LabelKey, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+_INF = 'le="+Inf"'
+
+
+def render_text() -> str:
+    """All registered metrics in Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        lines.append(f"# HELP {name} {metric.doc}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if isinstance(metric, Histogram):
+            for key, series in sorted(metric.series().items()):
+                for bound, count in zip(metric.buckets, series):
+                    le = f'le="{_fmt_value(bound)}"'
+                    lines.append(f"{name}_bucket{_fmt_labels(metric.labelnames, key, le)} {count}")
+                total = series[len(metric.buckets)]
+                lines.append(f"{name}_bucket{_fmt_labels(metric.labelnames, key, _INF)} {total}")
+                lines.append(f"{name}_sum{_fmt_labels(metric.labelnames, key)} {_fmt_value(series[-1])}")
+                lines.append(f"{name}_count{_fmt_labels(metric.labelnames, key)} {total}")
+        else:
+            for key, value in sorted(metric.samples().items()):
+                lines.append(f"{name}{_fmt_labels(metric.labelnames, key)} {_fmt_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,64 @@
+# position_book.py
+"""
+Positions keyed by conid, in the shape the tick path needs.
+
+Built once per positions() refresh; every streamed tick is then a dict
+lookup plus a few multiplications instead of re-indexing the whole
+positions list, re-parsing option descriptions and validating a pydantic
+model per message.
+"""
+from typing import Any, Dict, Iterable, Optional
+
+from utils import parse_option_symbol
+
+
+class PositionRecord:
+    """What a market-data update needs to know about one held contract."""
+    __slots__ = ("conid", "symbol", "asset_class", "multiplier", "quantity", "avg_price")
+
+    def __init__(self, row: Dict[str, Any]):
+        self.conid = int(row["conid"])
+        self.asset_class = row.get("assetClass", "STK")
+        description = row.get("contractDesc") or str(self.conid)
+        self.symbol = parse_option_symbol(description) if self.asset_class == "OPT" else description
+        self.multiplier = 100 if self.asset_class == "OPT" else 1
+        qty, cost = row.get("position"), row.get("avgPrice")
+        self.quantity = float(qty) if qty is not None else None
+        self.avg_price = float(cost) if cost is not None else None
+
+    def market_data(self, last_price: float, change_percent: Optional[float],
+                    change_amount: Optional[float]) -> Dict[str, Any]:
+        """Same dict as FrontendMarketDataUpdate(...).model_dump() for this position."""
+        value = unrealized = None
+        if self.quantity is not None and self.avg_price is not None:
+            value = last_price * self.quantity * self.multiplier
+            unrealized = (last_price - self.avg_price) * self.quantity * self.multiplier
+        return {
+            "type": "market_data",
+            "conid": self.conid,
+            "symbol": self.symbol,
+            "last_price": last_price,
+            "daily_change_percent": change_percent,
+            "daily_change_amount": change_amount,
+            "quantity": self.quantity,
+            "avg_bought_price": self.avg_price,
+            "value": value,
+            "unrealized_pnl": unrealized,
+        }
+
+
+class PositionBook:
+    """One account's positions by conid."""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]] = ()):
+        self._by_conid: Dict[int, PositionRecord] = {}
+        for row in rows:
+            if row.get("conid") is not None:
+                record = PositionRecord(row)
+                self._by_conid[record.conid] = record
+
+    def __len__(self) -> int:
+        return len(self._by_conid)
+
+    def get(self, conid: int) -> Optional[PositionRecord]:
+        return self._by_conid.get(conid)
@@ -2,7 +2,11 @@
 import asyncio
 from typing import Protocol, Awaitable, Callable, Any, Dict, List, Optional
 import httpx
+from barstore import BarStore
+from circuit import CircuitBreaker
+from conflation import Conflator
 from state import IBKRState
+from symbol_index import SymbolIndex
 from models import AuthStatusDTO # <-- Add any models used in method signatures
 
 class ServiceProtocol(Protocol):
@@ -14,13 +18,22 @@ class ServiceProtocol(Protocol):
     # --- Attributes from IBKRService.__init__ ---
     state: IBKRState
     http: httpx.AsyncClient
+    breaker: CircuitBreaker
+    bars: BarStore
+    conflator: Conflator
+    symbols: SymbolIndex
+    _warmup_tasks: Dict[str, asyncio.Task]
+    _book_rebuilds: Dict[str, asyncio.Task]
     _ws_task: Optional[asyncio.Task]
     _current_ws_account: Optional[str]
-    _broadcast: Callable[[Dict[str, Any]], Awaitable[None]]
+    _broadcast: Callable[..., Awaitable[None]]
 
     # --- Core Method from IBKRService ---
-    async def _req(self, method: str, ep: str, **kw) -> Any:
+    async def _req(self, method: str, ep: str, *, raw: bool = False, **kw) -> Any:
         ...
+    async def _send(self, method: str, ep: str, raw: bool = False, **kw) -> Any:
+        ...
+    async def _publish(self, payload: Dict[str, Any], account_id: Optional[str] = None) -> None: ...
 
     # --- Methods from AuthMixin ---
     async def sso_validate(self) -> bool: ...
@@ -30,6 +43,9 @@ class ServiceProtocol(Protocol):
     async def check_and_authenticate(self) -> AuthStatusDTO: ...
     async def logout(self) -> dict: ...
 
+    # --- Methods from MarketDataMixin ---
+    async def search(self, symbol, name=False, secType=""): ...
+
     # --- Methods from WebSocketHandlerMixin ---
     async def initialize_websocket_task(self, account_id: str) -> None: ...
     async def shutdown_websocket_task(self) -> None: ...
@@ -39,10 +55,11 @@ class ServiceProtocol(Protocol):
     async def _dispatch_pnl(self , msg ): ...
     async def _dispatch_chart_data(self , msg ): ...
     async def _dispatch_tick(self , msg ): ...
+    def _rebuild_position_book(self, account_id: str) -> None: ...
     async def _dispatch_active_stock_update(self , msg ): ...
     async def _ws_heartbeat(self): ...
     async def _websocket_loop(self, account_id): ...
-    async def _process_ibkr_message(self, raw_message): ...
+    async def _dispatch_message(self, msg: dict): ...
     async def _send_initial_allocation(self, account_id): ...
     async def _ws_allocation_refresher(self, account_id: str): ...
 
@@ -53,4 +70,9 @@ class ServiceProtocol(Protocol):
     
     # --- Methods from AccountMixin ---
     async def positions(self, account_id: str): ...
+    async def invalidate_account(self, account_id: Optional[str] = None) -> None: ...
     async def account_allocation(self, account_id: str): ...
+
+    # --- Methods from WarmupMixin ---
+    def start_warmup(self, account_id: Optional[str] = None, trigger: str = "auth") -> None: ...
+    def warmup_status(self, account_id: str) -> Optional[Dict[str, Any]]: ...
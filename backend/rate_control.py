@@ -1,11 +1,20 @@
 # rate_control.py
 import asyncio
+import heapq
+import itertools
 import os
+import random
 import re
 import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
 from functools import wraps
+import httpx
 from aiolimiter import AsyncLimiter
 from httpx import Response
+from metrics import Counter, Gauge, Histogram, endpoint_label
+from tracing import current_span, span
 
 log = logging.getLogger(__name__)
 
@@ -20,68 +29,318 @@ class RateLimitExceededException(Exception):
 GLOBAL = AsyncLimiter(10, 1)            # 10 req / 1 s
 ONE_PER_SEC   = AsyncLimiter(1, 1)
 ONE_PER_5SEC  = AsyncLimiter(1, 5)
-ONE_PER_15MIN = AsyncLimiter(1, 900)    # 1 req per 15 minutes (900 seconds)
 FIVE_CONCUR   = AsyncLimiter(5, 1)      # concurrency gate, not RPS
+# 1 req per 15 minutes (900 seconds), each endpoint on its own budget
+PA_PERFORMANCE = AsyncLimiter(1, 900)
+PA_SUMMARY     = AsyncLimiter(1, 900)
+SCANNER_PARAMS = AsyncLimiter(1, 900)
+# /pa/transactions takes one conid per call and the transactions route asks
+# for every held conid, so these calls queue instead of failing fast
+PA_TRANSACTIONS = AsyncLimiter(1, 1)
+# Limiters that reject with RateLimitExceededException instead of queueing
+FAIL_FAST_LIMITERS = {PA_PERFORMANCE, PA_SUMMARY, SCANNER_PARAMS}
 
 ENDPOINT_LIMITERS = {
     re.compile(r"/iserver/marketdata/snapshot"): GLOBAL,
     re.compile(r"/iserver/marketdata/history"):  FIVE_CONCUR,
     re.compile(r"/iserver/account/(orders|pnl|trades)"): ONE_PER_5SEC,
     re.compile(r"/portfolio/(accounts|subaccounts)"): ONE_PER_5SEC,
-    re.compile(r"/pa/(performance|summary|transactions)"): ONE_PER_15MIN,
-    re.compile(r"/iserver/scanner/params"): ONE_PER_15MIN,
+    re.compile(r"/pa/performance"): PA_PERFORMANCE,
+    re.compile(r"/pa/summary"): PA_SUMMARY,
+    re.compile(r"/pa/transactions"): PA_TRANSACTIONS,
+    re.compile(r"/iserver/scanner/params"): SCANNER_PARAMS,
     re.compile(r"/fyi/"): ONE_PER_SEC,
     re.compile(r"/tickle$"): ONE_PER_SEC,
 }
 
+LIMITER_NAMES = {
+    GLOBAL: "global",
+    ONE_PER_SEC: "one_per_sec",
+    ONE_PER_5SEC: "one_per_5sec",
+    FIVE_CONCUR: "five_concur",
+    PA_PERFORMANCE: "pa_performance",
+    PA_SUMMARY: "pa_summary",
+    PA_TRANSACTIONS: "pa_transactions",
+    SCANNER_PARAMS: "scanner_params",
+}
+
+LIMITER_WAIT_SECONDS = Histogram("ibkr_limiter_wait_seconds", "Time spent waiting for a limiter token",
+                                 ("limiter", "priority"))
+LIMITER_QUEUE_DEPTH = Gauge("ibkr_limiter_queue_depth", "Callers queued behind a limiter", ("limiter",))
+
+# ------- priority classes (lower value is served first) -------
+class Priority(IntEnum):
+    ORDER = 0      # place / modify / cancel / reply / whatif
+    QUOTE = 1      # snapshots
+    DEFAULT = 2    # accounts, portfolio, secdef, …
+    HISTORY = 3
+    SCANNER = 4
+
+ENDPOINT_PRIORITIES = {
+    re.compile(r"/iserver/account/[^/]+/orders?(/|$)"): Priority.ORDER,
+    re.compile(r"/iserver/reply/"): Priority.ORDER,
+    re.compile(r"/iserver/marketdata/snapshot"): Priority.QUOTE,
+    re.compile(r"/iserver/marketdata/history"): Priority.HISTORY,
+    re.compile(r"/iserver/scanner/"): Priority.SCANNER,
+}
+
+
+class PriorityGate:
+    """
+    Hands out an AsyncLimiter's capacity strictly by priority, FIFO within a
+    priority class. Callers only queue here when the limiter is exhausted or
+    others are already waiting; a single drain task feeds them in order.
+    """
+    def __init__(self, limiter: AsyncLimiter, name: str):
+        self.limiter = limiter
+        self.name = name
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._drainer: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority: int = Priority.DEFAULT) -> None:
+        if not self._waiters and self.limiter.has_capacity():
+            await self.limiter.acquire()
+            LIMITER_WAIT_SECONDS.observe(0.0, limiter=self.name, priority=Priority(priority).name)
+            return
+        started = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        LIMITER_QUEUE_DEPTH.set(self.depth, limiter=self.name)
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        try:
+            await fut
+        finally:
+            LIMITER_QUEUE_DEPTH.set(self.depth, limiter=self.name)
+        LIMITER_WAIT_SECONDS.observe(time.perf_counter() - started, limiter=self.name,
+                                     priority=Priority(priority).name)
+
+    async def _drain(self) -> None:
+        while True:
+            # Drop waiters that gave up (cancelled) before spending a token on them
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                return
+            # Wait for capacity without taking it, so a token is only spent
+            # once there is still someone to hand it to
+            if not self.limiter.has_capacity():
+                await asyncio.sleep(max(0.001, seconds_until_capacity(self.limiter)))
+                continue
+            await self.limiter.acquire()   # has capacity: returns without yielding
+            _, _, fut = heapq.heappop(self._waiters)
+            fut.set_result(None)
+
+
+GATES = {limiter: PriorityGate(limiter, name) for limiter, name in LIMITER_NAMES.items()}
+
+
+def resolve_limiter(ep: str) -> AsyncLimiter:
+    return next((l for pat, l in ENDPOINT_LIMITERS.items() if pat.search(ep)), GLOBAL)
+
+
+def resolve_priority(ep: str) -> Priority:
+    return next((p for pat, p in ENDPOINT_PRIORITIES.items() if pat.search(ep)), Priority.DEFAULT)
+
+
+def seconds_until_capacity(limiter: AsyncLimiter) -> float:
+    """How long until `limiter` can admit one more request."""
+    if limiter.has_capacity():  # also leaks the bucket up to now
+        return 0.0
+    # aiolimiter has no public "time to next token"; its bucket level is read
+    # when present (1.x), otherwise callers re-check after one token's interval
+    level, rate = getattr(limiter, "_level", None), getattr(limiter, "_rate_per_sec", None)
+    if isinstance(level, (int, float)) and isinstance(rate, (int, float)) and rate > 0:
+        return max(0.0, (level + 1 - limiter.max_rate) / rate)
+    return limiter.time_period / limiter.max_rate
+
+
+async def acquire_slot(ep: str, limiter: AsyncLimiter, priority: Priority) -> None:
+    """Take a token from the endpoint's own limiter, then from GLOBAL."""
+    with span("ibkr.limiter.acquire", **{"ibkr.limiter": LIMITER_NAMES.get(limiter, "unknown"),
+                                         "ibkr.priority": Priority(priority).name}):
+        if limiter is not GLOBAL:
+            await GATES[limiter].acquire(priority)
+        await GATES[GLOBAL].acquire(priority)
+
+
+# ------- retry policy -------
+RETRIES = Counter("ibkr_retries_total", "Gateway calls retried", ("endpoint", "reason"))
+BACKOFF_SECONDS = Counter("ibkr_retry_backoff_seconds_total", "Time spent backing off before retries", ("endpoint",))
+BUDGET_EXHAUSTED = Counter("ibkr_retry_budget_exhausted_total",
+                           "Retries skipped because the endpoint's retry budget was empty", ("endpoint",))
+
+# Failures that happen before the request reaches the gateway – always safe to retry
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    retry_statuses: frozenset = frozenset({404, 429, 503})
+    retry_read_errors: bool = True     # read timeouts / dropped connections mid-response
+    max_retry_after: float = 60.0      # a longer Retry-After is surfaced to the client instead
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given 0-based attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+DEFAULT_RETRY = RetryPolicy()
+
+ENDPOINT_RETRY_POLICIES = {
+    # Order writes are not idempotent: only retry what the gateway provably never processed
+    re.compile(r"/iserver/account/[^/]+/orders?(/|$)"): RetryPolicy(retry_statuses=frozenset({429}), retry_read_errors=False),
+    re.compile(r"/iserver/reply/"): RetryPolicy(retry_statuses=frozenset({429}), retry_read_errors=False),
+    # One call per 15 minutes – a retry would only trip the fail-fast guard
+    re.compile(r"/pa/(performance|summary)|/iserver/scanner/params"): RetryPolicy(max_attempts=1),
+}
+
+
+@dataclass
+class RetryBudget:
+    """
+    Token bucket bounding retries per endpoint: every request deposits
+    `ratio` tokens, every retry withdraws one, and `min_per_sec` keeps a
+    trickle available at low traffic. Stops retry storms from amplifying
+    an outage.
+    """
+    ratio: float = 0.2
+    min_per_sec: float = 0.5
+    cap: float = 10.0
+    tokens: float = 10.0
+    _stamp: float = field(default_factory=time.monotonic)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + (now - self._stamp) * self.min_per_sec)
+        self._stamp = now
+
+    def record_request(self) -> None:
+        self._refill()
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+_budgets: dict[str, RetryBudget] = {}
+
+
+def resolve_retry_policy(ep: str) -> RetryPolicy:
+    return next((p for pat, p in ENDPOINT_RETRY_POLICIES.items() if pat.search(ep)), DEFAULT_RETRY)
+
+
+def retry_budget(ep: str) -> RetryBudget:
+    return _budgets.setdefault(endpoint_label(ep), RetryBudget())
+
+
+def _retry_after(resp: Response) -> float | None:
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _retry_delay(policy: RetryPolicy, exc: Exception, attempt: int) -> tuple[float, str] | None:
+    """(delay, reason) if `exc` is retryable under `policy`, else None."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        if status not in policy.retry_statuses:
+            return None
+        delay = policy.backoff(attempt)
+        if status == 429:
+            delay = max(delay, _retry_after(exc.response) or 0.0)
+        return delay, str(status)
+    if isinstance(exc, _CONNECT_ERRORS):
+        return policy.backoff(attempt), "connect"
+    if isinstance(exc, httpx.TransportError) and policy.retry_read_errors:
+        return policy.backoff(attempt), "transport"
+    return None
+
 PAID_ENDPOINTS = {
     "/md/regsnapshot",
 }
 
 ALLOW_PAID = os.getenv("ALLOW_PAID_ENDPOINTS") == "1"
 
-def paced(endpoint: str):
+def paced(endpoint: str = "dynamic"):
     """
-    Decorator for IBKRService._make_request – injects pacing, 429 retry,
-    and paid-endpoint guard.
+    Decorator for IBKRService._send – injects pacing, retries (per
+    ENDPOINT_RETRY_POLICIES, bounded by a per-endpoint RetryBudget) and
+    the paid-endpoint guard.
+
+    With "dynamic" the limiter and priority class are resolved from the
+    actual `ep` of every call; any other value pins them at decoration time.
     """
-    limiter = next((l for pat, l in ENDPOINT_LIMITERS.items() if pat.search(endpoint)), GLOBAL)
-    
+    pinned = None if endpoint == "dynamic" else (resolve_limiter(endpoint), resolve_priority(endpoint))
+
     def decorator(fn):
         @wraps(fn)
         async def wrapper(self, method: str, ep: str, **kw) -> Response:
             # paid-call guard
             if any(ep.startswith(p) for p in PAID_ENDPOINTS) and not ALLOW_PAID:
                 raise RuntimeError(f"Paid IBKR endpoint blocked: {ep}")
-            
-            # Check if we can acquire the limiter without blocking
-            if not limiter.has_capacity:
-                # For 15-minute limits, don't wait - throw an error immediately
-                if limiter == ONE_PER_15MIN:
-                    raise RateLimitExceededException(
-                        endpoint=ep, 
-                        retry_after=int(limiter.time_to_next_reset)
-                    )
-            
-            async with limiter:
+
+            limiter, priority = pinned or (resolve_limiter(ep), resolve_priority(ep))
+
+            # For 15-minute limits, don't queue - throw an error immediately
+            if limiter in FAIL_FAST_LIMITERS and not limiter.has_capacity():
+                raise RateLimitExceededException(
+                    endpoint=ep,
+                    retry_after=int(seconds_until_capacity(limiter)) + 1
+                )
+
+            policy = resolve_retry_policy(ep)
+            budget = retry_budget(ep)
+            budget.record_request()
+            label = endpoint_label(ep)
+
+            attempt = 0
+            while True:
+                await acquire_slot(ep, limiter, priority)
                 try:
-                    resp: Response = await fn(self, method, ep, **kw)
-                    return resp
-                except Exception as e:
-                    # Handle 429 with exponential back-off
-                    if getattr(e, "response", None) and e.response.status_code == 429:
-                        retry_after = int(e.response.headers.get("Retry-After", "15"))
-                        
+                    return await fn(self, method, ep, **kw)
+                except Exception as exc:
+                    if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429:
+                        retry_after = _retry_after(exc.response)
                         # For critical rate limits, don't retry - inform the client
-                        if retry_after > 60:  # More than 1 minute
+                        if retry_after and retry_after > policy.max_retry_after:
+                            raise RateLimitExceededException(endpoint=ep, retry_after=int(retry_after)) from exc
+
+                    decision = _retry_delay(policy, exc, attempt)
+                    if decision is None:
+                        raise
+                    if attempt + 1 >= policy.max_attempts:
+                        if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429:
                             raise RateLimitExceededException(
-                                endpoint=ep,
-                                retry_after=retry_after
-                            )
-                        
-                        log.warning("429 received for %s – sleeping %ss", ep, retry_after)
-                        await asyncio.sleep(retry_after)
-                        return await wrapper(self, method, ep, **kw)
-                    raise
+                                endpoint=ep, retry_after=int(_retry_after(exc.response) or 1)
+                            ) from exc
+                        raise
+                    if not budget.try_spend():
+                        BUDGET_EXHAUSTED.inc(endpoint=label)
+                        log.warning("Retry budget exhausted for %s, giving up", ep)
+                        raise
+
+                    delay, reason = decision
+                    RETRIES.inc(endpoint=label, reason=reason)
+                    current_span().add_event("retry", reason=reason, delay_s=round(delay, 3), attempt=attempt + 2)
+                    BACKOFF_SECONDS.inc(delay, endpoint=label)
+                    log.warning("Retrying %s %s (%s) in %.2fs [attempt %d/%d]",
+                                method, ep, reason, delay, attempt + 2, policy.max_attempts)
+                    # Sleep outside the limiter: the next attempt queues for a fresh slot
+                    await asyncio.sleep(delay)
+                    attempt += 1
         return wrapper
     return decorator
\ No newline at end of file
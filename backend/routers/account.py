@@ -211,4 +211,11 @@ async def get_pnl_snapshot(
     if latest_valid_pnl_dto:
         return latest_valid_pnl_dto
     else:
-        raise HTTPException(status_code=500, detail="An unrecoverable error occurred and no PnL data could be retrieved.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="An unrecoverable error occurred and no PnL data could be retrieved.")
+
+@router.get("/warmup", summary="Cache warmup progress for an account")
+async def get_warmup_status(accountId: str, svc: IBKRService = Depends(get_ibkr_service)):
+    status = svc.warmup_status(accountId)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No cache warmup has run for account {accountId}.")
+    return status
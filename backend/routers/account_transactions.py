@@ -3,7 +3,7 @@ from __future__ import annotations
 import asyncio
 import logging
 from typing import Any, Dict, List
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
 from models import Order
 from deps import get_ibkr_service
@@ -29,7 +29,8 @@ async def get_transactions(
 
     Internally we:
     1.  Pull the current positions ⇒ unique **conids**.
-    2.  POST `/pa/transactions` once per conid (IBKR only accepts one at a time).
+    2.  POST `/pa/transactions` once per conid (IBKR only accepts one at a time);
+        the calls queue behind that endpoint's own limiter rather than failing fast.
     3.  Aggregate the `transactions` and P/L (`pnl`) data from all calls.
     4.  Return a dictionary containing both lists, as expected by the frontend.
     """
@@ -59,7 +60,7 @@ async def get_transactions(
             # The raw response contains 'transactions' and 'rpnl' keys
             return await ibkr_service._req("POST", "/pa/transactions", json=payload)
 
-        # Use asyncio.gather to run all API calls in parallel for efficiency
+        # Issued together; the /pa/transactions limiter paces them one after another
         results = await asyncio.gather(*(fetch_for_conid(c) for c in conids_list), return_exceptions=True)
         
         # Filter out exceptions and log failed conids
@@ -106,14 +107,16 @@ async def get_trades(
     """
     try:
         # This endpoint is simpler and fetches all recent trades in one go.
-        # It does not require looping through conids.
-        trades_data = await ibkr_service._req(
+        # It does not require looping through conids. The gateway JSON is
+        # passed through untouched, so skip decoding and re-encoding it.
+        trades_json = await ibkr_service._req(
             "GET",
             "/iserver/account/trades",
-            params={"days": days}
+            params={"days": days},
+            raw=True,
         )
         
-        return trades_data
+        return Response(content=trades_json or b"[]", media_type="application/json")
 
     except Exception as exc:
         log.exception("Failed to fetch recent trades: %s", exc)
@@ -144,6 +147,8 @@ async def place_order_route(
         return await ibkr_service.place_order(accountId, orders_data)
     except Exception as e:
         log.error(e)
+    finally:
+        await ibkr_service.invalidate_account(accountId)
 
 class ConfirmationReply(BaseModel):
     confirmed: bool
@@ -154,13 +159,22 @@ async def reply_to_confirmation_route(
     reply_data: ConfirmationReply,
     ibkr_service: IBKRService = Depends(get_ibkr_service)
 ):
-    return await ibkr_service.reply_to_confirmation(reply_id, reply_data.confirmed)
+    try:
+        return await ibkr_service.reply_to_confirmation(reply_id, reply_data.confirmed)
+    finally:
+        await ibkr_service.invalidate_account()
 
 @router.delete("/orders/{order_id}", summary="Cancel an order")
 async def cancel_order_route(order_id: str, accountId: str, ibkr_service: IBKRService = Depends(get_ibkr_service)):
     # Assuming you have a way to get the current account ID
-    return await ibkr_service.cancel_order(accountId, order_id)
+    try:
+        return await ibkr_service.cancel_order(accountId, order_id)
+    finally:
+        await ibkr_service.invalidate_account(accountId)
 
 @router.post("/orders/{order_id}", summary="Modify an order")
 async def modify_order_route(order_id: str, accountId: str, new_order_data: Dict[str, Any], ibkr_service: IBKRService = Depends(get_ibkr_service)):
-    return await ibkr_service.modify_order(accountId, order_id, new_order_data)
+    try:
+        return await ibkr_service.modify_order(accountId, order_id, new_order_data)
+    finally:
+        await ibkr_service.invalidate_account(accountId)
@@ -0,0 +1,87 @@
+# routers/admin.py
+import logging
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+import cache as cache_mod
+from deps import get_ibkr_service, require_admin
+from ibkr import IBKRService
+
+log = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin/cache", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+class TagInvalidation(BaseModel):
+    tags: List[str] = Field(..., min_length=1, description='Full tag names, e.g. "account:U123:positions"')
+
+
+class PrewarmRequest(BaseModel):
+    function: str = Field(..., description='Cached method, e.g. "get_strikes_for_month" or "MarketDataMixin.get_strikes_for_month"')
+    args: List[Any] = Field(default_factory=list)
+    kwargs: Dict[str, Any] = Field(default_factory=dict)
+    refresh: bool = Field(False, description="Drop the current entry first so the gateway is asked again")
+
+
+@router.get("/namespaces", summary="Cached keys grouped by namespace")
+async def cache_namespaces(svc: IBKRService = Depends(get_ibkr_service)):
+    return {
+        "key_version": cache_mod.CACHE_KEY_VERSION,
+        "distributed": cache_mod._distributed,
+        "namespaces": await cache_mod.namespaces(),
+        "l1": cache_mod.l1.stats(),
+        "bar_series_in_memory": len(svc.bars._series),
+        "symbol_index": svc.symbols.stats(),
+    }
+
+
+@router.get("/functions", summary="Hit ratio and settings per cached function")
+async def cache_functions():
+    return cache_mod.function_stats()
+
+
+@router.get("/keys", summary="Keys under a prefix with size and remaining TTL")
+async def cache_keys(prefix: str = "", limit: int = Query(200, ge=1, le=10_000)):
+    return await cache_mod.backend_entries(cache_mod.versioned_key(prefix), limit=limit)
+
+
+@router.delete("/keys", summary="Purge every entry under a key prefix")
+async def purge_cache_prefix(
+    prefix: str = Query(..., min_length=1, description='Key prefix after the version, e.g. "IBKRService.ledger" or "bars:265598"'),
+    svc: IBKRService = Depends(get_ibkr_service),
+):
+    removed = await cache_mod.purge_prefix(prefix)
+    if prefix.startswith("bars"):
+        # The bar store keeps its own copy of each series in memory; untouched ones reload from the backend
+        svc.bars.invalidate()
+    return {"prefix": prefix, "removed": removed}
+
+
+@router.post("/invalidate", summary="Invalidate every entry carrying any of the given tags")
+async def invalidate_cache_tags(body: TagInvalidation):
+    await cache_mod.invalidate_tags(*body.tags)
+    return {"invalidated": body.tags}
+
+
+@router.post("/prewarm", summary="Fill the cache entry for one call of a cached function")
+async def prewarm_cache(body: PrewarmRequest, svc: IBKRService = Depends(get_ibkr_service)):
+    function = _resolve_function(body.function)
+    method = getattr(svc, function.rsplit(".", 1)[-1])
+    key = method.cache_key(svc, *body.args, **body.kwargs)
+    if body.refresh:
+        await cache_mod.drop_key(key)
+    try:
+        await method(*body.args, **body.kwargs)
+    except TypeError as e:
+        raise HTTPException(status_code=422, detail=f"Bad arguments for {function}: {e}")
+    return {"function": function, "key": key, "age_s": cache_mod.cache_age.get()}
+
+
+def _resolve_function(name: str) -> str:
+    if name in cache_mod.CACHED_FUNCTIONS:
+        return name
+    matches = [q for q in cache_mod.CACHED_FUNCTIONS if q.rsplit(".", 1)[-1] == name]
+    if len(matches) != 1:
+        raise HTTPException(status_code=404 if not matches else 409,
+                            detail=f"{name!r} is {'not a cached function' if not matches else f'ambiguous: {matches}'}")
+    return matches[0]
@@ -5,6 +5,7 @@ import logging
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException
 import httpx
+from barstore import NoChartData
 from utils import format_option_description, price_delta, safe_float_conversion
 from ibkr import IBKRService
 from models import ChartDataBars, ConidResponse, FilteredChainResponse, OptionContract, PositionInfo, QuoteInfo, SearchResult, SingleContractResponse, StaticInfo, StockDetailsResponse
@@ -20,23 +21,22 @@ async def history(
         period: str = "1M",
         svc: IBKRService = Depends(get_ibkr_service),
 ):
-    # --- YTD Calculation Logic ---
+    # YTD is sliced from the daily series by the bar store
     if period == "YTD":
-        today = datetime.date.today()
-        start_of_year = datetime.date(today.year, 1, 1)
-        # Calculate number of days for the 'd' period format
-        days_since_start = (today - start_of_year).days + 1 
-        period_ibkr = f"{days_since_start}d"
-        bar_ibkr = "1d"  # Daily bars for YTD
+        period_ibkr, bar_ibkr = "ytd", "1d"
     elif period in PERIOD_BAR:
         period_ibkr, bar_ibkr = PERIOD_BAR[period]
     else:
         raise HTTPException(400, "Invalid period specified")
     try:
         raw = await svc.history(conid, period=period_ibkr, bar=bar_ibkr)
+    except NoChartData:
+        raise HTTPException(404, "Chart data unavailable")
     except httpx.HTTPStatusError as exc:
         log.error("IBKR %s  → %s  %s", exc.request.url, exc.response.status_code, exc.response.text)
         raise HTTPException(exc.response.status_code, "IBKR error")
+    except HTTPException:
+        raise
     except Exception as exc:
         log.exception("unexpected /history error")
         raise HTTPException(500, "internal error")
@@ -104,6 +104,8 @@ async def get_stock_quote(conid: int, ibkr_service: IBKRService = Depends(get_ib
         "marketDataStatus": raw_data[0].get("6509_f", "unknown") # Example for status
         }
          
+    except HTTPException:
+        raise
     except Exception as e:
         log.error(e)
         raise HTTPException(status_code=500, detail="Failed to fetch historical stock data.")
@@ -115,25 +117,11 @@ async def search_securities(
     svc: IBKRService = Depends(get_ibkr_service)
 ):
     try:
-        raw_results = await svc.search(symbol=query, name=False)
-        
-        # --- THE FIX IS HERE ---
-        # Manually construct the response list to ensure correct mapping.
-        formatted_results = []
-        for item in raw_results:
-            # Skip results that don't even have a conid
-            if not item.get('conid') or int(item.get('conid')) == -1:
-                continue
-
-            formatted_results.append(
-                SearchResult(
-                    conid=item.get('conid'),
-                    symbol=item.get('symbol'),
-                    companyName=item.get('companyHeader'), 
-                    secType=item.get('secType')
-                )
-            )
-        return formatted_results
+        return [
+            SearchResult(conid=item["conid"], symbol=item["symbol"],
+                         companyName=item["companyName"], secType=item["secType"])
+            for item in await svc.search_symbols(query)
+        ]
         
     except Exception:
         log.exception("Unexpected /search error")
@@ -0,0 +1,23 @@
+# routers/metrics.py
+import logging
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from metrics import render_text, snapshot
+
+log = logging.getLogger(__name__)
+
+router = APIRouter(tags=["Metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(render_text(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.get("/metrics/json")
+async def metrics_json():
+    """Same values as /metrics, keyed by metric name; handy for quick inspection."""
+    return snapshot()
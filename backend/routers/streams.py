@@ -0,0 +1,26 @@
+# routers/streams.py
+import logging
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel, Field
+from deps import get_ibkr_service, require_admin
+from ibkr import IBKRService
+
+log = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin/streams", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+class StreamRate(BaseModel):
+    hz: float = Field(..., ge=0, le=100, description="Max updates per second per conid; 0 sends every tick")
+
+
+@router.get("", summary="Per-stream update rates and pending conflated updates")
+async def stream_rates(svc: IBKRService = Depends(get_ibkr_service)):
+    return svc.conflator.stats()
+
+
+@router.put("/{stream}", summary="Change a stream's maximum update rate")
+async def set_stream_rate(stream: str, body: StreamRate, svc: IBKRService = Depends(get_ibkr_service)):
+    svc.conflator.set_rate(stream, body.hz)
+    log.info("Stream %s now capped at %s Hz", stream, body.hz)
+    return svc.conflator.stats()
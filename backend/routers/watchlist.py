@@ -2,7 +2,7 @@ import asyncio
 from logging import log
 import logging
 from fastapi import APIRouter, Depends, HTTPException
-import httpx
+from barstore import NoChartData
 from models import HistoricalPoint, HistoricalReq, StockHistorical, WatchlistDetail
 from ibkr import IBKRService
 from deps import get_ibkr_service 
@@ -73,12 +73,10 @@ async def batch_history(req: HistoricalReq, svc: IBKRService = Depends(get_ibkr_
                 points = [{"date": r["t"] // 1000, "price": r["c"]} for r in raw["data"]]
                 return {"ticker": symbol, "historical": points}
                 
-            except httpx.HTTPStatusError as exc:
-                if exc.response.status_code == 500 and b"Chart data unavailable" in exc.response.content:
-                    log.warning(f"Chart data unavailable for {symbol}")
-                    return None
-                # Let other errors propagate up
-                raise
+            except NoChartData:
+                # Remembered by the bar store, so this symbol isn't retried on every refresh
+                log.warning(f"Chart data unavailable for {symbol}")
+                return None
 
     # Create all tasks and run them concurrently (respecting the semaphore limit)
     tasks = [fetch_history_for_symbol(symbol) for symbol in req.tickers]
@@ -0,0 +1,7 @@
+# simulator/__init__.py
+"""
+Offline stand-in for the IBKR Client Portal gateway.
+
+Used for load / latency benchmarking of IBKRService without a live,
+logged-in ``ibkr-gateway`` container. See ``simulator/gateway.py``.
+"""
@@ -0,0 +1,14 @@
+# simulator/__main__.py
+"""Entry point: ``python -m simulator`` serves the simulated gateway on SIM_PORT (5000)."""
+import os
+import uvicorn
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "simulator.gateway:app",
+        host=os.getenv("SIM_HOST", "0.0.0.0"),
+        port=int(os.getenv("SIM_PORT", "5000")),
+        ssl_keyfile=os.getenv("SIM_SSL_KEYFILE"),
+        ssl_certfile=os.getenv("SIM_SSL_CERTFILE"),
+        log_level=os.getenv("SIM_LOG_LEVEL", "warning"),
+    )
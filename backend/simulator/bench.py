@@ -0,0 +1,127 @@
+# simulator/bench.py
+"""
+Throughput / latency benchmark for IBKRService against the simulator
+(or any gateway reachable at IBKR_GATEWAY_URL).
+
+    python -m simulator.bench rest --concurrency 20 --duration 15
+    python -m simulator.bench ws --duration 15
+
+``rest`` hammers ``_req`` with a mix of the calls the routers make;
+``ws`` runs the real ``_websocket_loop`` and counts frames broadcast.
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections import defaultdict
+
+from ibkr import IBKRService
+from models import WebSocketRequest
+from simulator.gateway import ACCOUNT_ID, UNIVERSE
+
+log = logging.getLogger("ibkr.sim.bench")
+
+
+def _mix(account: str) -> list[tuple[str, str, dict]]:
+    conids = ",".join(str(c) for _, c, _, _ in UNIVERSE)
+    return [
+        ("GET", "/iserver/marketdata/snapshot", {"params": {"conids": conids, "fields": "31,55,84,86,83,82"}}),
+        ("GET", f"/portfolio/{account}/positions/0", {}),
+        ("GET", "/iserver/accounts", {}),
+        ("GET", "/iserver/marketdata/history", {"params": {"conid": 265598, "period": "1m", "bar": "2h"}}),
+        ("GET", "/iserver/secdef/search", {"params": {"symbol": "AAPL"}}),
+        ("POST", f"/iserver/account/{account}/orders/whatif", {"json": {"orders": []}}),
+    ]
+
+
+def _pct(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def bench_rest(svc: IBKRService, account: str, concurrency: int, duration: float) -> None:
+    mix = _mix(account)
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    async def worker(n: int):
+        i = n
+        while time.perf_counter() < deadline:
+            method, ep, kw = mix[i % len(mix)]
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                await svc._req(method, ep, **kw)
+                latencies[ep].append(time.perf_counter() - t0)
+            except Exception as exc:
+                errors[ep] += 1
+                log.debug("%s %s failed: %s", method, ep, exc)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"{total} ok / {sum(errors.values())} errors in {elapsed:.1f}s -> {total / elapsed:.1f} req/s")
+    print(f"{'endpoint':<45} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>5}")
+    for ep in sorted(set(latencies) | set(errors)):
+        s = latencies.get(ep, [])
+        print(f"{ep:<45} {len(s):>6} {_pct(s, .5) * 1e3:>8.1f} {_pct(s, .95) * 1e3:>8.1f} "
+              f"{_pct(s, .99) * 1e3:>8.1f} {errors.get(ep, 0):>5}")
+
+
+async def bench_ws(svc: IBKRService, account: str, duration: float) -> None:
+    counts: dict[str, int] = defaultdict(int)
+    gaps: list[float] = []
+    last = [time.perf_counter()]
+
+    async def counting_broadcast(payload: dict, account_id: str | None = None) -> None:
+        now = time.perf_counter()
+        gaps.append(now - last[0])
+        last[0] = now
+        counts[payload.get("type", "?")] += 1
+
+    svc.set_broadcast(counting_broadcast)
+    await svc.initialize_websocket_task(account)
+    await asyncio.wait_for(svc.wait_for_connection(), timeout=10.0)
+    await svc.handle_ws_command(WebSocketRequest(action="subscribe_portfolio", account_id=account))
+    await svc.handle_ws_command(WebSocketRequest(action="subscribe_stock", conid=UNIVERSE[0][1], account_id=account))
+
+    started = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - started
+    await svc.shutdown_websocket_task()
+
+    total = sum(counts.values())
+    print(f"{total} broadcasts in {elapsed:.1f}s -> {total / elapsed:.1f} msg/s")
+    for kind, n in sorted(counts.items()):
+        print(f"  {kind:<22} {n:>7}")
+    if gaps:
+        print(f"inter-message gap p50={statistics.median(gaps) * 1e3:.2f}ms p99={_pct(gaps, .99) * 1e3:.2f}ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["rest", "ws"])
+    parser.add_argument("--account", default=ACCOUNT_ID)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    svc = IBKRService()
+    try:
+        if args.mode == "rest":
+            await bench_rest(svc, args.account, args.concurrency, args.duration)
+        else:
+            await bench_ws(svc, args.account, args.duration)
+    finally:
+        await svc.http.aclose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
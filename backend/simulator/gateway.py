@@ -0,0 +1,579 @@
+# simulator/gateway.py
+"""
+Local IBKR Client Portal gateway simulator.
+
+Serves the REST endpoints the IBKRService mixins call under ``/v1/api`` and
+pushes ``smd``/``sbd``/``spl``/``smh`` frames on ``/v1/api/ws``. Responses are
+replayed from ``simulator/fixtures/<name>.json`` when a fixture exists and
+synthesised otherwise. 429s, 503s and extra latency can be injected through
+env vars or at runtime via ``POST /sim/config``.
+
+Run it (TLS is required because the backend always dials ``wss://``):
+
+    openssl req -x509 -newkey rsa:2048 -nodes -days 365 -subj "/CN=localhost" \
+        -keyout sim.key -out sim.crt
+    SIM_SSL_KEYFILE=sim.key SIM_SSL_CERTFILE=sim.crt python -m simulator
+
+then point the backend at it with ``IBKR_GATEWAY_URL=https://localhost:5000``.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+log = logging.getLogger("ibkr.sim")
+
+FIXTURES_DIR = Path(os.getenv("SIM_FIXTURES_DIR", Path(__file__).parent / "fixtures"))
+ACCOUNT_ID = os.getenv("SIM_ACCOUNT_ID", "DU1234567")
+
+
+class SimConfig(BaseModel):
+    """Fault-injection and streaming knobs. Mutable at runtime via /sim/config."""
+    latency_ms: float = float(os.getenv("SIM_LATENCY_MS", "0"))
+    jitter_ms: float = float(os.getenv("SIM_JITTER_MS", "0"))
+    error_429_rate: float = float(os.getenv("SIM_429_RATE", "0"))
+    error_503_rate: float = float(os.getenv("SIM_503_RATE", "0"))
+    retry_after: int = int(os.getenv("SIM_RETRY_AFTER", "1"))
+    ws_rate: float = float(os.getenv("SIM_WS_RATE", "20"))   # frames / second, all topics
+    positions: int = int(os.getenv("SIM_POSITIONS", "25"))
+    page_size: int = 100
+    seed: int = int(os.getenv("SIM_SEED", "42"))
+
+
+config = SimConfig()
+rng = random.Random(config.seed)
+
+# Symbol universe: (ticker, conid, company name, base price)
+UNIVERSE = [
+    ("AAPL", 265598, "APPLE INC", 190.0),
+    ("MSFT", 272093, "MICROSOFT CORP", 410.0),
+    ("NVDA", 4815747, "NVIDIA CORP", 120.0),
+    ("TSLA", 76792991, "TESLA INC", 240.0),
+    ("AMZN", 3691937, "AMAZON.COM INC", 180.0),
+    ("GOOGL", 208813719, "ALPHABET INC-CL A", 165.0),
+    ("META", 107113386, "META PLATFORMS INC-CLASS A", 500.0),
+    ("AMD", 4391, "ADVANCED MICRO DEVICES", 150.0),
+    ("SPY", 756733, "SPDR S&P 500 ETF TRUST", 550.0),
+    ("QQQ", 320227571, "INVESCO QQQ TRUST SERIES 1", 470.0),
+]
+_BY_CONID = {c: (t, c, n, p) for t, c, n, p in UNIVERSE}
+
+# Running prices, random-walked by the WS pusher and the snapshot endpoint
+_prices: Dict[int, float] = {c: p for _, c, _, p in UNIVERSE}
+
+# Per-endpoint call counters, exposed on /sim/stats
+_stats: Dict[str, int] = {}
+
+
+def _fixture(name: str) -> Optional[Any]:
+    """Return the recorded fixture ``fixtures/<name>.json`` if one exists."""
+    path = FIXTURES_DIR / f"{name}.json"
+    if not path.is_file():
+        return None
+    with path.open() as fh:
+        return json.load(fh)
+
+
+def _tick(conid: int) -> float:
+    """Random-walk the price of `conid` and return the new value."""
+    base = _prices.get(conid) or rng.uniform(10, 500)
+    price = max(0.01, base * (1 + rng.gauss(0, 0.0008)))
+    _prices[conid] = price
+    return round(price, 2)
+
+
+def _quote_fields(conid: int) -> Dict[str, Any]:
+    ticker, _, name, _ = _BY_CONID.get(conid, (str(conid), conid, str(conid), 100.0))
+    last = _tick(conid)
+    prev = _BY_CONID.get(conid, (None, None, None, last))[3]
+    change = last - prev
+    return {
+        "conid": conid,
+        "conidEx": str(conid),
+        "31": f"{last:.2f}",
+        "55": ticker,
+        "7051": name,
+        "84": f"{last - 0.01:.2f}",
+        "86": f"{last + 0.01:.2f}",
+        "82": f"{change:+.2f}",
+        "83": f"{change / prev * 100:.2f}",
+        "70": f"{max(last, prev) * 1.01:.2f}",
+        "71": f"{min(last, prev) * 0.99:.2f}",
+        "7635": f"{last:.2f}",
+        "7741": f"{prev:.2f}",
+        "6004": "NASDAQ",
+        "6119": "STK",
+        "6070": "USD",
+        "6509": "RpB",
+        "_updated": int(time.time() * 1000),
+    }
+
+
+def _positions() -> List[Dict[str, Any]]:
+    fixture = _fixture("positions")
+    if fixture is not None:
+        return fixture
+    rows = []
+    for i in range(config.positions):
+        ticker, conid, name, base = UNIVERSE[i % len(UNIVERSE)]
+        if i >= len(UNIVERSE):
+            # Pad the book with synthetic option positions on the same underlyings
+            conid = conid * 1000 + i
+            ticker = f"{ticker}   SEP2026 {int(base)} C [{ticker}  260918C{int(base * 1000):08d} 100]"
+            asset_class = "OPT"
+        else:
+            asset_class = "STK"
+        price = _prices.get(conid, base)
+        qty = float(rng.randint(1, 100))
+        avg = round(base * rng.uniform(0.7, 1.1), 2)
+        rows.append({
+            "acctId": ACCOUNT_ID,
+            "conid": conid,
+            "contractDesc": ticker,
+            "fullName": name,
+            "position": qty,
+            "mktPrice": price,
+            "mktValue": round(price * qty, 2),
+            "currency": "USD",
+            "avgCost": avg,
+            "avgPrice": avg,
+            "realizedPnl": 0.0,
+            "unrealizedPnl": round((price - avg) * qty, 2),
+            "assetClass": asset_class,
+        })
+    return rows
+
+
+_BAR_SECONDS = {"min": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "m": 30 * 86400, "y": 365 * 86400}
+
+
+def _duration(spec: str) -> int:
+    """'5min' -> 300, '2h' -> 7200, '3m' -> 7776000 …"""
+    num = "".join(ch for ch in spec if ch.isdigit()) or "1"
+    unit = spec[len(num):].lower()
+    return int(num) * _BAR_SECONDS.get(unit, 86400)
+
+
+def _history(conid: int, period: str, bar: str) -> Dict[str, Any]:
+    fixture = _fixture("history")
+    if fixture is not None:
+        return fixture
+    step = _duration(bar)
+    now = int(time.time()) // step * step
+    count = max(1, min(1000, _duration(period) // step))
+    price = _prices.get(conid, 100.0)
+    data = []
+    for i in range(count, 0, -1):
+        o = price
+        c = max(0.01, o * (1 + rng.gauss(0, 0.01)))
+        data.append({
+            "t": (now - i * step) * 1000,
+            "o": round(o, 2), "c": round(c, 2),
+            "h": round(max(o, c) * 1.005, 2), "l": round(min(o, c) * 0.995, 2),
+            "v": rng.randint(1_000, 1_000_000),
+        })
+        price = c
+    ticker = _BY_CONID.get(conid, (str(conid),))[0]
+    return {"symbol": ticker, "text": ticker, "barLength": step, "points": len(data), "data": data}
+
+
+app = FastAPI(title="IBKR gateway simulator")
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    """Adds latency and randomly answers 429/503 before hitting the handler."""
+    path = request.url.path
+    if not path.startswith("/sim/"):
+        _stats[path] = _stats.get(path, 0) + 1
+        delay = config.latency_ms + rng.uniform(0, config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        roll = rng.random()
+        if roll < config.error_429_rate:
+            return JSONResponse({"error": "Too many requests"}, status_code=429,
+                                headers={"Retry-After": str(config.retry_after)})
+        if roll < config.error_429_rate + config.error_503_rate:
+            return JSONResponse({"error": "Service Unavailable"}, status_code=503)
+    return await call_next(request)
+
+
+# ---------- simulator control ----------
+@app.get("/sim/config")
+async def get_sim_config():
+    return config
+
+
+@app.post("/sim/config")
+async def set_sim_config(update: Dict[str, Any]):
+    for key, value in update.items():
+        if key in SimConfig.model_fields:
+            setattr(config, key, type(getattr(config, key))(value))
+    return config
+
+
+@app.get("/sim/stats")
+async def get_sim_stats():
+    return _stats
+
+
+@app.post("/sim/reset")
+async def reset_sim_stats():
+    _stats.clear()
+    return {"ok": True}
+
+
+# ---------- auth / session ----------
+@app.post("/v1/api/iserver/auth/status")
+async def auth_status():
+    return _fixture("auth_status") or {"authenticated": True, "connected": True, "competing": False,
+                                       "message": "simulated"}
+
+
+@app.get("/v1/api/sso/validate")
+async def sso_validate():
+    return {"RESULT": True, "USER_ID": 1}
+
+
+@app.post("/v1/api/tickle")
+async def tickle():
+    return {"session": "simulated-session", "iserver": {"authStatus": {"authenticated": True, "connected": True}}}
+
+
+@app.post("/v1/api/logout")
+async def logout():
+    return {"status": True}
+
+
+# ---------- accounts / portfolio ----------
+@app.get("/v1/api/iserver/accounts")
+async def iserver_accounts():
+    return _fixture("iserver_accounts") or {
+        "accounts": [ACCOUNT_ID],
+        "acctProps": {ACCOUNT_ID: {"supportsFractions": True}},
+        "allowFeatures": {"allowedAssetTypes": "STK,OPT,FUT,CASH", "allowCrypto": False,
+                          "allowFXConv": True, "allowEventTrading": False},
+        "selectedAccount": ACCOUNT_ID,
+    }
+
+
+@app.get("/v1/api/portfolio/accounts")
+@app.get("/v1/api/portfolio/subaccounts")
+async def portfolio_accounts():
+    return _fixture("portfolio_accounts") or [{
+        "id": ACCOUNT_ID, "accountId": ACCOUNT_ID, "accountTitle": "Simulated Account",
+        "displayName": ACCOUNT_ID, "type": "INDIVIDUAL", "tradingType": "PMRGN",
+        "currency": "USD", "ibEntity": "IBLLC-US", "clearingStatus": "O", "isPaper": True,
+    }]
+
+
+@app.get("/v1/api/portfolio/{acct}/positions/{page}")
+async def positions(acct: str, page: int):
+    rows = _positions()
+    return rows[page * config.page_size:(page + 1) * config.page_size]
+
+
+@app.get("/v1/api/portfolio/{acct}/summary")
+async def summary(acct: str):
+    return _fixture("summary") or {
+        "netliquidation": {"amount": 125_000.0, "currency": "USD"},
+        "totalcashvalue": {"amount": 20_000.0, "currency": "USD"},
+        "buyingpower": {"amount": 80_000.0, "currency": "USD"},
+    }
+
+
+@app.get("/v1/api/portfolio/{acct}/ledger")
+async def ledger(acct: str):
+    return _fixture("ledger") or {
+        "USD": {"secondkey": "USD", "currency": "USD", "cashbalance": 20_000.0, "settledcash": 20_000.0,
+                "unrealizedpnl": 1_500.0, "dividends": 12.5, "exchangerate": 1.0},
+        "BASE": {"secondkey": "BASE", "currency": "USD", "cashbalance": 20_000.0, "settledcash": 20_000.0,
+                 "unrealizedpnl": 1_500.0, "dividends": 12.5, "exchangerate": 1.0},
+    }
+
+
+@app.get("/v1/api/portfolio/{acct}/allocation")
+async def allocation(acct: str):
+    return _fixture("allocation") or {
+        "assetClass": {"long": {"STK": 95_000.0, "OPT": 5_000.0}, "short": {}},
+        "sector": {"long": {"Technology": 80_000.0, "Consumer": 20_000.0}, "short": {}},
+        "group": {"long": {"Semiconductors": 30_000.0, "Software": 50_000.0}, "short": {}},
+    }
+
+
+@app.get("/v1/api/portfolio/{acct}/combo/positions")
+async def combo_positions(acct: str):
+    return _fixture("combo_positions") or []
+
+
+@app.get("/v1/api/acesws/{acct}/signatures-and-owners")
+async def signatures(acct: str):
+    return _fixture("signatures") or {
+        "accountId": acct,
+        "users": [{"userName": "simuser", "roleId": "OWNER", "entity": {"entityName": "Sim User"}}],
+    }
+
+
+@app.get("/v1/api/iserver/account/pnl/partitioned")
+async def pnl_partitioned():
+    return _fixture("pnl") or {"upnl": {f"{ACCOUNT_ID}.Core": {
+        "rowType": 1, "dpl": 125.5, "nl": 125_000.0, "upl": 1_500.0, "el": 110_000.0, "mv": 105_000.0}}}
+
+
+@app.get("/v1/api/iserver/account/orders")
+async def live_orders():
+    return _fixture("orders") or {"orders": [], "snapshot": True}
+
+
+@app.get("/v1/api/iserver/account/trades")
+async def trades():
+    return _fixture("trades") or []
+
+
+# ---------- orders ----------
+@app.post("/v1/api/iserver/account/{acct}/orders/whatif")
+async def whatif(acct: str):
+    return _fixture("whatif") or {"amount": {"amount": "1,900.00 USD", "commission": "1.00 USD"},
+                                  "equity": {"current": "125,000", "change": "-1", "after": "124,999"},
+                                  "warn": None, "error": None}
+
+
+@app.post("/v1/api/iserver/account/{acct}/orders")
+async def place_orders(acct: str):
+    return [{"order_id": str(rng.randint(10**8, 10**9)), "order_status": "Submitted", "encrypt_message": "1"}]
+
+
+@app.post("/v1/api/iserver/account/{acct}/order/{order_id}")
+async def modify_order(acct: str, order_id: str):
+    return [{"order_id": order_id, "order_status": "Submitted"}]
+
+
+@app.delete("/v1/api/iserver/account/{acct}/order/{order_id}")
+async def cancel_order(acct: str, order_id: str):
+    return {"msg": "Request was submitted", "order_id": order_id, "conid": -1, "account": acct}
+
+
+@app.post("/v1/api/iserver/reply/{reply_id}")
+async def reply(reply_id: str):
+    return [{"order_id": str(rng.randint(10**8, 10**9)), "order_status": "Submitted"}]
+
+
+# ---------- portfolio analyst ----------
+@app.post("/v1/api/pa/performance")
+async def pa_performance():
+    fixture = _fixture("pa_performance")
+    if fixture is not None:
+        return fixture
+    days = 252
+    dates = [time.strftime("%Y%m%d", time.gmtime(time.time() - (days - i) * 86400)) for i in range(days)]
+    navs, nav = [], 100_000.0
+    for _ in dates:
+        nav *= 1 + rng.gauss(0.0004, 0.01)
+        navs.append(round(nav, 2))
+    returns = [round(n / navs[0] - 1, 6) for n in navs]
+    return {
+        "nav": {"dates": dates, "data": [{"navs": navs}]},
+        "cps": {"dates": dates, "data": [{"returns": returns}]},
+        "tpps": {"dates": dates, "data": [{"returns": returns}]},
+    }
+
+
+@app.post("/v1/api/pa/summary")
+async def pa_summary():
+    return _fixture("pa_summary") or {}
+
+
+@app.post("/v1/api/pa/transactions")
+async def pa_transactions(payload: Dict[str, Any]):
+    fixture = _fixture("pa_transactions")
+    if fixture is not None:
+        return fixture
+    conid = (payload.get("conids") or [0])[0]
+    ticker = _BY_CONID.get(conid, (str(conid),))[0]
+    txs = [{"date": time.strftime("%a %b %d 00:00:00 EST %Y", time.gmtime(time.time() - i * 86400)),
+            "cur": "USD", "fxRate": 1, "pr": round(_prices.get(conid, 100.0), 2), "qty": rng.choice([-5, 5, 10]),
+            "acctid": ACCOUNT_ID, "amt": 0, "conid": conid, "type": rng.choice(["Buy", "Sell"]), "desc": ticker}
+           for i in range(3)]
+    return {"id": "getTransactions", "currency": "USD", "transactions": txs,
+            "rpnl": {"data": [{"date": "20250101", "cur": "USD", "fxRate": 1, "acctid": ACCOUNT_ID,
+                               "amt": round(rng.uniform(-50, 50), 2), "conid": conid}]}}
+
+
+# ---------- watchlists ----------
+@app.get("/v1/api/iserver/watchlists")
+async def watchlists():
+    return _fixture("watchlists") or {"data": {"user_lists": [
+        {"id": "100", "name": "Tech", "modified": 0, "is_open": False, "read_only": False, "type": "watchlist"}]}}
+
+
+@app.get("/v1/api/iserver/watchlist")
+async def watchlist(id: str):
+    return _fixture("watchlist") or {"id": id, "name": "Tech", "instruments": [
+        {"ticker": t, "conid": c, "name": n, "assetClass": "STK"} for t, c, n, _ in UNIVERSE[:6]]}
+
+
+# ---------- scanner ----------
+@app.get("/v1/api/iserver/scanner/params")
+async def scanner_params():
+    return _fixture("scanner_params") or {
+        "scan_type_list": [{"display_name": "Top % Gainers", "code": "TOP_PERC_GAIN", "instruments": ["STK"]}],
+        "instrument_list": [{"display_name": "US Stocks", "type": "STK", "filters": ["priceAbove"]}],
+        "filter_list": [{"group": "priceAbove", "display_name": "Price Above", "code": "priceAbove", "type": "non-range"}],
+        "location_tree": [{"display_name": "US Stocks", "type": "STK", "locations": []}],
+    }
+
+
+@app.post("/v1/api/iserver/scanner/run")
+async def scanner_run():
+    return _fixture("scanner_run") or {
+        "contracts": [{"server_id": str(i), "symbol": t, "conidex": str(c), "con_id": c, "company_name": n}
+                      for i, (t, c, n, _) in enumerate(UNIVERSE)],
+        "scan_data_column_name": "Chg%",
+    }
+
+
+# ---------- contract definitions ----------
+@app.get("/v1/api/iserver/secdef/search")
+async def secdef_search(symbol: str, secType: str = "", name: Optional[str] = None):
+    fixture = _fixture("secdef_search")
+    if fixture is not None:
+        return fixture
+    query = symbol.upper()
+    hits = [row for row in UNIVERSE if row[0].startswith(query) or query in row[2]]
+    return [{
+        "conid": str(c), "companyHeader": f"{n} - NASDAQ", "companyName": n, "symbol": t,
+        "description": "NASDAQ", "secType": secType or "STK",
+        "sections": [{"secType": "STK"}, {"secType": "OPT", "months": "SEP26;OCT26;NOV26;DEC26", "exchange": "SMART"}],
+    } for t, c, n, _ in hits]
+
+
+@app.get("/v1/api/iserver/secdef/strikes")
+async def secdef_strikes(conid: int, month: str, secType: str = "OPT"):
+    fixture = _fixture("secdef_strikes")
+    if fixture is not None:
+        return fixture
+    price = _prices.get(conid, 100.0)
+    strikes = [round(price * (1 + i / 50)) for i in range(-20, 21)]
+    return {"call": strikes, "put": strikes}
+
+
+@app.get("/v1/api/iserver/secdef/info")
+async def secdef_info(conid: int, month: str, strike: float, right: str, secType: str = "OPT"):
+    fixture = _fixture("secdef_info")
+    if fixture is not None:
+        return fixture
+    return [{"conid": abs(hash((conid, month, strike, right))) % 10**9, "symbol": _BY_CONID.get(conid, ("?",))[0],
+             "secType": "OPT", "exchange": "SMART", "strike": strike, "right": right, "maturityDate": "20260918",
+             "multiplier": "100", "currency": "USD"}]
+
+
+@app.get("/v1/api/trsrv/secdef")
+async def trsrv_secdef(conids: str):
+    return _fixture("trsrv_secdef") or {"secdef": [
+        {"conid": int(c), "ticker": _BY_CONID.get(int(c), (c,))[0], "name": _BY_CONID.get(int(c), (c, 0, c))[2],
+         "assetClass": "STK", "currency": "USD"} for c in conids.split(",") if c]}
+
+
+# ---------- market data ----------
+@app.get("/v1/api/iserver/marketdata/snapshot")
+async def snapshot(conids: str, fields: str = ""):
+    fixture = _fixture("snapshot")
+    if fixture is not None:
+        return fixture
+    wanted = set(fields.split(",")) if fields else None
+    out = []
+    for c in conids.split(","):
+        if not c:
+            continue
+        row = _quote_fields(int(c))
+        if wanted is not None:
+            row = {k: v for k, v in row.items() if k in wanted or not k[0].isdigit()}
+        out.append(row)
+    return out
+
+
+@app.get("/v1/api/iserver/marketdata/history")
+async def history(conid: int, period: str = "1w", bar: str = "15min", outsideRth: str = "true"):
+    return _history(conid, period, bar)
+
+
+# ---------- streaming ----------
+@app.websocket("/v1/api/ws")
+async def ws_stream(ws: WebSocket):
+    """
+    Minimal imitation of the gateway's streaming socket.
+    Topics subscribed via smd+/sbd+/spl+/smh+ get frames pushed round-robin
+    at ``config.ws_rate`` frames per second in total.
+    """
+    await ws.accept()
+    quotes: Set[int] = set()
+    books: Set[int] = set()
+    charts: Set[int] = set()
+    pnl_accounts: Set[str] = set()
+
+    async def reader():
+        while True:
+            msg = await ws.receive_text()
+            if msg == "tic":
+                continue
+            parts = msg.split("+")
+            head = parts[0]
+            try:
+                if head == "smd":
+                    quotes.add(int(parts[1]))
+                elif head == "umd":
+                    quotes.discard(int(parts[1]))
+                elif head == "sbd":
+                    books.add(int(parts[2]))
+                elif head == "ubd":
+                    books.clear()
+                elif head == "smh":
+                    charts.add(int(parts[1]))
+                elif head == "umh":
+                    charts.clear()
+                elif head == "spl":
+                    pnl_accounts.add(parts[1] if len(parts) > 1 else ACCOUNT_ID)
+            except (IndexError, ValueError):
+                log.debug("ignoring malformed sim command %s", msg)
+
+    def frames():
+        for conid in list(quotes):
+            row = _quote_fields(conid)
+            yield {"topic": f"smd+{conid}", **row}
+        for conid in list(books):
+            mid = _prices.get(conid, 100.0)
+            yield {"topic": f"sbd+{ACCOUNT_ID}+{conid}", "data": [
+                {"row": i, "price": f"{mid + (5 - i) * 0.01:.2f}",
+                 **({"ask": str(rng.randint(1, 900))} if i < 5 else {"bid": str(rng.randint(1, 900))})}
+                for i in range(10)]}
+        for conid in list(charts):
+            price = _tick(conid)
+            yield {"topic": f"smh+{conid}", "serverId": f"sim{conid}", "data": [{
+                "t": int(time.time()) * 1000, "o": price, "h": price, "l": price, "c": price, "v": 100}]}
+        for acct in list(pnl_accounts):
+            yield {"topic": "spl", "args": {f"{acct}.Core": {
+                "rowType": 1, "dpl": round(rng.uniform(-100, 100), 2), "nl": 125_000.0,
+                "upl": round(rng.uniform(-2000, 2000), 2), "uel": 100_000.0, "mv": 105_000.0}}}
+
+    reader_task = asyncio.create_task(reader())
+    try:
+        while not reader_task.done():
+            sent = False
+            for frame in frames():
+                await ws.send_text(json.dumps(frame))
+                sent = True
+                await asyncio.sleep(1 / max(config.ws_rate, 0.001))
+            if not sent:
+                await asyncio.sleep(0.1)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        reader_task.cancel()
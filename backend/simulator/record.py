@@ -0,0 +1,69 @@
+# simulator/record.py
+"""
+Capture fixtures from a live, logged-in gateway for the simulator to replay.
+
+    python -m simulator.record --account U1234567 --conid 265598
+
+Writes one ``fixtures/<name>.json`` per route the simulator knows about.
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+import httpx
+
+from config import GATEWAY_BASE_URL
+from simulator.gateway import FIXTURES_DIR
+
+log = logging.getLogger("ibkr.sim.record")
+
+
+def _routes(account: str, conid: int) -> list[tuple[str, str, str, dict]]:
+    """(fixture name, method, path, request kwargs) for everything worth recording."""
+    return [
+        ("auth_status", "POST", "/iserver/auth/status", {}),
+        ("iserver_accounts", "GET", "/iserver/accounts", {}),
+        ("portfolio_accounts", "GET", "/portfolio/accounts", {}),
+        ("positions", "GET", f"/portfolio/{account}/positions/0", {}),
+        ("summary", "GET", f"/portfolio/{account}/summary", {}),
+        ("ledger", "GET", f"/portfolio/{account}/ledger", {}),
+        ("allocation", "GET", f"/portfolio/{account}/allocation", {}),
+        ("signatures", "GET", f"/acesws/{account}/signatures-and-owners", {}),
+        ("pnl", "GET", "/iserver/account/pnl/partitioned", {}),
+        ("orders", "GET", "/iserver/account/orders", {}),
+        ("trades", "GET", "/iserver/account/trades", {}),
+        ("watchlists", "GET", "/iserver/watchlists", {"params": {"SC": "USER_WATCHLIST"}}),
+        ("scanner_params", "GET", "/iserver/scanner/params", {}),
+        ("secdef_search", "GET", "/iserver/secdef/search", {"params": {"symbol": "AAPL"}}),
+        ("snapshot", "GET", "/iserver/marketdata/snapshot",
+         {"params": {"conids": str(conid), "fields": "31,55,84,86,83,82,70,71,7051"}}),
+        ("history", "GET", "/iserver/marketdata/history",
+         {"params": {"conid": conid, "period": "1y", "bar": "1d", "outsideRth": "true"}}),
+        ("pa_performance", "POST", "/pa/performance", {"json": {"acctIds": [account], "period": "1Y"}}),
+    ]
+
+
+async def record(base_url: str, account: str, conid: int) -> None:
+    FIXTURES_DIR.mkdir(parents=True, exist_ok=True)
+    async with httpx.AsyncClient(base_url=base_url, verify=False, timeout=30.0,
+                                 headers={"Host": "api.ibkr.com"}) as http:
+        for name, method, path, kw in _routes(account, conid):
+            try:
+                r = await http.request(method, path, **kw)
+                r.raise_for_status()
+            except httpx.HTTPError as exc:
+                log.warning("skipping %s: %s", name, exc)
+                continue
+            (FIXTURES_DIR / f"{name}.json").write_text(json.dumps(r.json(), indent=2))
+            log.info("recorded %s (%d bytes)", name, len(r.content))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--account", required=True)
+    parser.add_argument("--conid", type=int, default=265598)
+    parser.add_argument("--base-url", default=f"{GATEWAY_BASE_URL}/v1/api")
+    args = parser.parse_args()
+    asyncio.run(record(args.base_url, args.account, args.conid))
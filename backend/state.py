@@ -4,6 +4,7 @@ import asyncio
 from typing import Optional, List, Dict, Any, Set
 from pydantic import BaseModel, Field
 from websockets.legacy.client import WebSocketClientProtocol
+from position_book import PositionBook
 
 class IBKRState(BaseModel):
     shutdown_signal: asyncio.Event = Field(default_factory=asyncio.Event)
@@ -12,6 +13,7 @@ class IBKRState(BaseModel):
     ibkr_session_token: Optional[str] = None
     ws_connected: bool = False
     positions: Dict[str, List[Dict[str, Any]]] = Field(default_factory=dict)
+    position_books: Dict[str, PositionBook] = Field(default_factory=dict)  # Key: accountId, rebuilt with positions
     accounts_fetched: bool = False
     accounts_cache: List[Dict[str, Any]] = Field(default_factory=list)
     allocation: Dict[str, Optional[dict]] = Field(default_factory=dict)
@@ -19,6 +21,8 @@ class IBKRState(BaseModel):
     chart_subscriptions: Dict[int, str] = Field(default_factory=dict)  # Key: conid, Value: serverId
     pnl_subscribed: bool = False
     portfolio_subscriptions: Set[int] = Field(default_factory=set)
+    order_fills: Dict[str, float] = Field(default_factory=dict)  # Key: orderId, Value: filled quantity seen on 'sor'
+    warmup: Dict[str, Dict[str, Any]] = Field(default_factory=dict)  # Key: accountId, Value: cache warmup progress
     
     class Config:
         arbitrary_types_allowed = True
\ No newline at end of file
@@ -0,0 +1,299 @@
+# symbol_index.py
+"""
+Local, persistent index of contracts: symbol, company name, conid, secType.
+
+Every keystroke in the search bar used to be a /iserver/secdef/search call.
+The index is fed from every secdef search response and from positions, is
+kept in a small SQLite file so it survives restarts (and is shared by the
+workers on one host), and answers
+
+* prefix queries on symbol and company name (B-tree range scans),
+* fuzzy queries through a trigram table ("aple" still finds Apple),
+* "what did the gateway answer for this exact search" – so repeated
+  lookups, including get_conid and the options routes, never leave the
+  process. Empty answers (unknown tickers) are remembered too, for the
+  shorter NEGATIVE_CACHE_TTL.
+
+Lookups are a handful of indexed reads; the gateway is only asked when the
+index has nothing authoritative for the query. Writes run one at a time in
+a worker thread on their own connection (WAL lets the loop keep reading),
+and rows whose content hasn't changed are left alone.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import NEGATIVE_CACHE_TTL, SYMBOL_INDEX_PATH, SYMBOL_QUERY_TTL
+from metrics import Counter
+
+log = logging.getLogger("ibkr.symbols")
+
+SYMBOL_LOOKUPS = Counter("ibkr_symbol_index_lookups_total", "Symbol index lookups by outcome", ("kind", "result"))
+
+MIN_SIMILARITY = 0.3   # share of the query's trigrams a fuzzy hit must contain
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS symbols (
+    conid      INTEGER PRIMARY KEY,
+    symbol     TEXT NOT NULL,
+    name       TEXT,
+    sec_type   TEXT,
+    payload    TEXT,            -- latest raw secdef search item, NULL if only seen in positions
+    held       INTEGER NOT NULL DEFAULT 0,  -- in some account's latest positions (see holdings)
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_symbol ON symbols (symbol COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS trigrams (
+    gram  TEXT NOT NULL,
+    conid INTEGER NOT NULL,
+    PRIMARY KEY (gram, conid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS holdings (
+    account_id TEXT NOT NULL,
+    conid      INTEGER NOT NULL,
+    PRIMARY KEY (account_id, conid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS queries (
+    query      TEXT PRIMARY KEY,  -- normalised search parameters
+    conids     TEXT NOT NULL,     -- JSON list, in the gateway's order
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+def trigrams(text: str) -> set:
+    """Lower-cased trigrams of each word, padded so short words and word starts count."""
+    grams = set()
+    for word in text.lower().split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def query_key(symbol: str, name: bool = False, sec_type: str = "") -> str:
+    return f"{symbol.strip().upper()}|{int(bool(name))}|{(sec_type or '').upper()}"
+
+
+def _sec_type(item: Dict[str, Any]) -> str:
+    if item.get("secType"):
+        return item["secType"]
+    sections = item.get("sections") or []
+    return sections[0].get("secType", "STK") if sections else "STK"
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    # Everything starting with `prefix` sorts in [prefix, prefix + U+FFFF)
+    return prefix + "\uffff"
+
+
+class SymbolIndex:
+    def __init__(self, path: str = SYMBOL_INDEX_PATH, query_ttl: float = SYMBOL_QUERY_TTL,
+                 negative_ttl: float = NEGATIVE_CACHE_TTL):
+        self.path = path
+        self.query_ttl = query_ttl
+        self.negative_ttl = negative_ttl
+        self._db = self._connect()
+        self._db.executescript(_SCHEMA)
+        # Flags set before holdings were tracked per account are re-derived from them
+        self._db.execute("UPDATE symbols SET held = 0 WHERE held = 1 AND conid NOT IN (SELECT conid FROM holdings)")
+        # An in-memory database exists per connection, so there it is shared
+        self._writer = self._db if path == ":memory:" else self._connect()
+        self._write_lock = asyncio.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        if self.path != ":memory:":
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def close(self) -> None:
+        if self._writer is not self._db:
+            self._writer.close()
+        self._db.close()
+
+    # ---------- feeding ----------
+    async def _write(self, fn, *args) -> None:
+        async with self._write_lock:
+            await asyncio.to_thread(fn, *args)
+
+    async def add_secdef(self, items: Iterable[Dict[str, Any]], query: Optional[str] = None) -> None:
+        """
+        Index a /iserver/secdef/search response. With `query` (see query_key)
+        the response is also remembered as the gateway's answer to it.
+        """
+        await self._write(self._add_secdef, list(items or []), query)
+
+    async def add_positions(self, account_id: str, positions: Iterable[Dict[str, Any]]) -> None:
+        """
+        Index an account's held contracts and make them its holdings; never
+        overwrites what a secdef response said about them.
+        """
+        await self._write(self._add_positions, account_id, list(positions or []))
+
+    def _add_secdef(self, items: List[Dict[str, Any]], query: Optional[str]) -> None:
+        db = self._writer
+        now = time.time()
+        conids = []
+        with self._transaction():
+            for item in items:
+                try:
+                    conid = int(item.get("conid"))
+                except (TypeError, ValueError):
+                    continue
+                if conid <= 0 or conid in conids or not item.get("symbol"):
+                    continue
+                conids.append(conid)
+                name = item.get("companyName") or item.get("companyHeader")
+                self._upsert(conid, item["symbol"], name, _sec_type(item), json.dumps(item), now)
+            if query is not None:
+                db.execute("INSERT OR REPLACE INTO queries (query, conids, fetched_at) VALUES (?, ?, ?)",
+                                 (query, json.dumps(conids), now))
+
+    def _add_positions(self, account_id: str, positions: List[Dict[str, Any]]) -> None:
+        db = self._writer
+        rows = {}
+        for pos in positions:
+            conid = pos.get("conid")
+            symbol = pos.get("ticker") or pos.get("contractDesc")
+            if conid and symbol:
+                rows[int(conid)] = (symbol, pos.get("name") or pos.get("fullName"), pos.get("assetClass") or "STK")
+        before = {r["conid"] for r in db.execute("SELECT conid FROM holdings WHERE account_id = ?", (account_id,))}
+        now = time.time()
+        with self._transaction():
+            for conid, (symbol, name, sec_type) in rows.items():
+                known = db.execute("SELECT payload FROM symbols WHERE conid = ?", (conid,)).fetchone()
+                if known is None or known["payload"] is None:
+                    self._upsert(conid, symbol, name, sec_type, None, now)
+            if before == set(rows):
+                return
+            db.execute("DELETE FROM holdings WHERE account_id = ?", (account_id,))
+            db.executemany("INSERT INTO holdings (account_id, conid) VALUES (?, ?)",
+                           [(account_id, c) for c in rows])
+            # Contracts sold out of this account lose the flag unless another account still holds them
+            changed = list(before ^ set(rows))
+            for i in range(0, len(changed), 500):
+                chunk = changed[i:i + 500]
+                db.execute(
+                    f"UPDATE symbols SET held = conid IN (SELECT conid FROM holdings) "
+                    f"WHERE conid IN ({','.join('?' * len(chunk))})", chunk)
+
+    def _upsert(self, conid: int, symbol: str, name: Optional[str], sec_type: str,
+                payload: Optional[str], now: float) -> None:
+        db = self._writer
+        known = db.execute("SELECT symbol, name, sec_type, payload FROM symbols WHERE conid = ?", (conid,)).fetchone()
+        if known is not None and tuple(known) == (symbol, name, sec_type, payload):
+            return
+        db.execute(
+            "INSERT INTO symbols (conid, symbol, name, sec_type, payload, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (conid) DO UPDATE SET symbol = excluded.symbol, name = excluded.name, "
+            "sec_type = excluded.sec_type, payload = excluded.payload, updated_at = excluded.updated_at",
+            (conid, symbol, name, sec_type, payload, now))
+        if known is not None and (known["symbol"], known["name"]) == (symbol, name):
+            return   # same text, same trigrams
+        db.execute("DELETE FROM trigrams WHERE conid = ?", (conid,))
+        db.executemany("INSERT OR IGNORE INTO trigrams (gram, conid) VALUES (?, ?)",
+                       [(g, conid) for g in trigrams(f"{symbol} {name or ''}")])
+
+    @contextmanager
+    def _transaction(self):
+        self._writer.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+        self._writer.execute("COMMIT")
+
+    # ---------- lookups ----------
+    def gateway_answer(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Raw secdef items the gateway returned for `query`, if still fresh;
+        [] when it is known to match nothing.
+        """
+        row = self._db.execute("SELECT conids, fetched_at FROM queries WHERE query = ?", (query,)).fetchone()
+        conids = json.loads(row["conids"]) if row is not None else None
+        if not conids:
+            if conids is not None and time.time() - row["fetched_at"] <= self.negative_ttl:
+                SYMBOL_LOOKUPS.inc(kind="query", result="negative_hit")
+                return []
+            SYMBOL_LOOKUPS.inc(kind="query", result="miss")
+            return None
+        if time.time() - row["fetched_at"] > self.query_ttl:
+            SYMBOL_LOOKUPS.inc(kind="query", result="miss")
+            return None
+        payloads = {}
+        marks = ",".join("?" * len(conids))
+        for r in self._db.execute(f"SELECT conid, payload FROM symbols WHERE conid IN ({marks})", conids):
+            if r["payload"] is not None:
+                payloads[r["conid"]] = json.loads(r["payload"])
+        if len(payloads) != len(conids):
+            SYMBOL_LOOKUPS.inc(kind="query", result="miss")
+            return None
+        SYMBOL_LOOKUPS.inc(kind="query", result="hit")
+        return [payloads[c] for c in conids]
+
+    def conid_for(self, symbol: str, sec_type: str = "STK") -> Optional[int]:
+        """
+        Conid for an exact symbol: the gateway's first answer to the same
+        lookup if we have it, else a held contract with that symbol. Other
+        listings of the symbol are not trusted to be the primary one.
+        """
+        answer = self.gateway_answer(query_key(symbol, sec_type=sec_type))
+        if answer:
+            return int(answer[0]["conid"])
+        row = self._db.execute(
+            "SELECT conid FROM symbols WHERE symbol = ? COLLATE NOCASE AND sec_type = ? AND held = 1 LIMIT 1",
+            (symbol.strip(), sec_type or "STK")).fetchone()
+        SYMBOL_LOOKUPS.inc(kind="conid", result="hit" if row else "miss")
+        return row["conid"] if row else None
+
+    def search(self, text: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Ranked local matches: exact symbol, symbol prefix, company-name
+        prefix, then trigram similarity.
+        """
+        text = text.strip()
+        if not text:
+            return []
+        upper = _prefix_upper_bound(text)
+        ranked: Dict[int, tuple] = {}
+
+        def take(rows, rank):
+            for r in rows:
+                if r["conid"] not in ranked:
+                    ranked[r["conid"]] = (rank, r)
+
+        take(self._db.execute("SELECT * FROM symbols WHERE symbol = ? COLLATE NOCASE LIMIT ?", (text, limit)), 0)
+        take(self._db.execute(
+            "SELECT * FROM symbols WHERE symbol >= ? COLLATE NOCASE AND symbol < ? COLLATE NOCASE "
+            "ORDER BY length(symbol), symbol LIMIT ?", (text, upper, limit)), 1)
+        take(self._db.execute(
+            "SELECT * FROM symbols WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE "
+            "ORDER BY length(name) LIMIT ?", (text, upper, limit)), 2)
+
+        grams = trigrams(text)
+        if len(ranked) < limit and len(text) >= 3 and grams:
+            marks = ",".join("?" * len(grams))
+            rows = self._db.execute(
+                f"SELECT s.*, COUNT(*) AS shared FROM trigrams t JOIN symbols s ON s.conid = t.conid "
+                f"WHERE t.gram IN ({marks}) GROUP BY t.conid ORDER BY shared DESC LIMIT ?",
+                (*grams, limit)).fetchall()
+            take((r for r in rows if r["shared"] / len(grams) >= MIN_SIMILARITY), 3)
+
+        hits = sorted(ranked.values(), key=lambda rr: rr[0])[:limit]
+        SYMBOL_LOOKUPS.inc(kind="search", result="hit" if hits else "miss")
+        return [{"conid": r["conid"], "symbol": r["symbol"], "companyName": r["name"], "secType": r["sec_type"],
+                 "exact": rank == 0} for rank, r in hits]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "symbols": self._db.execute("SELECT COUNT(*) FROM symbols").fetchone()[0],
+            "queries": self._db.execute("SELECT COUNT(*) FROM queries").fetchone()[0],
+        }
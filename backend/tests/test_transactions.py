@@ -0,0 +1,61 @@
+# tests/test_transactions.py
+import asyncio
+import json
+import os
+
+os.environ.setdefault("SYMBOL_INDEX_PATH", ":memory:")
+
+import httpx
+
+import rate_control
+from ibkr import IBKRService
+from routers.account_transactions import get_transactions
+
+ACCOUNT = "U1234567"
+CONIDS = [265598, 8314, 272093]   # paced at one call per second
+
+
+def _gateway(request: httpx.Request) -> httpx.Response:
+    path = request.url.path
+    if path.endswith(f"/portfolio/{ACCOUNT}/positions/0"):
+        return httpx.Response(200, json=[{"conid": c, "contractDesc": str(c)} for c in CONIDS])
+    if path.endswith(f"/portfolio/{ACCOUNT}/positions/1"):
+        return httpx.Response(200, json=[])
+    if path.endswith("/pa/transactions"):
+        (conid,) = json.loads(request.content)["conids"]
+        return httpx.Response(200, json={
+            "transactions": [{"conid": conid, "type": "Buy", "qty": 1}],
+            "rpnl": {"data": [{"conid": conid, "amt": 1.0}]},
+        })
+    if path.endswith("/iserver/scanner/params"):
+        return httpx.Response(200, json={"scan_type_list": []})
+    return httpx.Response(404)
+
+
+def _service() -> IBKRService:
+    svc = IBKRService()
+    svc.http = httpx.AsyncClient(base_url=svc.base_url, transport=httpx.MockTransport(_gateway))
+    return svc
+
+
+def test_transactions_cover_every_conid():
+    async def run():
+        svc = _service()
+        result = await get_transactions(accountId=ACCOUNT, days=90, ibkr_service=svc)
+        # /pa/transactions no longer shares a 15-minute budget with the other /pa and scanner endpoints
+        params = await svc._req("GET", "/iserver/scanner/params")
+        await svc.http.aclose()
+        svc.symbols.close()
+        return result, params
+
+    result, params = asyncio.run(run())
+    assert sorted(t["conid"] for t in result["transactions"]) == sorted(CONIDS)
+    assert sorted(p["conid"] for p in result["pnl"]) == sorted(CONIDS)
+    assert params == {"scan_type_list": []}
+
+
+def test_transactions_queue_instead_of_failing_fast():
+    assert rate_control.PA_TRANSACTIONS not in rate_control.FAIL_FAST_LIMITERS
+    limiters = {rate_control.resolve_limiter(ep) for ep in
+                ("/pa/performance", "/pa/summary", "/pa/transactions", "/iserver/scanner/params")}
+    assert len(limiters) == 4
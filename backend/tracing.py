@@ -0,0 +1,199 @@
+# tracing.py
+"""
+Minimal span tracing with OpenTelemetry-style names and attributes.
+
+    with span("ibkr.request", **{"http.request.method": "GET"}) as s:
+        ...
+        s.set_attribute("http.response.status_code", 200)
+
+The current span lives in a contextvar, so child spans created in awaited
+coroutines (and in tasks spawned from them) are parented automatically.
+Finished spans are buffered per trace and handed to the exporter when the
+root span ends – optionally only if the root took longer than
+TRACE_SLOW_MS, so slow requests can be explained after the fact without
+logging every call.
+
+Exporters (TRACE_EXPORTER): "none" (default, spans are no-ops),
+"console" (indented tree on the ibkr.trace logger) or "jsonl" (one JSON
+object per span appended to TRACE_FILE).
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import TRACE_EXPORTER, TRACE_FILE, TRACE_SLOW_MS
+
+log = logging.getLogger("ibkr.trace")
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "events", "status", "_token")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.events: List[dict] = []
+        self.status = "UNSET"
+        self._token = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes) -> None:
+        self.events.append({"name": name, "time_unix_nano": time.time_ns(), "attributes": attributes})
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = "ERROR"
+        self.add_event("exception", **{"exception.type": type(exc).__name__, "exception.message": str(exc)})
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.record_exception(exc)
+        elif self.status == "UNSET":
+            self.status = "OK"
+        _current.reset(self._token)
+        _finish(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events,
+        }
+
+
+class _NoopSpan:
+    """Returned by span() when tracing is disabled; every method is a no-op."""
+    trace_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+# ---------- exporters ----------
+class ConsoleExporter:
+    def export(self, spans: List[Span]) -> None:
+        children: Dict[Optional[str], List[Span]] = {}
+        for s in spans:
+            children.setdefault(s.parent_id, []).append(s)
+        lines: List[str] = []
+
+        def walk(parent_id: Optional[str], depth: int) -> None:
+            for s in sorted(children.get(parent_id, []), key=lambda x: x.start_ns):
+                attrs = " ".join(f"{k}={v}" for k, v in s.attributes.items())
+                lines.append(f"{'  ' * depth}{s.name} {s.duration_ms:.1f}ms {s.status} {attrs}".rstrip())
+                walk(s.span_id, depth + 1)
+
+        walk(None, 0)
+        log.info("trace %s\n%s", spans[0].trace_id, "\n".join(lines))
+
+
+class JsonlExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        payload = "".join(json.dumps(s.to_dict(), default=str) + "\n" for s in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(payload)
+
+
+def _build_exporter(kind: str):
+    if kind == "console":
+        return ConsoleExporter()
+    if kind == "jsonl":
+        return JsonlExporter(TRACE_FILE)
+    if kind not in ("", "none"):
+        log.warning("Unknown TRACE_EXPORTER %r, tracing disabled", kind)
+    return None
+
+
+_exporter = _build_exporter(TRACE_EXPORTER)
+_pending: Dict[str, List[Span]] = {}   # trace_id -> finished spans awaiting their root
+_MAX_PENDING_TRACES = 1000               # children that outlive their root never get flushed
+
+
+def _finish(s: Span) -> None:
+    spans = _pending.get(s.trace_id)
+    if spans is None:
+        if len(_pending) >= _MAX_PENDING_TRACES:
+            del _pending[next(iter(_pending))]
+        spans = _pending[s.trace_id] = []
+    spans.append(s)
+    if s.parent_id is not None:
+        return
+    del _pending[s.trace_id]
+    if _exporter is None or s.duration_ms < TRACE_SLOW_MS:
+        return
+    try:
+        _exporter.export(spans)
+    except Exception as e:
+        log.warning("Trace export failed: %s", e)
+
+
+# ---------- public API ----------
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def span(name: str, **attributes) -> Span | _NoopSpan:
+    """Start a child of the current span (or a new trace) – use as a context manager."""
+    if _exporter is None:
+        return _NOOP
+    return Span(name, _current.get(), attributes)
+
+
+def current_span() -> Span | _NoopSpan:
+    return _current.get() or _NOOP
+
+
+def set_exporter(exporter) -> None:
+    """Swap the exporter at runtime (None disables tracing)."""
+    global _exporter
+    _exporter = exporter
+    _pending.clear()
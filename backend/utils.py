@@ -1,11 +1,17 @@
 # utils.py
 from datetime import datetime
+import json
 import logging
 import math
 import re
 import sys
 from typing import Any
 
+try:
+    import orjson
+except ImportError:  # optional speed-up, stdlib json is the fallback
+    orjson = None
+
 def setup_logging(level="INFO"):
     logging.basicConfig(
         level=getattr(logging, level.upper(), logging.INFO),
@@ -18,6 +24,12 @@ def setup_logging(level="INFO"):
     # logging.getLogger("websockets").setLevel(logging.WARNING)
     # logging.getLogger("httpx").setLevel(logging.WARNING)
     
+def json_loads(data: bytes | str) -> Any:
+    """Decode JSON with orjson when installed, else the stdlib parser."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 def safe_float_conversion(value: Any) -> float | None:
     """Safely converts a value to a float, handling None, strings, etc."""
     if value is None: